@@ -0,0 +1,302 @@
+#!/bin/env python3
+
+# Benchmarks for the paths that grow with the size of a tree or its saves:
+#   synthetic trees (node count x fan-out x label length): building, hit-testing, raising/removing nodes,
+#   automatic layout, saving and opening the tree file, drawing the canvas offscreen (needs gi + cairo, skipped
+#   otherwise), and copying saves into/out of a tree, with and without the snapshot store.
+# Results are written as JSON ({name: value}). Names ending in _mbps are throughput (higher is better), everything
+# else is time (lower is better). With --baseline the results are compared against an earlier run and the
+# exit status is 1 if anything got slower than --threshold.
+#   benchmark.py --quick --out results.json
+#   benchmark.py --baseline baseline.json
+import argparse, contextlib, io, json, os, platform, random, shutil, sys, tempfile, time
+import snapshotstore, treecore, treedb
+from treecore import Main, Node, Objects
+
+VIEWPORT = (1280, 720)
+LEVEL_HEIGHT = 60  # Layout of synthetic trees: each level a row, nodes in a level side by side.
+NODE_SPACING = 20
+
+
+def best_of(repeat, run, setup=None):  # Shortest time of a few runs of run(), in seconds. (After an untimed setup())
+    times = []
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+# Synthetic tree: breadth first, each node with fanout subnodes, labels of label_length characters.
+# Laid out like a drawn tree: leaves side by side in depth-first order, each supernode centered over its subnodes.
+# Node boxes get a size from the label length, so no font is needed to build one.
+def make_tree(count, fanout, label_length, seed=0):
+    rng = random.Random(seed)
+    main = Main()
+    Objects.clear()
+    width = 20 + 7 * label_length
+    sub_node_ids = [list(range(i * fanout + 1, min(count, i * fanout + fanout + 1))) for i in range(count)]
+    depth = [0] * count
+    for i in range(1, count):
+        depth[i] = depth[(i - 1) // fanout] + 1
+    x = [0] * count
+    next_x = 0
+    pending = [0] if count else []
+    while pending:  # Leaves in depth-first order.
+        i = pending.pop()
+        if sub_node_ids[i]:
+            pending.extend(reversed(sub_node_ids[i]))
+        else:
+            x[i] = next_x
+            next_x += width + NODE_SPACING
+    for i in reversed(range(count)):  # Subnodes have higher ids than their supernode.
+        if sub_node_ids[i]:
+            x[i] = (x[sub_node_ids[i][0]] + x[sub_node_ids[i][-1]]) // 2
+    letters = 'abcdefghijklmnopqrstuvwxyz      '
+    for i in range(count):
+        text = ''.join(rng.choice(letters) for j in range(label_length))
+        node = Node(text, (x[i], depth[i] * LEVEL_HEIGHT), main.new_node_id())
+        node.ext_width = width
+        node.ext_height = 30
+        node.text_width = None  # Measured before it's drawn, like a node from an opened tree.
+        main.add_object(node)
+        if i:
+            Objects.nodes[(i - 1) // fanout].add_subnode(node.node_id)
+    main.drawarea_size = [max(next_x, width), (max(depth or [0]) + 1) * LEVEL_HEIGHT]
+    return main
+
+
+def canvas_points(main, count, rng):  # Points on the canvas, most of them on a node.
+    node_ids = list(main.node_id_list)
+    points = []
+    for i in range(count):
+        if i % 4:
+            node = Objects.nodes[rng.choice(node_ids)]
+            points.append((node.x + rng.random() * node.ext_width, node.y + rng.random() * node.ext_height))
+        else:
+            points.append((rng.random() * main.drawarea_size[0], rng.random() * main.drawarea_size[1]))
+    return points
+
+
+def draw_benchmarks(results, prefix, main, repeat):  # Canvas painting through the tile cache, onto an image surface.
+    try:
+        import cairo
+        import savebrancher  # Needs gi for Gtk, the painting itself is plain cairo.
+        import tilecache
+    except (ImportError, ValueError) as e:
+        print('Skipping draw benchmarks: ' + str(e), file=sys.stderr)
+        return
+    view = type('View', (object,), {'target_node_id': None, 'selected_node_ids': [], 'path_node_ids': set()})()
+    tiles = tilecache.TileCache(lambda cr, x0, y0, x1, y1: savebrancher.AppWindow.paint_area(view, cr, x0, y0, x1, y1))
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, VIEWPORT[0], VIEWPORT[1])
+    cr = cairo.Context(surface)
+    # Middle of the canvas, where a viewport is full of nodes and edges.
+    x0 = max(0, main.drawarea_size[0] // 2 - VIEWPORT[0] // 2)
+    cr.translate(-x0, 0)
+
+    def draw():
+        tiles.draw(cr, x0, 0, x0 + VIEWPORT[0], VIEWPORT[1])
+
+    start = time.perf_counter()
+    treecore.measure_nodes(main)  # First frame: measures labels and renders every tile.
+    draw()
+    results[prefix + 'draw_first_ms'] = (time.perf_counter() - start) * 1000
+
+    def cold():
+        tiles.clear()
+        draw()
+
+    results[prefix + 'draw_cold_ms'] = best_of(repeat, cold) * 1000
+    results[prefix + 'draw_cached_ms'] = best_of(repeat, draw) * 1000
+
+    # Zoomed out (boxes without labels, and shaded blocks): should cost about the same as at 100%, not more.
+    for zoom in (0.3, 0.05):
+        tiles.set_scale(zoom)
+        zx0 = max(0, main.drawarea_size[0] * zoom // 2 - VIEWPORT[0] // 2)
+        cr.identity_matrix()
+        cr.translate(-zx0, 0)
+
+        def zoomed():
+            tiles.clear()
+            tiles.draw(cr, zx0, 0, zx0 + VIEWPORT[0], VIEWPORT[1])
+
+        results[prefix + 'draw_zoom%d_ms' % round(zoom * 100)] = best_of(repeat, zoomed) * 1000
+
+
+def tree_benchmarks(results, count, fanout, label_length, tmpdir, repeat, draw):
+    prefix = 'tree/%d/fanout%d/label%d/' % (count, fanout, label_length)
+    rng = random.Random(1)
+    start = time.perf_counter()
+    main = make_tree(count, fanout, label_length)
+    results[prefix + 'build_ms'] = (time.perf_counter() - start) * 1000
+
+    points = canvas_points(main, 10000, rng)
+    results[prefix + 'hit_test_us'] = best_of(repeat, lambda: [treecore.node_at(x, y) for x, y in points]) \
+        / len(points) * 1e6
+
+    all_node_ids = list(main.node_id_list)
+    node_ids = [rng.choice(all_node_ids) for i in range(10000)]
+    results[prefix + 'bring_top_us'] = best_of(repeat, lambda: [main.bring_top(node_id) for node_id in node_ids]) \
+        / len(node_ids) * 1e6
+
+    # Every run lays out nodes scattered over the canvas; a tree that's laid out already barely changes.
+    # The grids are built again on the first search after that, timed on its own.
+    scattered = {node_id: (rng.random() * main.drawarea_size[0], rng.random() * main.drawarea_size[1])
+                 for node_id in all_node_ids}
+    results[prefix + 'layout_ms'] = best_of(repeat, lambda: treecore.layout_tree(main),
+                                            lambda: treecore.move_nodes(scattered)) * 1000
+
+    def reindex():
+        treecore.node_at(0, 0)
+        Objects.edge_grid.within(0, 0, 1, 1)
+
+    def relayout():
+        treecore.move_nodes(scattered)
+        treecore.layout_tree(main)
+
+    results[prefix + 'layout_reindex_ms'] = best_of(repeat, reindex, relayout) * 1000
+
+    if draw:
+        draw_benchmarks(results, prefix, main, repeat)
+
+    # Saving and opening, as a tree file and as a SQLite database.
+    main.tree_dirpath = tmpdir
+    main.tree_filepath = os.path.join(tmpdir, 'bench.sbr')
+    results[prefix + 'save_ms'] = best_of(repeat, lambda: treecore.save_tree(main)) * 1000
+    results[prefix + 'load_ms'] = best_of(repeat, lambda: treecore.load_tree(main.tree_filepath)) * 1000
+    main = make_tree(count, fanout, label_length)
+    main.tree_dirpath = tmpdir
+    main.tree_filepath = os.path.join(tmpdir, 'bench-%d-%d-%d.sbr' % (count, fanout, label_length))
+    main.storage = 'sqlite'
+    treedb.connect(treedb.db_path(main.tree_filepath)).apply(treecore.tree_changes(main, replace=True))
+    treecore.save_tree(main)
+    changed = node_ids[:100]
+    results[prefix + 'sqlite_save_100_ms'] = best_of(repeat, lambda: treecore.save_tree(main, changed)) * 1000
+    results[prefix + 'sqlite_load_ms'] = best_of(repeat, lambda: treecore.load_tree(main.tree_filepath)) * 1000
+
+    # Removing 1% of the nodes. (Last, it changes the tree.)
+    main = make_tree(count, fanout, label_length)
+    removed = rng.sample(list(main.node_id_list), max(1, count // 100))
+    start = time.perf_counter()
+    for node_id in removed:
+        main.remove_object(Objects.nodes[node_id])
+    results[prefix + 'remove_object_us'] = (time.perf_counter() - start) / len(removed) * 1e6
+
+
+def write_random_file(filepath, size):
+    with open(filepath, 'wb') as f:
+        block = os.urandom(1024 * 1024)
+        for offset in range(0, size, len(block)):
+            f.write(block[:size - offset])
+            block = block[1:] + block[:1]  # Every MB different, so nothing dedups within a file.
+
+
+def copy_benchmarks(results, megabytes, tmpdir, repeat):  # Copying a save into a tree and back out.
+    prefix = 'copy/%dMB/' % megabytes
+    size = megabytes * 1024 * 1024
+    srcpath = os.path.join(tmpdir, 'source.sav')
+    destpath = os.path.join(tmpdir, 'loaded.sav')
+    write_random_file(srcpath, size)
+    main = treecore.tree_for_source(srcpath)
+    os.makedirs(main.tree_dirpath, exist_ok=True)
+    store = snapshotstore.SnapshotStore(main.tree_dirpath)
+    node = Node('bench', (0, 0), 0)
+    with contextlib.redirect_stderr(io.StringIO()):
+        main.use_store = False
+        seconds = best_of(repeat, lambda: treecore.snapshot_source(main, store, node, srcpath))
+        results[prefix + 'snapshot_file_mbps'] = megabytes / seconds
+        seconds = best_of(repeat, lambda: treecore.write_save(main, store, node, destpath))
+        results[prefix + 'load_file_mbps'] = megabytes / seconds
+
+        main.use_store = True
+
+        def put():  # A new snapshot every time: change the first bytes so it doesn't dedup.
+            with open(srcpath, 'r+b') as f:
+                f.write(os.urandom(16))
+            treecore.snapshot_source(main, store, node, srcpath)
+
+        seconds = best_of(repeat, put)
+        results[prefix + 'snapshot_store_mbps'] = megabytes / seconds
+        seconds = best_of(repeat, lambda: treecore.write_save(main, store, node, destpath))
+        results[prefix + 'load_store_mbps'] = megabytes / seconds
+    shutil.rmtree(main.tree_dirpath)
+    os.remove(srcpath)
+    os.remove(destpath)
+
+
+def compare(results, baseline, threshold):  # Print changes against a baseline. Returns the names that got worse.
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline or not baseline[name]:
+            continue
+        if name.endswith('_mbps'):
+            change = baseline[name] / results[name] - 1  # Throughput: lower is slower.
+        else:
+            change = results[name] / baseline[name] - 1
+        flag = ''
+        if change > threshold:
+            flag = '  SLOWER'
+            regressions.append(name)
+        elif change < -threshold:
+            flag = '  faster'
+        print('%-52s %12.3f %12.3f %+7.1f%%%s' % (name, baseline[name], results[name], change * 100, flag),
+              file=sys.stderr)
+    return regressions
+
+
+def parse_list(text):
+    return [int(value) for value in text.split(',') if value]
+
+
+def benchmark(argv=None):
+    parser = argparse.ArgumentParser(description="SaveBrancher benchmarks.")
+    parser.add_argument('--sizes', type=parse_list, default=[1000, 10000, 100000], help="node counts")
+    parser.add_argument('--fanouts', type=parse_list, default=[2, 16])
+    parser.add_argument('--label-lengths', type=parse_list, default=[8, 48])
+    parser.add_argument('--copy-sizes', type=parse_list, default=[1, 10, 100, 500], help="save sizes in MB")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per measurement, the best one counts")
+    parser.add_argument('--quick', action='store_true', help="small trees and saves only")
+    parser.add_argument('--no-draw', action='store_true', help="skip the draw benchmarks")
+    parser.add_argument('--tmpdir', help="where to write trees and saves (default: system temp)")
+    parser.add_argument('--out', help="write the results here instead of stdout")
+    parser.add_argument('--baseline', help="results of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2, help="slowdown counted as a regression (0.2: 20%%)")
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.sizes, args.fanouts, args.label_lengths, args.copy_sizes = [1000, 10000], [4], [16], [1, 10]
+
+    results = {}
+    tmpdir = tempfile.mkdtemp(prefix='sbrbench', dir=args.tmpdir)
+    try:
+        for count in args.sizes:
+            for fanout in args.fanouts:
+                for label_length in args.label_lengths:
+                    print('Tree: %d nodes, fan-out %d, labels %d' % (count, fanout, label_length), file=sys.stderr)
+                    tree_benchmarks(results, count, fanout, label_length, tmpdir, args.repeat, not args.no_draw)
+        for megabytes in args.copy_sizes:
+            print('Copy: %dMB' % megabytes, file=sys.stderr)
+            copy_benchmarks(results, megabytes, tmpdir, args.repeat)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    report = {'python': platform.python_version(), 'platform': platform.platform(),
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=1, sort_keys=True)
+        print()
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('%d slower than the baseline.' % len(regressions), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,120 @@
+import ctypes, ctypes.util, os, select, struct, sys, threading, time
+import snapshotstore
+
+
+SETTLE_SECONDS = 0.5  # A save counts as written once the file hasn't changed for this long.
+POLL_INTERVAL = 0.5   # Seconds between looks at the file where inotify isn't available.
+
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+INOTIFY_EVENT = struct.Struct('iIII')  # Watch descriptor, mask, cookie, length of the name that follows.
+
+
+def inotify_watch(dirpath):  # File descriptor reading inotify events of a directory, or None without inotify.
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    # The directory rather than the file: games often write a new file and rename it over the old one.
+    if libc.inotify_add_watch(fd, os.fsencode(dirpath), IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+def read_events(fd):  # Names of the files in the inotify events waiting on fd.
+    names = []
+    try:
+        data = os.read(fd, 65536)
+    except BlockingIOError:
+        return names
+    offset = 0
+    while offset < len(data):
+        wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+        offset += INOTIFY_EVENT.size
+        names.append(os.fsdecode(data[offset:offset + length].rstrip(b'\0')))
+        offset += length
+    return names
+
+
+def file_signature(filepath):  # (size, mtime) of a file, or None while it isn't there.
+    try:
+        st = os.stat(filepath)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+# Watches a save file on a thread of its own and calls on_capture(content hash) once something new has been written
+# to it. Writes are collected until the file has been left alone for SETTLE_SECONDS (games often write a save in
+# several goes), and nothing is reported if the contents are the same as last time. (Or as what's expected: see expect)
+# Uses inotify on Linux, otherwise polls the file's size and mtime every POLL_INTERVAL.
+class SourceWatcher(object):
+    def __init__(self, filepath, on_capture, settle=SETTLE_SECONDS, poll_interval=POLL_INTERVAL):
+        self.filepath = filepath
+        self.on_capture = on_capture
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.known_hash = None  # Hash of the contents the file is known to have. (Hashed when the watcher starts)
+        self.inotify = False
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='SourceWatcher', daemon=True)
+        self.thread.start()
+
+    def expect(self, content_hash):  # The file is about to get these contents, which aren't a new save. (Loading one)
+        self.known_hash = content_hash
+
+    def stop(self):  # (Doesn't wait for the thread, it finishes by itself within a poll interval.)
+        self.stopping.set()
+
+    def run(self):
+        fd = inotify_watch(os.path.dirname(os.path.abspath(self.filepath)))
+        self.inotify = fd is not None
+        name = os.path.basename(self.filepath)
+        try:
+            if self.known_hash is None and file_signature(self.filepath) is not None:
+                self.known_hash = snapshotstore.hash_file(self.filepath)
+            signature = file_signature(self.filepath)
+            changed_at = None  # When the file last changed, while a write is being waited out.
+            while not self.stopping.is_set():
+                wait = self.poll_interval if changed_at is None else self.settle
+                if fd is not None:
+                    ready, _, _ = select.select([fd], [], [], wait)
+                    if ready and name in read_events(fd):
+                        signature = file_signature(self.filepath)
+                        changed_at = time.monotonic()
+                        continue
+                elif self.stopping.wait(wait):
+                    break
+                new_signature = file_signature(self.filepath)
+                if new_signature != signature:
+                    signature = new_signature
+                    changed_at = time.monotonic()
+                    continue
+                if changed_at is not None and time.monotonic() - changed_at >= self.settle:
+                    changed_at = None
+                    self.check(signature)
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    def check(self, signature):  # The file has settled, see if it's something new.
+        if signature is None:
+            return  # Deleted, nothing to capture.
+        try:
+            content_hash = snapshotstore.hash_file(self.filepath)
+        except OSError:
+            return
+        if file_signature(self.filepath) != signature:
+            return  # Written to again while it was read; checked again once that settles.
+        if content_hash == self.known_hash:
+            print('Capture: %s unchanged, skipped' % self.filepath, file=sys.stderr)
+            return
+        self.known_hash = content_hash
+        if not self.stopping.is_set():
+            self.on_capture(content_hash)
@@ -0,0 +1,29 @@
+import os
+import pytest
+import treecore
+from treecore import Objects
+
+
+# Fixtures shared by the test_*.py files next to the modules they test.
+
+
+@pytest.fixture
+def save(tmp_path):  # save(name, data): write a file into tmp_path, returns its path.
+    def save(name, data):
+        path = tmp_path / name
+        path.write_bytes(data)
+        return str(path)
+    return save
+
+
+@pytest.fixture
+def main(save):  # Empty tree for tmp_path/game.sav, made the current tree. (Its SBR directory exists, nothing else.)
+    main = treecore.tree_for_source(save('game.sav', b'save'))
+    os.makedirs(main.tree_dirpath)
+    Objects.clear()
+    return main
+
+
+@pytest.fixture
+def store(main):  # The tree's snapshot store.
+    return treecore.open_store(main)
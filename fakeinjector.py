@@ -0,0 +1,62 @@
+#!/bin/env python3
+
+# Stand-in for xdotool, for running the load hook without a game or X: SBR_INJECTOR="python3 fakeinjector.py"
+# Appends every command it gets to $FAKEINJECTOR_LOG (one per line), answers window searches with
+# $FAKEINJECTOR_WINDOW and fails commands for any window id listed in $FAKEINJECTOR_BADWINDOWS.
+# Commands can be chained on one command line like xdotool's. With $FAKEINJECTOR_BUFFERED set, script mode ("-")
+# only runs the script once stdin is closed and doesn't flush its own output, which is what xdotool may do.
+import os, subprocess, sys, time
+
+window_id = os.environ.get('FAKEINJECTOR_WINDOW', '12345')
+bad_windows = os.environ.get('FAKEINJECTOR_BADWINDOWS', '').split()
+logpath = os.environ.get('FAKEINJECTOR_LOG')
+buffered = bool(os.environ.get('FAKEINJECTOR_BUFFERED'))
+COMMANDS = ('search', 'keydown', 'keyup', 'key', 'getwindowname', 'exec')
+
+
+def record(command):
+    if logpath:
+        with open(logpath, 'a') as f:
+            f.write('%.6f %s\n' % (time.time(), command))
+
+
+def run(args):  # Returns False if the command failed.
+    record(' '.join(args))
+    if args[0] == 'exec':  # (Runs the rest of the line.)
+        args = [arg for arg in args[1:] if arg != '--sync']
+        sys.stdout.flush()
+        subprocess.run(args)
+        return True
+    if args[0] == 'search':
+        print(window_id)
+    elif any(arg in bad_windows for arg in args):
+        print('X Error of failed request: BadWindow (invalid Window parameter)', file=sys.stderr)
+        sys.stderr.flush()
+        return False
+    elif args[0] == 'getwindowname':
+        print('Fake window ' + args[-1])
+    if not buffered:
+        sys.stdout.flush()
+    return True
+
+
+def run_chain(args):  # Commands chained on one line, each starting with its name. Stops at the first that fails.
+    while args:
+        end = len(args)
+        if args[0] != 'exec':
+            end = 1
+            while end < len(args) and args[end] not in COMMANDS:
+                end += 1
+        if not run(args[:end]):
+            return False
+        args = args[end:]
+    return True
+
+
+if sys.argv[1:] == ['-']:  # Script mode: one command per line, run as they come in.
+    lines = sys.stdin.readlines() if buffered else sys.stdin
+    for line in lines:
+        if line.split():
+            run_chain(line.split())
+elif len(sys.argv) > 1:
+    sys.exit(0 if run_chain(sys.argv[1:]) else 1)
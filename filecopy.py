@@ -0,0 +1,85 @@
+import errno, os, shutil, sys, time
+try:
+    import fcntl
+except ImportError:  # Not on Linux/Unix: only the plain copy is available.
+    fcntl = None
+
+
+FICLONE = 0x40049409  # ioctl for reflink clones on btrfs/XFS. (linux/fs.h)
+STRATEGIES = ['reflink', 'copy_file_range', 'sendfile', 'copy']  # Best first.
+UNSUPPORTED = (errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EINVAL, errno.ENOSYS, errno.ENOTTY, errno.EBADF)
+
+# (source device, destination device) -> strategy that worked the last time between them.
+strategy_cache = {}
+
+
+def copy_reflink(src, dest, size):  # Shares the source's extents; no data is copied at all.
+    if fcntl is None:
+        raise OSError(errno.ENOSYS, "No fcntl")
+    fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+
+
+def copy_range(src, dest, size):  # Copies inside the kernel (and server-side on some network filesystems).
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError(errno.ENOSYS, "No copy_file_range")
+    copied = 0
+    while copied < size:
+        n = os.copy_file_range(src.fileno(), dest.fileno(), size - copied)
+        if n == 0:
+            break
+        copied += n
+
+
+def copy_sendfile(src, dest, size):
+    if not hasattr(os, 'sendfile'):
+        raise OSError(errno.ENOSYS, "No sendfile")
+    copied = 0
+    while copied < size:
+        n = os.sendfile(dest.fileno(), src.fileno(), copied, size - copied)
+        if n == 0:
+            break
+        copied += n
+
+
+def copy_plain(src, dest, size):
+    shutil.copyfileobj(src, dest, 1024 * 1024)
+
+
+COPY_FUNCTIONS = {'reflink': copy_reflink, 'copy_file_range': copy_range, 'sendfile': copy_sendfile, 'copy': copy_plain}
+
+
+def device_pair(srcpath, destpath):
+    destdir = os.path.dirname(os.path.abspath(destpath))
+    return os.stat(srcpath).st_dev, os.stat(destdir).st_dev
+
+
+# Copy a file with the cheapest method the filesystems allow, keeping metadata like shutil.copy2.
+# The method that works is remembered per pair of devices so later copies go straight to it. Returns the method used.
+# With log, the time it took goes to stderr. (stdout is left to the scripts calling this, see sbrcli.py)
+def copy_file(srcpath, destpath, log=True):
+    start = time.perf_counter()
+    pair = device_pair(srcpath, destpath)
+    size = os.path.getsize(srcpath)
+    strategies = STRATEGIES
+    if pair in strategy_cache:
+        strategies = [strategy_cache[pair]] + [s for s in STRATEGIES if s != strategy_cache[pair]]
+    with open(srcpath, 'rb') as src, open(destpath, 'wb') as dest:
+        for strategy in strategies:
+            try:
+                COPY_FUNCTIONS[strategy](src, dest, size)
+            except OSError as e:
+                if e.errno not in UNSUPPORTED or strategy == 'copy':
+                    raise
+                # Not supported here: start over with the next method.
+                src.seek(0)
+                dest.seek(0)
+                dest.truncate()
+                continue
+            break
+    shutil.copystat(srcpath, destpath)
+    strategy_cache[pair] = strategy
+    if log:
+        seconds = time.perf_counter() - start
+        print('Copied %d bytes via %s in %.3fs (%.1f MB/s)' %
+              (size, strategy, seconds, size / 1048576.0 / max(seconds, 1e-9)), file=sys.stderr)
+    return strategy
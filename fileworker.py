@@ -0,0 +1,68 @@
+import os, threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+WORKERS = 4  # Jobs run at once. Copies are mostly waiting on the disk, so a few can overlap.
+
+
+# Runs file operations (copying saves into the tree and back out, deleting them) on a thread pool, so the window
+# keeps responding while large saves are copied.
+# Every job has keys (node ids, file paths); a job waits for all earlier jobs sharing one of its keys, so a save is
+# never loaded or deleted before it's finished being written.
+# on_change(jobs, size) is called from the submitting/worker thread whenever the number of unfinished jobs
+# (and the bytes they move) changes. It's called with the lock held, so calls arrive in order; keep it short.
+class FileWorker(object):
+    def __init__(self, workers=WORKERS, on_change=None):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='FileWorker')
+        self.on_change = on_change
+        self.condition = threading.Condition()
+        self.last = {}  # Key -> Event set when the newest job with that key is done.
+        self.jobs = 0
+        self.size = 0
+
+    # Run job() in the background. on_done(result, error) is called from the worker thread afterwards.
+    def submit(self, keys, job, on_done=None, size=0):
+        done = threading.Event()
+        with self.condition:
+            # Jobs are started in submission order, so the ones waited on are already running or finished.
+            waits = [self.last[key] for key in keys if key in self.last]
+            for key in keys:
+                self.last[key] = done
+            self.jobs += 1
+            self.size += size
+            if self.on_change:
+                self.on_change(self.jobs, self.size)
+        self.pool.submit(self.run, keys, job, on_done, size, waits, done)
+
+    def run(self, keys, job, on_done, size, waits, done):
+        for event in waits:
+            event.wait()
+        result, error = None, None
+        try:
+            result = job()
+        except Exception as e:  # Reported through on_done rather than lost on the worker thread.
+            error = e
+        with self.condition:
+            for key in keys:
+                if self.last.get(key) is done:
+                    del self.last[key]
+            self.jobs -= 1
+            self.size -= size
+            if self.on_change:
+                self.on_change(self.jobs, self.size)
+            if on_done:
+                on_done(result, error)  # Before flush() can return, so flushing also means it's been queued.
+            done.set()
+            self.condition.notify_all()
+
+    def flush(self):  # Wait until every submitted job is finished.
+        with self.condition:
+            while self.jobs:
+                self.condition.wait()
+
+
+def file_size(filepath):  # Size of a file about to be copied, 0 if it's missing. (Only used for progress.)
+    try:
+        return os.path.getsize(filepath)
+    except OSError:
+        return 0
@@ -0,0 +1,72 @@
+import ast, glob, os, threading
+
+
+HOOK_DIR = '.'  # Where load hooks are looked for. (Next to savebrancher.glade, like the other files it uses.)
+DEFAULT_HOOK = 'onloadscript.py'
+HOOK_PATTERN = 'onloadscript*.py'  # Profiles: onloadscript-<name>.py
+
+
+# Load hooks are Python files run around writing a node's save out to the source file:
+#   pre_load(node, save_path, source_path, loader)   before the save is written, e.g. to pause the game.
+#   post_load(node, save_path, source_path, loader)  after, e.g. to send the emulator its load key.
+# save_path is where the node's save is written to (usually the source save), source_path the tree's source save.
+# Both are optional. Files without either are older scripts; their whole body runs after every load instead,
+# with node_id, filepath (save_path) and loader set.
+class Hook(object):
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.mtime = os.stat(filepath).st_mtime_ns
+        with open(filepath) as f:
+            tree = ast.parse(f.read(), filepath)
+        self.code = compile(tree, filepath, 'exec')
+        functions = set(node.name for node in tree.body if isinstance(node, ast.FunctionDef))
+        self.script = not functions & {'pre_load', 'post_load'}
+        self.namespace = {'__file__': filepath, '__name__': 'hook'}
+        if not self.script:  # Older scripts would load a save just by being run.
+            exec(self.code, self.namespace)
+        self.pre_load = self.namespace.get('pre_load')
+        self.post_load = self.namespace.get('post_load')
+
+    def run_pre_load(self, node, save_path, source_path, loader):
+        if self.pre_load is not None:
+            self.pre_load(node, save_path, source_path, loader)
+
+    def run_post_load(self, node, save_path, source_path, loader):
+        if self.post_load is not None:
+            self.post_load(node, save_path, source_path, loader)
+        elif self.script:
+            exec(self.code, {'loader': loader, 'node_id': node.node_id, 'filepath': save_path})
+
+
+# Compiled hooks by file name. A hook is only read and compiled again once its file changes.
+class HookCache(object):
+    def __init__(self, dirpath=HOOK_DIR):
+        self.dirpath = dirpath
+        self.hooks = {}
+        self.lock = threading.Lock()  # Hooks run on the file worker threads.
+
+    def available(self):  # File names of the hooks that can be picked, the default first.
+        names = sorted(os.path.basename(path) for path in glob.glob(os.path.join(self.dirpath, HOOK_PATTERN)))
+        if DEFAULT_HOOK in names:
+            names.remove(DEFAULT_HOOK)
+            names.insert(0, DEFAULT_HOOK)
+        return names
+
+    def path(self, name=None):  # Path of a hook file. (Also where the GUI edits it.)
+        return os.path.join(self.dirpath, name or DEFAULT_HOOK)
+
+    def get(self, name=None):
+        filepath = self.path(name)
+        mtime = os.stat(filepath).st_mtime_ns
+        with self.lock:
+            hook = self.hooks.get(filepath)
+            if hook is None or hook.mtime != mtime:
+                hook = Hook(filepath)
+                self.hooks[filepath] = hook
+            return hook
+
+
+def profile_name(name):  # Menu label of a hook file: onloadscript-mednafen.py -> mednafen
+    if name == DEFAULT_HOOK:
+        return "Default"
+    return os.path.splitext(name)[0][len('onloadscript-'):] or name
@@ -0,0 +1,73 @@
+import json, threading, time
+from collections import deque
+
+
+WINDOW = 300           # Durations kept per timer for the percentiles. (The most recent ones.)
+TRACE_EVENTS = 100000  # Events kept for exporting, the oldest are dropped first.
+
+
+# Timers for finding out where the time goes (drawing, clicks, saving, copying and loading saves).
+# Recording is off until enabled; add() is then just a flag check, so timers can stay in the code.
+# Each timer keeps its last WINDOW durations for percentiles, and every timing is kept as an event that can be
+# exported as a Chrome trace (chrome://tracing, Perfetto). add() can be called from any thread.
+class Recorder(object):
+    def __init__(self, window=WINDOW, trace_events=TRACE_EVENTS):
+        self.enabled = False
+        self.window = window
+        self.series = {}     # Timer name -> deque of durations in ms.
+        self.last_args = {}  # Timer name -> args of its last timing. (E.g. nodes drawn)
+        self.events = deque(maxlen=trace_events)  # (name, start, end, thread id, args)
+        self.threads = {}    # Thread id -> name, for the trace.
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+
+    def add(self, name, start, end=None, **args):  # Record a timing that started at start. (time.perf_counter())
+        if not self.enabled:
+            return
+        if end is None:
+            end = time.perf_counter()
+        series = self.series.get(name)
+        if series is None:
+            with self.lock:
+                series = self.series.setdefault(name, deque(maxlen=self.window))
+        series.append((end - start) * 1000)
+        self.last_args[name] = args
+        thread_id = threading.get_ident()
+        if thread_id not in self.threads:
+            self.threads[thread_id] = threading.current_thread().name
+        self.events.append((name, start, end, thread_id, args))
+
+    def clear(self):
+        with self.lock:
+            self.series = {}
+            self.last_args = {}
+            self.events.clear()
+
+    def percentiles(self, name, points=(50, 90, 99)):  # Durations (ms) at the percentiles, or None before any timing.
+        values = sorted(self.series.get(name, ()))
+        if not values:
+            return None
+        return [values[min(len(values) - 1, int(len(values) * point / 100))] for point in points]
+
+    def summary(self):  # One line per timer: count, p50/p90/p99/max in ms and the args of the last timing.
+        lines = []
+        for name in sorted(self.series):
+            values = self.series[name]
+            p50, p90, p99 = self.percentiles(name)
+            args = ' '.join('%s=%s' % item for item in sorted(self.last_args.get(name, {}).items()))
+            lines.append('%-9s %5d %7.1f %7.1f %7.1f %7.1f  %s' % (name, len(values), p50, p90, p99, max(values), args))
+        if lines:
+            lines.insert(0, '%-9s %5s %7s %7s %7s %7s' % ('ms', 'n', 'p50', 'p90', 'p99', 'max'))
+        return lines
+
+    def trace(self):  # Events in Chrome's trace event format.
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': thread_id, 'args': {'name': name}}
+                  for thread_id, name in list(self.threads.items())]
+        for name, start, end, thread_id, args in list(self.events):
+            events.append({'name': name, 'ph': 'X', 'pid': 1, 'tid': thread_id,
+                           'ts': (start - self.origin) * 1e6, 'dur': (end - start) * 1e6, 'args': args})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def export(self, filepath):
+        with open(filepath, 'w') as f:
+            json.dump(self.trace(), f)
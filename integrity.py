@@ -0,0 +1,251 @@
+import json, os, re, time
+from concurrent.futures import ThreadPoolExecutor
+import persistence, snapshotstore, treecore
+from treecore import Objects
+
+
+MANIFEST_FILENAME = 'manifest.json'  # Checksums of the tree's saves as of the last verify. (In the tree's directory)
+RECOVERED_GAP = 40  # Space between recovered nodes, placed in a row below the tree.
+TEMP_GRACE = 60  # Seconds since its last write before a temp file counts as left over, not as a write in progress.
+WORKERS = min(32, (os.cpu_count() or 1) + 4)  # Files hashed at once. Hashing and decompressing mostly run outside the GIL.
+
+
+# What verify found. Paths are relative to the tree's directory.
+class Report(object):
+    def __init__(self):
+        self.missing = []   # (node id or None, path) of saves the tree needs that aren't there.
+        self.orphaned = []  # (node id or None, path) of files the tree doesn't use. (Node id: of a node file nobody has)
+        self.corrupt = []   # (path, reason)
+        self.files = 0      # Files looked at.
+        self.hashed = 0     # Files read, the others were unchanged since the manifest.
+        self.hashed_bytes = 0
+        self.seconds = 0.0
+
+    def ok(self):
+        return not (self.missing or self.orphaned or self.corrupt)
+
+    def lines(self):
+        lines = []
+        for node_id, path in self.missing:
+            lines.append('missing   %s%s' % (path, '' if node_id is None else '  (node %d)' % node_id))
+        for node_id, path in self.orphaned:
+            lines.append('orphaned  %s' % path)
+        for path, reason in self.corrupt:
+            lines.append('corrupt   %s  (%s)' % (path, reason))
+        lines.append('%d files, %d hashed (%.1f MB) in %.2fs: %d missing, %d orphaned, %d corrupt' %
+                     (self.files, self.hashed, self.hashed_bytes / 1048576.0, self.seconds,
+                      len(self.missing), len(self.orphaned), len(self.corrupt)))
+        return lines
+
+
+def manifest_path(main):
+    return os.path.join(main.tree_dirpath, MANIFEST_FILENAME)
+
+
+def read_manifest(main):  # {path: [size, mtime_ns, sha256]}, empty if there's none yet (or it's unreadable).
+    try:
+        with open(manifest_path(main)) as f:
+            return json.load(f)['files']
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def write_manifest(main, files):
+    persistence.write_atomic(manifest_path(main), json.dumps({'files': files}, sort_keys=True, indent=0).encode('utf-8'))
+
+
+# Snapshots the nodes need, including the bases of deltas. {hash: hash of its delta base, None for keyframes}
+def referenced_snapshots(store, snapshots):
+    referenced = {}
+    pending = [snapshot for snapshot in snapshots if snapshot]
+    while pending:
+        snapshot = pending.pop()
+        if snapshot in referenced:
+            continue
+        referenced[snapshot] = None
+        if store.exists(snapshot):
+            try:
+                dmap = store.delta_map(snapshot)
+            except Exception:  # Unreadable delta; reported when it's hashed.
+                continue
+            if dmap is not None:
+                referenced[snapshot] = dmap.base
+                pending.append(dmap.base)
+    return referenced
+
+
+def dependents(referenced, snapshots):  # The snapshots and every delta built on them, directly or further down a chain.
+    built_on = {}
+    for snapshot, base in referenced.items():
+        if base is not None:
+            built_on.setdefault(base, []).append(snapshot)
+    found = set()
+    pending = list(snapshots)
+    while pending:
+        snapshot = pending.pop()
+        if snapshot not in found:
+            found.add(snapshot)
+            pending.extend(built_on.get(snapshot, ()))
+    return found
+
+
+def leftover_temp(filepath):  # Whether a .tmp file is from a write that never finished.
+    try:
+        return time.time() - os.stat(filepath).st_mtime > TEMP_GRACE
+    except FileNotFoundError:  # Renamed into place just now.
+        return False
+
+
+def parse_object(filename):  # Snapshot hash of an object file's name, or None if it isn't one.
+    snapshot, rest = filename[:64], filename[64:]
+    if not re.match('[0-9a-f]{64}$', snapshot):
+        return None
+    if rest.startswith('.delta'):
+        rest = rest[6:]
+    if rest and rest not in [suffix for suffix, opener in snapshotstore.CODECS.values()]:
+        return None
+    return snapshot
+
+
+# Check a tree's directory against the tree: every node's save is there, nothing else is, and every save still has
+# the contents it had. Objects in the snapshot store are checked against their hash (deltas rebuilt from their
+# chain), node files against the manifest. Files whose size and mtime haven't changed since the manifest was written
+# aren't read again unless full is set, or they're deltas built on an object that is read again (or missing): a delta
+# is only as good as the chain below it. Everything else is hashed in parallel.
+# Returns (Report, manifest files) where the manifest has the files that checked out, for write_manifest.
+def verify(main, store, full=False, workers=WORKERS):
+    start = time.perf_counter()
+    report = Report()
+    manifest = read_manifest(main)
+    node_file = re.compile(re.escape(main.source_filename) + r'\.(\d+)$')
+    nodes = Objects.nodes
+    checks = []  # (path, full path, stat, node id, snapshot) of every save found.
+    found = set()
+    for entry in os.scandir(main.tree_dirpath):
+        match = node_file.match(entry.name)
+        if entry.name.endswith('.tmp'):  # (Written by persistence.write_atomic and the snapshot store.)
+            if leftover_temp(entry.path):
+                report.orphaned.append((None, entry.name))
+        elif match and entry.is_file():
+            node_id = int(match.group(1))
+            found.add(node_id)
+            node = nodes.get(node_id)
+            if node is None or getattr(node, 'snapshot', None):
+                report.orphaned.append((None if node is not None else node_id, entry.name))
+            else:
+                checks.append((entry.name, entry.path, entry.stat(), node_id, None))
+    for node_id in main.node_id_list:
+        if not getattr(nodes[node_id], 'snapshot', None) and node_id not in found:
+            report.missing.append((node_id, os.path.basename(treecore.node_filepath(main, node_id))))
+
+    referenced = referenced_snapshots(store, [getattr(nodes[node_id], 'snapshot', None) for node_id in main.node_id_list])
+    stored = set()
+    for dirpath, dirnames, filenames in os.walk(store.dirpath):
+        for filename in filenames:
+            filepath = os.path.join(dirpath, filename)
+            path = os.path.relpath(filepath, main.tree_dirpath)
+            snapshot = parse_object(filename)
+            if filename.endswith('.tmp'):
+                if leftover_temp(filepath):
+                    report.orphaned.append((None, path))
+            elif snapshot not in referenced:
+                report.orphaned.append((None, path))
+            else:
+                stored.add(snapshot)
+                checks.append((path, filepath, os.stat(filepath), None, snapshot))
+    snapshot_nodes = {}
+    for node_id in main.node_id_list:
+        snapshot_nodes.setdefault(getattr(nodes[node_id], 'snapshot', None), node_id)
+    for snapshot in referenced:
+        if snapshot not in stored:
+            report.missing.append((snapshot_nodes.get(snapshot), os.path.relpath(store.object_path(snapshot), main.tree_dirpath)))
+
+    unchanged = set()
+    for path, filepath, st, node_id, snapshot in checks:
+        entry = manifest.get(path)
+        if not full and entry is not None and entry[:2] == [st.st_size, st.st_mtime_ns]:
+            unchanged.add(path)
+    stale = dependents(referenced, [snapshot for path, filepath, st, node_id, snapshot in checks
+                                    if snapshot is not None and path not in unchanged] +
+                       [snapshot for snapshot in referenced if snapshot not in stored])
+    files = {}
+    pending = []
+    for path, filepath, st, node_id, snapshot in checks:
+        if path in unchanged and snapshot not in stale:
+            files[path] = manifest[path]  # Unchanged since it was last checked.
+        else:
+            pending.append((path, filepath, st, snapshot))
+
+    def check(job):
+        path, filepath, st, snapshot = job
+        try:
+            if snapshot is None:
+                return job, snapshotstore.hash_file(filepath), None
+            return job, store.content_hash(snapshot), None
+        except Exception as e:
+            return job, None, e
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='Verify') as pool:
+        for (path, filepath, st, snapshot), content_hash, error in pool.map(check, pending):
+            report.hashed += 1
+            report.hashed_bytes += st.st_size
+            entry = manifest.get(path)
+            if error is not None:
+                report.corrupt.append((path, str(error) or type(error).__name__))
+            elif snapshot is not None and content_hash != snapshot:
+                report.corrupt.append((path, "contents don't match the hash"))
+            elif snapshot is None and entry is not None and entry[2] != content_hash:
+                report.corrupt.append((path, "changed since it was last verified"))  # Node saves are never rewritten.
+            else:
+                files[path] = [st.st_size, st.st_mtime_ns, content_hash]
+                continue
+            if entry is not None:
+                files[path] = entry  # Still what it should be, so it's found again next time.
+    report.files = len(checks) + len(report.orphaned)
+    report.seconds = time.perf_counter() - start
+    return report, files
+
+
+# Reconcile the tree with its directory after verify: node files nobody has are taken in again as nodes (in a row
+# below the tree, labelled "Recovered <id>"), other orphans are moved to the trash. With prune, nodes whose saves
+# are missing or corrupt are removed, and so are nodes whose snapshot is a delta with a missing or corrupt object
+# anywhere down its chain. (Their subnodes become roots.) Returns (changed node ids, treecore.Removal).
+def repair(main, store, report, prune=False):
+    bottom = max([node.y + node.ext_height for node in Objects.nodes.values()] or [0])
+    recovered = []
+    trash_dirpath = os.path.join(main.tree_dirpath, treecore.TRASH_DIRNAME, 'orphans.%d' % time.time())
+    for node_id, path in report.orphaned:
+        if node_id is not None and node_id not in Objects.nodes:
+            node = treecore.Node('Recovered %d' % node_id, (20 + len(recovered) * RECOVERED_GAP, bottom + RECOVERED_GAP), node_id)
+            node.text_width = None  # Sized to its label when the GUI first draws it.
+            main.add_object(node)
+            main.next_node_id = max(main.next_node_id, node_id)
+            recovered.append(node_id)
+        else:
+            os.makedirs(os.path.dirname(os.path.join(trash_dirpath, path)), exist_ok=True)
+            os.replace(os.path.join(main.tree_dirpath, path), os.path.join(trash_dirpath, path))
+    removed = []
+    if prune:
+        node_file = re.compile(re.escape(main.source_filename) + r'\.(\d+)$')
+        removed = []
+        bad = set()  # Snapshots that can't be rebuilt from their own object.
+        for node_id, path in report.missing:
+            snapshot = parse_object(os.path.basename(path))
+            if snapshot is not None:
+                bad.add(snapshot)
+            elif node_id is not None:
+                removed.append(node_id)
+        for path, reason in report.corrupt:
+            match = node_file.match(path)
+            if match:
+                removed.append(int(match.group(1)))
+            else:
+                bad.add(parse_object(os.path.basename(path)))
+        if bad:
+            referenced = referenced_snapshots(store, [getattr(Objects.nodes[node_id], 'snapshot', None)
+                                                      for node_id in main.node_id_list])
+            broken = dependents(referenced, bad)
+            removed.extend(node_id for node_id in main.node_id_list
+                           if getattr(Objects.nodes[node_id], 'snapshot', None) in broken)
+    removal = treecore.remove_nodes(main, removed)
+    return recovered + removal.linked_ids(), removal
@@ -0,0 +1,126 @@
+import itertools, os, queue, shlex, subprocess, sys, threading, time
+
+
+INJECTOR = os.environ.get('SBR_INJECTOR', 'xdotool')  # Command that finds windows and sends keys. (See fakeinjector.py)
+REPLY_TIMEOUT = 2.0  # Seconds to wait for the injector to finish a batch of commands.
+PROBE_TIMEOUT = 0.5  # Seconds a newly started injector gets to show it runs commands as they come in.
+
+
+class InjectorError(Exception):
+    pass
+
+
+# Sends keys to the game/emulator window for the load hook through one long-running injector process
+# ("xdotool -", running commands as it reads them from stdin) instead of starting xdotool for every step.
+# Every batch of commands ends with the injector running "echo <token>", so the batch is known to be done once the
+# token comes back; nothing depends on when the injector itself flushes its output. An injector that only runs its
+# script once stdin is closed never sends the token back for the probe run when it's started, and the keys are sent
+# by starting it for every key press instead (all commands of a press chained on one command line).
+# Window ids are looked up once per window class and only looked up again after sending to them fails.
+class Loader(object):
+    def __init__(self, injector=INJECTOR):
+        self.injector = shlex.split(injector)
+        self.process = None
+        self.replies = None  # Queue of lines from the running injector, None once it's stopped. (stdout and stderr)
+        self.script_mode = None  # Whether the injector runs commands from stdin as they come in. (None: not tried yet)
+        self.tokens = itertools.count(1)
+        self.windows = {}  # Window class name -> window id.
+        self.lock = threading.Lock()  # Loads can finish on several worker threads at once.
+        self.last_inject = None  # Seconds the last key press took, including any window lookup.
+
+    def find_window(self, classname):
+        if classname not in self.windows:
+            result = subprocess.run(self.injector + ['search', '--classname', classname],
+                                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=REPLY_TIMEOUT)
+            window_ids = result.stdout.split()
+            if not window_ids:
+                raise InjectorError("No window found with class name: " + classname)
+            self.windows[classname] = window_ids[0].decode('ascii')
+        return self.windows[classname]
+
+    def start(self):
+        # Errors go into the same pipe as the output, so they arrive before the token of the batch they're from.
+        self.process = subprocess.Popen(self.injector + ['-'], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT, universal_newlines=True, bufsize=1)
+        self.replies = queue.Queue()
+        threading.Thread(target=self.read_replies, args=(self.process.stdout, self.replies), daemon=True).start()
+        if self.script_mode is None:
+            try:
+                self.send([], PROBE_TIMEOUT)
+                self.script_mode = True
+            except InjectorError:
+                self.stop()
+                self.script_mode = False
+                print("Injector doesn't run commands as they come in; starting it for every key press instead.", file=sys.stderr)
+
+    def read_replies(self, stream, replies):
+        for line in stream:
+            replies.put(line.rstrip('\n'))
+        replies.put(None)
+
+    def stop(self):
+        if self.process is not None:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+            self.process.terminate()
+            self.process = None
+
+    # Run commands on the running injector and wait until they're done. Anything else it prints (window names,
+    # warnings) is ignored, unless it says a window doesn't exist (a stale window id).
+    def send(self, commands, timeout=REPLY_TIMEOUT):
+        while not self.replies.empty():  # Anything left over from before belongs to earlier commands.
+            self.replies.get_nowait()
+        token = 'sbr-done-%d' % next(self.tokens)
+        try:
+            self.process.stdin.write('\n'.join(commands + ['exec --sync echo ' + token]) + '\n')
+            self.process.stdin.flush()
+        except OSError as e:
+            raise InjectorError("Injector stopped: " + str(e))
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                line = self.replies.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                raise InjectorError("Injector didn't answer.")
+            if line == token:
+                return
+            if line is None:
+                raise InjectorError("Injector stopped.")
+            if 'BadWindow' in line:
+                raise InjectorError(line)
+
+    def run_once(self, commands):  # Run commands with an injector started for them. (When it can't run a script.)
+        args = []
+        for command in commands:
+            args.extend(shlex.split(command))
+        result = subprocess.run(self.injector + args, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                universal_newlines=True, timeout=REPLY_TIMEOUT)
+        if result.returncode != 0 or 'BadWindow' in result.stderr:
+            raise InjectorError(result.stderr.strip() or "Injector failed with exit status %d." % result.returncode)
+        for line in result.stderr.splitlines():
+            print('Injector: ' + line, file=sys.stderr)
+
+    def press(self, classname, key):  # Press and release a key in a window. Looks the window up again once if that fails.
+        start = time.perf_counter()
+        with self.lock:
+            for attempt in range(2):
+                try:
+                    window_id = self.find_window(classname)
+                    commands = ['keydown --window %s %s' % (window_id, key),
+                                'keyup --window %s %s' % (window_id, key),
+                                'getwindowname %s' % window_id]  # Fails for a stale id.
+                    if self.script_mode is not False and (self.process is None or self.process.poll() is not None):
+                        self.start()
+                    if self.script_mode:
+                        self.send(commands)
+                    else:
+                        self.run_once(commands)
+                    break
+                except InjectorError:
+                    self.windows.pop(classname, None)
+                    self.stop()
+                    if attempt:
+                        raise
+            self.last_inject = time.perf_counter() - start
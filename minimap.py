@@ -0,0 +1,51 @@
+import tilecache
+
+
+MINIMAP_WIDTH = 240  # Largest size of the minimap on screen; the canvas is scaled to fit, keeping its proportions.
+MINIMAP_HEIGHT = 160
+MINIMAP_TILE = 64
+
+
+# Overview of the whole canvas in a corner of the window, with the visible part outlined.
+# Rendered through its own small tile cache at the overview's scale, so a change only re-renders the few tiles
+# it touches; paint(cr, x0, y0, x1, y1) is the canvas painter (see TileCache), which picks what to draw
+# from the scale it's painting at.
+class Minimap(object):
+    def __init__(self, paint, width=MINIMAP_WIDTH, height=MINIMAP_HEIGHT):
+        self.width = width
+        self.height = height
+        self.tiles = tilecache.TileCache(paint, MINIMAP_TILE, 4 * width * height * 4)
+        self.extent = (1, 1)  # Canvas size it's scaled for.
+
+    def fit(self, canvas_w, canvas_h):  # Scale to show a canvas of this size.
+        self.extent = (max(1, canvas_w), max(1, canvas_h))
+        self.tiles.set_scale(min(self.width / self.extent[0], self.height / self.extent[1]))
+
+    def size(self):  # Size on screen. (w, h)
+        s = self.tiles.scale
+        return int(self.extent[0] * s) + 1, int(self.extent[1] * s) + 1
+
+    def invalidate(self, x, y, w, h):  # Part of the canvas changed. (Canvas coordinates)
+        self.tiles.invalidate(x, y, w, h)
+
+    def draw(self, cr, x, y, view):  # Draw with the top left at (x, y); view is the visible canvas area (x, y, w, h).
+        w, h = self.size()
+        s = self.tiles.scale
+        cr.save()
+        cr.translate(x, y)
+        cr.rectangle(0, 0, w, h)
+        cr.clip()
+        self.tiles.draw(cr, 0, 0, w, h)
+        cr.set_source_rgba(1, 1, 1, 0.8)
+        cr.set_line_width(1)
+        vx, vy, vw, vh = view
+        cr.rectangle(int(vx * s) + 0.5, int(vy * s) + 0.5, max(2, int(vw * s)), max(2, int(vh * s)))
+        cr.stroke()
+        cr.set_source_rgba(0.098039215, 0.4, 1, 1.0)
+        cr.rectangle(0.5, 0.5, w - 1, h - 1)
+        cr.stroke()
+        cr.restore()
+
+    def to_canvas(self, x, y):  # Canvas point at a point on the minimap.
+        s = self.tiles.scale
+        return x / s, y / s
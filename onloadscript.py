@@ -1,15 +1,9 @@
-import subprocess
+# Load hook: sends the load key to the game/emulator window after a save has been written out. (See hooks.py)
 
-# Exe name and load key.
+# Window class name and load key.
 processname = 'mednafen'
 xdotoolkey = 'F7'
 
-proc = subprocess.Popen('xdotool search --classname '+processname, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True)
-res = proc.communicate()[0] #   Return result and end process.
-res = res[:-1]
-windowid = res.decode('ascii')
 
-proc3 = subprocess.Popen('xdotool keydown --window '+ windowid + ' ' + xdotoolkey, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True)
-res = proc3.communicate()[0] #  ..
-proc4 = subprocess.Popen('xdotool keyup --window '+ windowid + ' ' + xdotoolkey, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True)
-res = proc4.communicate()[0] #  ..
+def post_load(node, save_path, source_path, loader):
+    loader.press(processname, xdotoolkey)
@@ -0,0 +1,79 @@
+import os, threading
+from collections import OrderedDict
+
+
+def write_atomic(filepath, data):  # Replace a file's contents so it's never left half written, even after a crash.
+    temppath = '%s.%d.tmp' % (filepath, threading.get_ident())  # Writers on different threads never share a temp file.
+    with open(temppath, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temppath, filepath)
+    try:  # Make the rename itself durable.
+        dirfd = os.open(os.path.dirname(os.path.abspath(filepath)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dirfd)
+    except OSError:
+        pass
+    finally:
+        os.close(dirfd)
+
+
+# Writes tree files on a background thread. Only the newest submitted state of each file is written, so a burst of
+# submissions while a write is in progress turns into a single write afterwards.
+# encode(state) turns a submitted state into bytes; on_error(filepath, exception) and on_saved(filepath)
+# are called from the writer thread. For states that aren't written as a whole file, apply(filepath, state)
+# writes one instead and merge(older, newer) combines a state with one still waiting, instead of replacing it.
+class TreeWriter(object):
+    def __init__(self, encode=None, on_error=None, on_saved=None, apply=None, merge=None):
+        self.encode = encode
+        self.on_error = on_error
+        self.on_saved = on_saved
+        self.apply = apply
+        self.merge = merge
+        self.condition = threading.Condition()
+        self.pending = OrderedDict()  # Filepath -> newest state waiting to be written.
+        self.writing = False
+        self.thread = threading.Thread(target=self.run, name='TreeWriter', daemon=True)
+        self.thread.start()
+
+    def submit(self, filepath, state):
+        with self.condition:
+            if self.merge is not None and filepath in self.pending:
+                state = self.merge(self.pending[filepath], state)
+            self.pending[filepath] = state
+            self.condition.notify_all()
+
+    def write(self, filepath, state):  # Write right away on the calling thread. Returns the exception or None.
+        try:
+            if self.apply is not None:
+                self.apply(filepath, state)
+            else:
+                write_atomic(filepath, self.encode(state))
+        except Exception as e:  # Reported through on_error/the return value rather than lost on the writer thread.
+            return e
+        return None
+
+    def flush(self):  # Wait until everything submitted so far is on disk.
+        with self.condition:
+            while self.pending or self.writing:
+                self.condition.wait()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                filepath, state = self.pending.popitem(last=False)
+                self.writing = True
+            error = self.write(filepath, state)
+            if error is not None:
+                if self.on_error:
+                    self.on_error(filepath, error)
+            elif self.on_saved:
+                self.on_saved(filepath)
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
@@ -1,87 +1,75 @@
 #!/bin/env python3
 
+import time
+startup_start = time.perf_counter()  # For --startup-times.
 import gi
 gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk
 from gi.repository import Gdk
 from gi.repository import Gio
-import cairo, math, os, shutil
-import pickle, json, csv
+from gi.repository import GLib
+import cairo, math, os, sys
+from collections import deque
+import capture, fileworker, hooks, instrument, loader, minimap, persistence, snapshotstore, textlayout, tilecache, treecore, treedb, treefile
+from treecore import Main, Node, Objects
+
+
+Objects.layouts = textlayout.LayoutCache()  # Measured node texts. (Kept between trees.)
+
+SAVE_DELAY = 500  # Milliseconds changes are collected for before the tree file is written.
+OVERLAY_INTERVAL = 500  # Milliseconds between updates of the timing overlay.
+ZOOM_STEP = 1.25  # Zoom per ctrl+wheel step. Zoom is ZOOM_STEP ** level.
+MIN_ZOOM_LEVEL = -18  # About 2%: grid cells are still a couple of pixels.
+MAX_ZOOM_LEVEL = 6
+# Level of detail, by zoom: less is drawn the further out, so painting costs about the same at any zoom.
+TEXT_ZOOM = 0.5    # Below: no labels or arrowheads, nodes are plain boxes.
+POINT_ZOOM = 0.2   # Below: nodes are points.
+BLOCK_ZOOM = 0.08  # Below: no nodes or edges, areas are shaded by how many nodes are in them.
+SUBTREE_REGIONS = 64  # Dragging a bigger subtree than this redraws everything instead of each node's region.
+UNDO_SECONDS = 30  # Removed nodes can be put back (ctrl+z) for this long, then their saves are deleted.
 
+main = Main()
 
-# Everything refers to objects by id so they can be saved as json. Here we keep the references to the actual objects.
-class Objects(object):
-    nodes = {}
+# Timings of drawing, clicks, saves and copies. Recorded while the overlay is shown (p), or from the start with --perf.
+perf = instrument.Recorder()
+perf.enabled = '--perf' in sys.argv
 
 
-class Main(object):
-    def __init__(self):
-        self.node_id_list = []  # List of node ids (referencable in the Objects.nodes list)
-        self.next_node_id = -1
-        self.drawarea_size = []
-        self.drawarea_extra = [0, 0]  # Extra amount of drawarea that is scrollable.
-        self.window_size = [1280, 960]
-        self.source_filepath = None  # This will be None while an sbr file is not accessed and source is not known.
-        self.source_filename = None
-        self.tree_filename = None
-        self.tree_dirpath = None
-        self.tree_filepath = None
-
-    def new_node_id(self):  # New object IDs.
-        self.next_node_id += 1
-        return self.next_node_id
-
-    def adjust_indices(self, index):  # Adjust indices of the objects after the one being removed.
-        adjust_list = self.node_id_list[index + 1:]
-        for node_id in adjust_list:
-            Objects.nodes[node_id].render_index -= 1
-
-    def bring_top(self, node_id):  # Bring an object to the front of the rendering order.
-        self.adjust_indices(Objects.nodes[node_id].render_index)
-        self.node_id_list.pop(Objects.nodes[node_id].render_index)    # Remove target object from rendering list.
-        Objects.nodes[node_id].render_index = len(self.node_id_list)  # New rendering index at the end of the list.
-        self.node_id_list.append(node_id)              # Add to the end of the list.
-
-    def remove_object(self, node):  # Remove an object from the rendering list.
-        self.adjust_indices(node.render_index)
-        self.node_id_list.pop(node.render_index)
-        del Objects.nodes[node.node_id]
-
-    def add_object(self, node):  # Add an object to the rendering list.
-        node.render_index = len(self.node_id_list)
-        self.node_id_list.append(node.node_id)
-        Objects.nodes[node.node_id] = node
+# Time spent in each part of starting up, printed with --startup-times.
+class StartupTimes(object):
+    def __init__(self, start, enabled=False):
+        self.enabled = enabled
+        self.start = start
+        self.last = start
+        self.phases = []
 
+    def mark(self, phase):  # End of a phase.
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
 
-main = Main()
+    def report(self):
+        if not self.enabled:
+            return
+        for phase, seconds in self.phases:
+            print('%-12s %7.1fms' % (phase, seconds * 1000))
+        print('%-12s %7.1fms' % ('total', (self.last - self.start) * 1000))
+
+
+startup = StartupTimes(startup_start, '--startup-times' in sys.argv)
+startup.mark("imports")
 
 
-# Prototype node object.
-class Node(object):
-    def __init__(self, text="default", pos=(0, 0)):
-        self.super_node_id = None
-        self.sub_node_ids = []
-        self.text = text
-        self.x = pos[0]
-        self.y = pos[1]
-        self.w = 20
-        self.h = 20
-        self.ext_width = 100    # Dimensions of box after padding with text.
-        self.ext_height = 100
-        self.text_width = 0     # Text string dimensions.
-        self.text_height = 0
-        self.text_x = 0
-        self.text_y = 0
-        self.render_index = None             # Index of this node element in main.node_id_list for rendering order.
-        self.node_id = main.new_node_id()
-
-    def add_subnode(self, node_id):  # Creates an edge from this node to a subnode; connecting the two.
-        sub_node = Objects.nodes[node_id]
-        if node_id not in self.sub_node_ids:
-            if sub_node.super_node_id:
-                sub_node.super_node_id.sub_node_ids.pop(sub_node.super_node_id.sub_node_ids.index(sub_node.node_id))
-            self.sub_node_ids.append(sub_node.node_id)
-            sub_node.super_node_id = self.node_id
+def built_on_first_use(build):  # Property for a widget that's only built (by build(self)) the first time it's used.
+    name = build.__name__
+
+    def get(self):
+        widget = self.widgets.get(name)
+        if widget is None:
+            widget = build(self)
+            self.widgets[name] = widget
+        return widget
+    return property(get)
 
 
 class AppWindow(Gtk.ApplicationWindow):
@@ -92,9 +80,13 @@ class AppWindow(Gtk.ApplicationWindow):
         self.grabbed_diff = [0, 0]  # Space between the position of a grabbed box and the cursor.
 
         self.grabbed_node_id = None
+        self.grabbed_subtree = False  # Dragging moves the grabbed node's whole subtree.
         self.selected_node_id = None
         self.selected_node_ids = []
         self.target_node_id = None  # Object targeted with right click.
+        self.path_node_ids = set()  # Selected node and its supernodes up to the root. (Edges drawn highlighted)
+        self.branch_mode = False  # Clicks select whole subtrees and drags move them. (b, or holding shift)
+        self.removals = []  # (treecore.Removal, Main, store) of removals that can still be undone, oldest first.
 
         self.mod_ctrl = False
         self.mod_shift = False
@@ -102,45 +94,68 @@ class AppWindow(Gtk.ApplicationWindow):
         self.last_m_x = 0
         self.last_m_y = 0
 
-        self.set_icon_from_file('savebrancher.png')
         self.gladefile = "savebrancher.glade"
         self.builder = Gtk.Builder()                # Used to build gui objects from our glade file.
-        self.builder.add_from_file(self.gladefile)  #
+        # Only the main window for now; dialogs are built from the glade file when they're first used.
+        self.builder.add_objects_from_file(self.gladefile, ["window1", "image1", "image2", "image4"])
         self.builder.connect_signals(self)          # Connect the signals to our callbacks in this object.
         self.mainbox = self.builder.get_object("mainbox")
         self.mainbox.get_parent().remove(self.mainbox)  # Remove the window I have for previewing in Glade.
         self.add(self.mainbox)
-
-        self.onloadbuffer = Gtk.TextBuffer()
-        f = open('onloadscript.py', 'r')
-        scriptlines = f.readlines()
-        f.close()
-        scriptlines = "".join(scriptlines)
-        self.onloadbuffer.set_text(scriptlines)
+        self.widgets = {}  # Widgets built on first use. (See built_on_first_use)
+        self.first_frame = True
+        self.startup_filepath = None  # Tree file to open once the window is up.
+        startup.mark("builder")
 
         self.bars_hidden = False
+        self.overlay_shown = False
+        self.overlay_started = False  # Recording was started by showing the overlay.
+        self.overlay_timeout = None
+        self.overlay_rect = None  # Where the overlay was last drawn. (x, y, w, h)
+        self.nodes_drawn = 0  # Nodes painted for the current frame. (Counted while recording)
+        self.zoom_level = 0
+        self.zoom = 1.0  # Drawarea pixels per canvas pixel. Events are in drawarea pixels, nodes in canvas pixels.
+        self.canvas_size = [0, 0]  # Canvas area the drawarea is sized for, at zoom 1.
+        self.minimap_shown = False
+        self.minimap_rect = None  # Where the minimap was last drawn. (x, y, w, h)
+        self.layout_pending = False  # Lay out all nodes on the next draw. (After opening a tree.)
 
         self.menubar1 = self.builder.get_object("menubar1")
+        self.store = None  # Snapshot store of the opened tree.
+        self.watcher = None  # capture.SourceWatcher on the tree's source save, while auto capture is on.
+        # Tree files are written in the background, after SAVE_DELAY.
+        self.save_timeout = None
+        self.sbr_writer = persistence.TreeWriter(apply=self.write_tree_file,
+                                                 on_error=lambda filepath, e: GLib.idle_add(self.save_failed, filepath, e),
+                                                 on_saved=lambda filepath: GLib.idle_add(self.set_title, "SaveBrancher"))
+        # Trees stored in SQLite only get the rows of nodes that changed since the last save.
+        self.db_writer = persistence.TreeWriter(apply=self.write_tree_db,
+                                                merge=lambda older, newer: older.merge(newer),
+                                                on_error=lambda dbpath, e: GLib.idle_add(self.save_failed, dbpath, e),
+                                                on_saved=lambda dbpath: GLib.idle_add(self.set_title, "SaveBrancher"))
+        self.changed_node_ids = set()  # Nodes added/changed since the last save.
+        self.removed_node_ids = set()
+
+        # Settings menu. (Filled in after the window is shown, see finish_startup.)
+        self.menuitem2 = self.builder.get_object("menuitem2")
+        self.menu2 = self.builder.get_object("menu2")
+        self.settings_items = None
         self.box1 = self.builder.get_object("box1")
 
         self.connect('check-resize', self.cb_windowresize)
 
-        self.entry_rename = self.builder.get_object("entry_rename")
-        self.dialog_rename = self.builder.get_object("dialog_rename")
-        self.entry_newsave = self.builder.get_object("entry_newsave")
-        self.dialog_newsave = self.builder.get_object("dialog_newsave")
-        self.entry_appendsave = self.builder.get_object("entry_appendsave")
-        self.dialog_appendsave = self.builder.get_object("dialog_appendsave")
-
         self.scrolledwindow = self.builder.get_object("scrolledwindow")
         self.widget_area = self.builder.get_object("widget_area")
         self.drawarea = self.builder.get_object("drawarea")
         self.drawarea.set_events(Gdk.EventMask.BUTTON_PRESS_MASK)
         self.drawarea.connect('draw', self.cb_draw)
+        self.tiles = tilecache.TileCache(self.paint_area)  # Rendered canvas, drawn from in cb_draw.
         self.eventbox = self.builder.get_object("eventbox")
         self.eventbox.connect('button-press-event', self.cb_click)
         self.eventbox.connect('button-release-event', self.cb_release)
         self.eventbox.connect('motion-notify-event', self.cb_motion)
+        self.eventbox.connect('scroll-event', self.cb_scroll)
+        self.minimap = minimap.Minimap(self.paint_area)
         self.statusbar = self.builder.get_object("statusbar")
 
         self.menuitem_save = self.builder.get_object("menuitem_save")
@@ -150,36 +165,11 @@ class AppWindow(Gtk.ApplicationWindow):
 
         self.widget_area.set_events(Gdk.EventMask.BUTTON_PRESS_MASK)
         self.eventbox.set_events(Gdk.EventMask.BUTTON_PRESS_MASK)
-
-        # Node menu when no node is selected.
-        self.spacemenu = Gtk.Menu()
-        self.sm_appendsave = Gtk.MenuItem(label=("Append new save"))
-        self.spacemenu.append(self.sm_appendsave)
-        self.sm_appendsave.connect('button-press-event', self.cb_appendsave)
-        self.sm_appendsave.show()
-        self.sm_newsave = Gtk.MenuItem(label=("Copy new save"))
-        self.spacemenu.append(self.sm_newsave)
-        self.sm_newsave.connect('button-press-event', self.cb_newsave)
-        self.sm_newsave.show()
-
-        # Node menu right-clicking a node.
-        self.nodemenu = Gtk.Menu()
-        self.nm_rename = Gtk.MenuItem(label=("Rename"))
-        self.nodemenu.append(self.nm_rename)
-        self.nm_rename.connect('button-press-event', self.cb_rename)
-        self.nm_rename.show()
-        self.nm_linksave = Gtk.MenuItem(label=("Link"))
-        self.nodemenu.append(self.nm_linksave)
-        self.nm_linksave.connect('button-press-event', self.cb_linksave)
-        self.nm_linksave.show()
-        self.nm_unlink = Gtk.MenuItem(label=("Unlink"))
-        self.nodemenu.append(self.nm_unlink)
-        self.nm_unlink.connect('button-press-event', self.cb_unlink)
-        self.nm_unlink.show()
-        self.nm_writesave = Gtk.MenuItem(label="Load save (Overwrite Slot)")
-        self.nodemenu.append(self.nm_writesave)
-        self.nm_writesave.connect('button-press-event', self.cb_writesave)
-        self.nm_writesave.show()
+        self.eventbox.add_events(Gdk.EventMask.SCROLL_MASK | Gdk.EventMask.SMOOTH_SCROLL_MASK)
+        self.scroll_delta = 0  # Smooth scrolling not yet added up to a whole zoom step.
+        # Scrolling moves what's drawn over the canvas (overlay, minimap) along with the viewport.
+        self.scrolledwindow.get_hadjustment().connect('value-changed', self.cb_scrolled)
+        self.scrolledwindow.get_vadjustment().connect('value-changed', self.cb_scrolled)
 
         # CSS styling and settings >
         settings = Gtk.Settings.get_default()
@@ -213,46 +203,352 @@ class AppWindow(Gtk.ApplicationWindow):
         self.statusbar4 = self.builder.get_object("statusbar4")
         self.context_id4 = self.statusbar4.get_context_id("status")
         self.statusbar4.push(self.context_id4, "....")
+        # Displays the saves being copied/deleted in the background.
+        self.statusbar3 = Gtk.Statusbar()
+        self.box1.pack_end(self.statusbar3, False, True, 0)
+        self.context_id3 = self.statusbar3.get_context_id("files")
+        self.statusbar3.show()
+
+        # Save files are copied and deleted on worker threads; what to do once they're done runs back on this one.
+        self.files = fileworker.FileWorker(on_change=lambda jobs, size: GLib.idle_add(self.show_file_progress, jobs, size))
+        self.files_done = deque()  # (done callback, result, error) of finished file jobs.
+        self.loader = loader.Loader()  # Sends the load key for the load hooks.
+        self.hooks = hooks.HookCache()
+        self.onload_filepath = None  # Hook file open in the editor dialog.
+        startup.mark("widgets")
+
+    # Everything that can wait until the window is on screen. (Called after the first frame is drawn.)
+    def finish_startup(self):
+        self.set_icon_from_file('savebrancher.png')
+        self.menuitem_usestore = Gtk.CheckMenuItem(label="Deduplicate snapshots")
+        self.menu2.append(self.menuitem_usestore)
+        self.menuitem_usestore.connect('toggled', self.cb_usestore_toggled)
+        self.menuitem_usestore.show()
+        self.menuitem_sqlite = Gtk.CheckMenuItem(label="Store tree in SQLite database")
+        self.menu2.append(self.menuitem_sqlite)
+        self.menuitem_sqlite.connect('toggled', self.cb_sqlite_toggled)
+        self.menuitem_sqlite.show()
+        self.menuitem_autolayout = Gtk.CheckMenuItem(label="Lay out appended saves")
+        self.menu2.append(self.menuitem_autolayout)
+        self.menuitem_autolayout.connect('toggled', self.cb_autolayout_toggled)
+        self.menuitem_autolayout.show()
+        self.menuitem_autocapture = Gtk.CheckMenuItem(label="Capture new saves automatically")
+        self.menu2.append(self.menuitem_autocapture)
+        self.menuitem_autocapture.connect('toggled', self.cb_autocapture_toggled)
+        self.menuitem_autocapture.show()
+        self.keyframe_items = self.settings_submenu("Delta keyframe interval",
+                                                    [(0, "Off"), (4, "4"), (8, "8"), (16, "16"), (32, "32")],
+                                                    self.cb_keyframes_toggled)
+        self.compression_items = self.settings_submenu("Compression",
+                                                       [(None, "Off")] + [(codec, codec) for codec in snapshotstore.CODECS],
+                                                       self.cb_compression_toggled)
+        self.hook_items = self.settings_submenu("Load hook",
+                                                [(name, hooks.profile_name(name)) for name in self.hooks.available()],
+                                                self.cb_hook_toggled)
+        self.menuitem2.show()
+        self.settings_items = True
+        self.sync_settings()
+        startup.mark("deferred")
+        if self.startup_filepath:
+            self.open_tree(self.startup_filepath)
+            startup.mark("open tree")
+        startup.report()
+        return False
+
+    # Dialogs and menus. Built the first time they're used.
+    def glade_object(self, top_id, object_id=None):  # Object from the glade file, building its top-level object if needed.
+        if self.builder.get_object(top_id) is None:
+            self.builder.add_objects_from_file(self.gladefile, [top_id])
+            self.builder.connect_signals(self)  # Only connects the signals of the objects just added.
+        return self.builder.get_object(object_id or top_id)
+
+    @built_on_first_use
+    def dialog_rename(self):
+        return self.glade_object("dialog_rename")
+
+    @built_on_first_use
+    def entry_rename(self):
+        return self.glade_object("dialog_rename", "entry_rename")
+
+    @built_on_first_use
+    def dialog_newsave(self):
+        return self.glade_object("dialog_newsave")
+
+    @built_on_first_use
+    def entry_newsave(self):
+        return self.glade_object("dialog_newsave", "entry_newsave")
+
+    @built_on_first_use
+    def dialog_appendsave(self):
+        return self.glade_object("dialog_appendsave")
+
+    @built_on_first_use
+    def entry_appendsave(self):
+        return self.glade_object("dialog_appendsave", "entry_appendsave")
+
+    @built_on_first_use
+    def dialog_onload(self):
+        dialog = self.glade_object("dialog_onload")
+        dialog.connect("delete-event", self.cb_delete_event)
+        self.glade_object("dialog_onload", "textview_onload").set_buffer(self.onloadbuffer)
+        return dialog
+
+    @built_on_first_use
+    def onloadbuffer(self):
+        return Gtk.TextBuffer()  # Filled from onloadscript.py in cb_onload.
+
+    @built_on_first_use
+    def file_newsource(self):
+        dialog = Gtk.FileChooserDialog(title="Select a source state/save.",
+                                       parent=None,
+                                       action=Gtk.FileChooserAction.OPEN)
+        dialog.add_buttons(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,Gtk.STOCK_OPEN, Gtk.ResponseType.OK)
+        dialog.connect("response", self.cb_newsource_response)
+        dialog.connect("delete-event", self.cb_delete_event)
+        return dialog
+
+    @built_on_first_use
+    def file_opentree(self):
+        dialog = Gtk.FileChooserDialog(title="Select an existing tree file.",
+                                       parent=None,
+                                       action=Gtk.FileChooserAction.OPEN)
+        dialog.add_buttons(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL, Gtk.STOCK_OPEN, Gtk.ResponseType.OK)
+        dialog.connect("response", self.cb_opentree_response)
+        dialog.connect("delete-event", self.cb_delete_event)
+        return dialog
+
+    @built_on_first_use
+    def dialog_warncreate(self):
+        dialog = Gtk.MessageDialog(parent=None,
+                                   flags=0,
+                                   message_type=Gtk.MessageType.INFO,
+                                   text="Create savetree from:")
+        dialog.add_buttons(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL, Gtk.STOCK_OK, Gtk.ResponseType.OK)
+        dialog.connect("response", self.cb_warncreate_response)
+        dialog.connect("delete-event", self.cb_delete_event)
+        return dialog
+
+    @built_on_first_use
+    def dialog_error(self):
+        dialog = Gtk.MessageDialog(parent=None,
+                                   flags=0,
+                                   message_type=Gtk.MessageType.ERROR,
+                                   text="Error.")
+        dialog.add_buttons(Gtk.STOCK_OK, Gtk.ResponseType.OK)
+        dialog.connect("response", self.cb_error_response)
+        dialog.connect("delete-event", self.cb_delete_event)
+        return dialog
+
+    @built_on_first_use
+    def spacemenu(self):  # Node menu when no node is selected.
+        menu = Gtk.Menu()
+        self.sm_appendsave = Gtk.MenuItem(label=("Append new save"))
+        menu.append(self.sm_appendsave)
+        self.sm_appendsave.connect('button-press-event', self.cb_appendsave)
+        self.sm_appendsave.show()
+        self.sm_newsave = Gtk.MenuItem(label=("Copy new save"))
+        menu.append(self.sm_newsave)
+        self.sm_newsave.connect('button-press-event', self.cb_newsave)
+        self.sm_newsave.show()
+        return menu
 
-        self.file_newsource = Gtk.FileChooserDialog(title="Select a source state/save.",
-                                                    parent=None,
-                                                    action=Gtk.FileChooserAction.OPEN)
-        self.file_newsource.add_buttons(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,Gtk.STOCK_OPEN, Gtk.ResponseType.OK)
-        self.file_newsource.connect("response", self.cb_newsource_response)
-        self.file_newsource.connect("delete-event", self.cb_delete_event)
-        self.file_opentree = Gtk.FileChooserDialog(title="Select an existing tree file.",
-                                                   parent=None,
-                                                   action=Gtk.FileChooserAction.OPEN)
-        self.file_opentree.add_buttons(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL, Gtk.STOCK_OPEN, Gtk.ResponseType.OK)
-        self.file_opentree.connect("response", self.cb_opentree_response)
-        self.file_opentree.connect("delete-event", self.cb_delete_event)
-        self.dialog_onload = self.builder.get_object("dialog_onload")
-        self.dialog_onload.connect("delete-event", self.cb_delete_event)
-        self.button_onload_cancel = self.builder.get_object("button_onload_cancel")
-        self.button_onload_confirm = self.builder.get_object("button_onload_confirm")
-        self.textview_onload = self.builder.get_object("textview_onload")
-        self.textview_onload.set_buffer(self.onloadbuffer)
-        self.dialog_warncreate = Gtk.MessageDialog(parent=None,
-                                                   flags=0,
-                                                   message_type=Gtk.MessageType.INFO,
-                                                   text="Create savetree from:")
-        self.dialog_warncreate.add_buttons(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL, Gtk.STOCK_OK, Gtk.ResponseType.OK)
-        self.dialog_warncreate.connect("response", self.cb_warncreate_response)
-        self.dialog_warncreate.connect("delete-event", self.cb_delete_event)
-        self.dialog_error = Gtk.MessageDialog(parent=None,
-                                              flags=0,
-                                              message_type=Gtk.MessageType.ERROR,
-                                              text="Error.")
-        self.dialog_error.add_buttons(Gtk.STOCK_OK, Gtk.ResponseType.OK)
-        self.dialog_error.connect("response", self.cb_error_response)
-        self.dialog_error.connect("delete-event", self.cb_delete_event)
-
-    # Redraw drawarea.
+    @built_on_first_use
+    def nodemenu(self):  # Node menu right-clicking a node.
+        menu = Gtk.Menu()
+        self.nm_rename = Gtk.MenuItem(label=("Rename"))
+        menu.append(self.nm_rename)
+        self.nm_rename.connect('button-press-event', self.cb_rename)
+        self.nm_rename.show()
+        self.nm_linksave = Gtk.MenuItem(label=("Link"))
+        menu.append(self.nm_linksave)
+        self.nm_linksave.connect('button-press-event', self.cb_linksave)
+        self.nm_linksave.show()
+        self.nm_unlink = Gtk.MenuItem(label=("Unlink"))
+        menu.append(self.nm_unlink)
+        self.nm_unlink.connect('button-press-event', self.cb_unlink)
+        self.nm_unlink.show()
+        self.nm_selectsubtree = Gtk.MenuItem(label="Select subtree")
+        menu.append(self.nm_selectsubtree)
+        self.nm_selectsubtree.connect('button-press-event', self.cb_selectsubtree)
+        self.nm_selectsubtree.show()
+        self.nm_deletesubtree = Gtk.MenuItem(label="Delete subtree")
+        menu.append(self.nm_deletesubtree)
+        self.nm_deletesubtree.connect('button-press-event', self.cb_deletesubtree)
+        self.nm_deletesubtree.show()
+        self.nm_writesave = Gtk.MenuItem(label="Load save (Overwrite Slot)")
+        menu.append(self.nm_writesave)
+        self.nm_writesave.connect('button-press-event', self.cb_writesave)
+        self.nm_writesave.show()
+        return menu
+
+    # Adds a submenu of radio items to the settings menu. Returns {value: item}.
+    def settings_submenu(self, label, options, callback):
+        menuitem = Gtk.MenuItem(label=label)
+        self.menu2.append(menuitem)
+        submenu = Gtk.Menu()
+        menuitem.set_submenu(submenu)
+        items = {}
+        group = None
+        for value, itemlabel in options:
+            item = Gtk.RadioMenuItem.new_with_label_from_widget(group, itemlabel)
+            group = item
+            submenu.append(item)
+            item.connect('toggled', callback, value)
+            item.show()
+            items[value] = item
+        menuitem.show()
+        return items
+
+    # Redraw the whole drawarea and minimap. (For changes all over the tree; see redraw_regions otherwise.)
     def redraw(self):
-        self.drawarea.queue_draw_area(0,
-                                      0,
-                                      main.drawarea_size[0]+main.drawarea_extra[0],
-                                      main.drawarea_size[1]+main.drawarea_extra[1])
+        self.tiles.clear()
+        self.minimap.tiles.clear()
+        self.drawarea.queue_draw()
+
+    # Redraw only parts of the drawarea. (Regions as (x, y, w, h) on the canvas, e.g. from Node.region before and
+    # after a move.)
+    def redraw_regions(self, regions):
+        z = self.zoom
+        for x, y, w, h in regions:
+            self.tiles.invalidate(x, y, w, h)
+            self.minimap.invalidate(x, y, w, h)
+            self.drawarea.queue_draw_area(int(math.floor(x * z)), int(math.floor(y * z)),
+                                          int(math.ceil(w * z)) + 1, int(math.ceil(h * z)) + 1)
+        if self.minimap_shown:
+            self.queue_minimap()
+
+    # Areas drawn differently because of the selection: the selected and targeted nodes and the highlighted path (each
+    # node's region covers the edge to its supernode). None if that's too many to be worth redrawing one by one.
+    def selection_regions(self):
+        node_ids = set(self.selected_node_ids) | self.path_node_ids
+        node_ids.add(self.target_node_id)
+        node_ids.intersection_update(Objects.nodes)
+        if len(node_ids) > SUBTREE_REGIONS:
+            return None
+        return [Objects.nodes[node_id].region() for node_id in node_ids]
+
+    # Areas a removal changes, or undoing it: the removed nodes and every edge they had. None if that's too many to
+    # redraw one by one.
+    def removal_regions(self, removal):
+        if len(removal.nodes) + len(removal.super_links) + len(removal.sub_links) > SUBTREE_REGIONS:
+            return None
+        removed = {node.node_id: node for node in removal.nodes}
+        regions = [(node.x - treecore.EDGE_PAD, node.y - treecore.EDGE_PAD, node.ext_width + 2 * treecore.EDGE_PAD,
+                    node.ext_height + 2 * treecore.EDGE_PAD) for node in removal.nodes]
+        links = [(node.super_node_id, node.node_id) for node in removal.nodes if node.super_node_id in removed]
+        for super_node_id, node_id in links + removal.super_links + removal.sub_links:
+            ends = [removed.get(end_id) or Objects.nodes.get(end_id) for end_id in (super_node_id, node_id)]
+            if None not in ends:
+                (x0, y0), (x1, y1) = ends[0].center(), ends[1].center()
+                regions.append((min(x0, x1) - treecore.EDGE_PAD, min(y0, y1) - treecore.EDGE_PAD,
+                                abs(x1 - x0) + 2 * treecore.EDGE_PAD, abs(y1 - y0) + 2 * treecore.EDGE_PAD))
+        return regions
+
+    def redraw_selection(self, old_regions):  # Redraw after the selection changed. (old_regions: selection_regions before)
+        new_regions = self.selection_regions()
+        if old_regions is None or new_regions is None:
+            self.redraw()
+        else:
+            self.redraw_regions(old_regions + new_regions)
+
+    # Size the drawarea to the canvas at the current zoom. Zoomed out, it's at least as big as the tree, so all of
+    # it can be scrolled to.
+    def resize_drawarea(self):
+        self.canvas_size = [main.drawarea_size[0] + main.drawarea_extra[0],
+                            main.drawarea_size[1] + main.drawarea_extra[1]]
+        self.zoom_drawarea()
+
+    def zoom_drawarea(self):
+        w, h = self.canvas_size
+        if self.zoom != 1.0 or self.minimap_shown:
+            bounds = treecore.tree_bounds()
+            w, h = max(w, bounds[0]), max(h, bounds[1])
+            self.minimap.fit(w, h)
+        self.drawarea.set_size_request(int(w * self.zoom), int(h * self.zoom))
+        return w, h
+
+    def set_zoom(self, level, x, y):  # Zoom keeping the canvas point at (x, y) in the drawarea where it is.
+        level = min(MAX_ZOOM_LEVEL, max(MIN_ZOOM_LEVEL, level))
+        if level == self.zoom_level:
+            return
+        hadj = self.scrolledwindow.get_hadjustment()
+        vadj = self.scrolledwindow.get_vadjustment()
+        canvas_x, canvas_y = x / self.zoom, y / self.zoom
+        view_x, view_y = x - hadj.get_value(), y - vadj.get_value()  # Where the point is in the window.
+        self.zoom_level = level
+        self.zoom = ZOOM_STEP ** level if level else 1.0
+        self.tiles.set_scale(self.zoom)
+        w, h = self.zoom_drawarea()
+        # The adjustments only get the new size on the next layout; set it now so the scroll position isn't clamped.
+        hadj.set_upper(max(hadj.get_page_size(), w * self.zoom))
+        vadj.set_upper(max(vadj.get_page_size(), h * self.zoom))
+        hadj.set_value(canvas_x * self.zoom - view_x)
+        vadj.set_value(canvas_y * self.zoom - view_y)
+        self.drawarea.queue_draw()
+        self.statusbar4.push(self.context_id4, "Zoom %d%%" % round(self.zoom * 100))
+
+    def cb_scroll(self, widget, event):  # Ctrl+wheel zooms, the rest scrolls.
+        if not event.state & Gdk.ModifierType.CONTROL_MASK:
+            return False
+        if event.direction == Gdk.ScrollDirection.UP:
+            steps = 1
+        elif event.direction == Gdk.ScrollDirection.DOWN:
+            steps = -1
+        elif event.direction == Gdk.ScrollDirection.SMOOTH:
+            self.scroll_delta -= event.get_scroll_deltas()[2]
+            steps = int(self.scroll_delta)
+            self.scroll_delta -= steps
+        else:
+            return False
+        if steps:
+            self.set_zoom(self.zoom_level + steps, event.x, event.y)
+        return True
+
+    def cb_scrolled(self, adjustment):
+        if self.overlay_shown or self.minimap_shown:
+            self.drawarea.queue_draw()  # From the tiles, without painting anything.
+
+    def view_area(self):  # Visible part of the canvas. (x, y, w, h)
+        hadj = self.scrolledwindow.get_hadjustment()
+        vadj = self.scrolledwindow.get_vadjustment()
+        return (hadj.get_value() / self.zoom, vadj.get_value() / self.zoom,
+                hadj.get_page_size() / self.zoom, vadj.get_page_size() / self.zoom)
+
+    # Minimap: the whole canvas in the bottom right corner of the window. Drawn over the tiles, from its own cache.
+    def toggle_minimap(self):
+        self.minimap_shown = not self.minimap_shown
+        if self.minimap_shown:
+            self.zoom_drawarea()  # Fits the minimap to the tree.
+        self.queue_minimap()
+
+    def queue_minimap(self):
+        if self.minimap_rect is not None:
+            x, y, w, h = self.minimap_rect
+            self.drawarea.queue_draw_area(int(x), int(y), int(w) + 1, int(h) + 1)
+        if not self.minimap_shown:
+            self.minimap_rect = None
+
+    def draw_minimap(self, cr):
+        hadj = self.scrolledwindow.get_hadjustment()
+        vadj = self.scrolledwindow.get_vadjustment()
+        w, h = self.minimap.size()
+        x = hadj.get_value() + hadj.get_page_size() - w - 8
+        y = vadj.get_value() + vadj.get_page_size() - h - 8
+        self.minimap_rect = (x, y, w, h)
+        self.minimap.draw(cr, x, y, self.view_area())
+
+    def minimap_click(self, event):  # Center the view on the point clicked on the minimap. Returns whether it was.
+        if self.minimap_rect is None:
+            return False
+        x, y, w, h = self.minimap_rect
+        if not (x <= event.x < x + w and y <= event.y < y + h):
+            return False
+        canvas_x, canvas_y = self.minimap.to_canvas(event.x - x, event.y - y)
+        hadj = self.scrolledwindow.get_hadjustment()
+        vadj = self.scrolledwindow.get_vadjustment()
+        hadj.set_value(canvas_x * self.zoom - hadj.get_page_size() / 2)
+        vadj.set_value(canvas_y * self.zoom - vadj.get_page_size() / 2)
+        return True
 
     def clear_paths(self):
         main.source_filepath = None
@@ -261,18 +557,303 @@ class AppWindow(Gtk.ApplicationWindow):
         main.tree_dirpath = None
         main.tree_filepath = None
 
-    def save_sbr(self):
-        # Save current window size for later restoration.
-        main.window_size = self.get_size()[:]
-        try:
-            sbr_file = open(main.tree_filepath, 'wb')
-            pickle.dump(main, sbr_file)
-            sbr_file.close()
+    # Save the tree file. Changes made within SAVE_DELAY of each other are written together by the background writer;
+    # wait=True writes right away and returns whether it worked.
+    def save_sbr(self, wait=False):
+        if wait:
+            self.cancel_save()
+            self.db_writer.flush()
+            self.sbr_writer.flush()  # So an older write still in flight can't land after this one.
+            if main.storage == 'sqlite':  # The changed nodes only go to the database, like in cb_save_timeout.
+                changes = self.tree_changes()
+                error = self.db_writer.write(treedb.db_path(main.tree_filepath), changes)
+                if error is not None:  # Kept for the next save.
+                    for node_id, row in changes.nodes.items():
+                        (self.changed_node_ids if row is not None else self.removed_node_ids).add(node_id)
+                    return False
+            else:
+                self.changed_node_ids = set()
+                self.removed_node_ids = set()
+            error = self.sbr_writer.write(main.tree_filepath, self.tree_state())
+            if error is not None:
+                return False
             self.set_title("SaveBrancher")
             return True
-        except:
-            # WIP: Could add error dialog here.
+        if self.save_timeout is None:
+            self.save_timeout = GLib.timeout_add(SAVE_DELAY, self.cb_save_timeout)
+        return True
+
+    def write_tree_file(self, filepath, tree):  # (Called on the writer thread, or by save_sbr with wait=True.)
+        start = time.perf_counter()
+        data = treefile.encode_tree(*tree)
+        persistence.write_atomic(filepath, data)
+        perf.add('save', start, bytes=len(data))
+
+    def write_tree_db(self, dbpath, changes):
+        start = time.perf_counter()
+        treedb.connect(dbpath).apply(changes)
+        perf.add('save', start, rows=len(changes.nodes))
+
+    def tree_state(self):  # Copy of the tree for writing: (Main's settings, node records in rendering order)
+        # Save current window size for later restoration.
+        main.window_size = list(self.get_size())
+        return treecore.tree_state(main)
+
+    def tree_changes(self, replace=False):  # Rows to write to the tree's database. (All of them with replace=True)
+        main.window_size = list(self.get_size())
+        changes = treecore.tree_changes(main, self.changed_node_ids, self.removed_node_ids, replace)
+        self.changed_node_ids = set()
+        self.removed_node_ids = set()
+        return changes
+
+    def mark_changed(self, *node_ids):  # Nodes to save on the next save. (Needed for trees stored in SQLite.)
+        self.changed_node_ids.update(node_ids)
+
+    def mark_removed(self, node_id):
+        self.changed_node_ids.discard(node_id)
+        self.removed_node_ids.add(node_id)
+
+    # Replace the current tree with the one in a tree file. (See treecore.load_tree)
+    def load_sbr(self, filepath):
+        global main
+        main, converted = treecore.load_tree(filepath)
+        self.layout_pending = True  # Labels are measured in one pass before the first tile is drawn.
+        self.changed_node_ids = set()
+        self.removed_node_ids = set()
+
+    def cb_save_timeout(self):
+        self.save_timeout = None
+        if main.tree_filepath:
+            if main.storage == 'sqlite':
+                self.db_writer.submit(treedb.db_path(main.tree_filepath), self.tree_changes())
+            else:
+                self.changed_node_ids = set()
+                self.removed_node_ids = set()
+                self.sbr_writer.submit(main.tree_filepath, self.tree_state())
+        return False
+
+    def cancel_save(self):
+        if self.save_timeout is not None:
+            GLib.source_remove(self.save_timeout)
+            self.save_timeout = None
+
+    def flush_sbr(self):  # Write pending changes and wait for them. (Before quitting or switching trees.)
+        while self.removals:  # No undoing them after this.
+            self.reclaim_removal(self.removals[0])
+        self.files.flush()
+        self.finish_file_jobs()  # Record the snapshots of finished copies before the last save.
+        if self.save_timeout is not None:
+            self.cancel_save()
+            self.cb_save_timeout()
+        self.sbr_writer.flush()
+        self.db_writer.flush()
+
+    def run_file_job(self, keys, job, done, size=0):  # Run job() on the file worker, then done(result, error) here.
+        self.files.submit(keys, job, lambda result, error: self.queue_file_done(done, result, error), size)
+
+    def queue_file_done(self, done, result, error):  # (Called from a worker thread.)
+        self.files_done.append((done, result, error))
+        GLib.idle_add(self.finish_file_jobs)
+
+    def finish_file_jobs(self):
+        while self.files_done:
+            done, result, error = self.files_done.popleft()
+            done(result, error)
+        return False
+
+    def show_file_progress(self, jobs, size):
+        self.statusbar3.remove_all(self.context_id3)
+        if jobs:
+            self.statusbar3.push(self.context_id3, "Copying %d file(s), %.1f MB" % (jobs, size / 1048576.0))
+        return False
+
+    def show_error(self, text, detail):
+        self.dialog_error.set_property("text", text)
+        self.dialog_error.format_secondary_text(detail)
+        self.dialog_error.show()
+
+    def save_failed(self, filepath, error):
+        self.set_title("SaveBrancher(*)")
+        self.dialog_error.set_property("text", "Couldn\'t save tree:")
+        self.dialog_error.format_secondary_text(filepath + "\n" + str(error))
+        self.dialog_error.show()
+        return False
+
+    def open_store(self):  # Set up the snapshot store of the current tree and the settings menu for it.
+        self.store = treecore.open_store(main)
+        self.sync_settings()
+        tree = main
+
+        def done(result, error):
+            if error is not None:
+                print("Couldn't empty trash:", error)
+
+        self.run_file_job([self.trash_key(tree)], lambda: treecore.empty_trash(tree), done)
+        self.update_capture()
+
+    def update_capture(self):  # Watch the source save if the tree captures saves automatically, stop watching if not.
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+        if getattr(main, 'auto_capture', False) and main.source_filepath:
+            self.watcher = capture.SourceWatcher(main.source_filepath, lambda content_hash: GLib.idle_add(self.capture_source))
+
+    # Append the source save below the head node, as the game just wrote it. (Auto capture; the watcher has already
+    # waited for the write to finish and skipped saves that didn't change.)
+    def capture_source(self):
+        if self.watcher is None or not main.tree_filepath:
             return False
+        start = time.perf_counter()
+        head_node_id = getattr(main, 'head_node_id', None)
+        if head_node_id not in Objects.nodes:
+            head_node_id = None  # A new root.
+        node = treecore.add_node(main, time.strftime("Capture %H:%M:%S"), treecore.new_node_position(head_node_id),
+                                 head_node_id)
+        node.layout()
+        moved = []
+        if getattr(main, 'auto_layout', False) and head_node_id is not None:
+            moved = treecore.layout_subtree(head_node_id)
+            self.mark_changed(*moved)
+        self.snapshot_source(node)
+        self.mark_changed(node.node_id)
+        main.head_node_id = node.node_id
+        w, h = treecore.tree_bounds()  # Make room if it's past the edge of the canvas.
+        if w > self.canvas_size[0] or h > self.canvas_size[1]:
+            main.drawarea_extra = [max(main.drawarea_extra[0], w - main.drawarea_size[0]),
+                                   max(main.drawarea_extra[1], h - main.drawarea_size[1])]
+            self.resize_drawarea()
+        self.save_sbr()
+        if moved:
+            self.redraw()
+        else:
+            self.redraw_regions([node.region()])
+        perf.add('capture', start, node=node.node_id)
+        self.statusbar1.push(self.context_id1, "Captured %d: %s" % (node.node_id, node.text))
+        return False
+
+    def sync_settings(self):  # Show the current tree's settings in the settings menu.
+        if self.settings_items is None:
+            return  # Not built yet; done once it is.
+        self.menuitem_usestore.set_active(getattr(main, 'use_store', False))
+        self.menuitem_sqlite.set_active(main.storage == 'sqlite')
+        self.menuitem_autolayout.set_active(getattr(main, 'auto_layout', False))
+        self.menuitem_autocapture.set_active(getattr(main, 'auto_capture', False))
+        if getattr(main, 'keyframe_interval', 0) in self.keyframe_items:
+            self.keyframe_items[getattr(main, 'keyframe_interval', 0)].set_active(True)
+        if getattr(main, 'compression', None) in self.compression_items:
+            self.compression_items[getattr(main, 'compression', None)].set_active(True)
+        if getattr(main, 'load_hook', hooks.DEFAULT_HOOK) in self.hook_items:
+            self.hook_items[getattr(main, 'load_hook', hooks.DEFAULT_HOOK)].set_active(True)
+
+    def snapshot_source(self, node):  # Copy the source save into the tree for a new node, in the background.
+        tree, store, srcpath = main, self.store, main.source_filepath
+        keys = [node.node_id, srcpath]  # Not while a load is writing the source.
+        if node.super_node_id is not None:
+            keys.append(node.super_node_id)  # Wait for the parent's own snapshot, it's the delta base.
+
+        def job():
+            start = time.perf_counter()
+            treecore.snapshot_source(tree, store, node, srcpath)
+            perf.add('snapshot', start, bytes=size)
+
+        def done(result, error):
+            node.pending = None
+            if error is not None:
+                self.show_error("Couldn\'t copy save:", str(srcpath) + "\n" + str(error))
+            if Objects.nodes.get(node.node_id) is node:
+                self.mark_changed(node.node_id)  # Saved again with its snapshot.
+                self.save_sbr()
+                self.redraw_regions([node.region()])
+
+        size = fileworker.file_size(srcpath)
+        node.pending = 'saving'
+        self.run_file_job(keys, job, done, size)
+
+    def trash_key(self, tree):  # File job key of a tree's trash, so it's emptied before anything is moved in.
+        return os.path.join(tree.tree_dirpath, treecore.TRASH_DIRNAME)
+
+    # Take nodes out of the tree (see treecore.remove_nodes): one save of the tree for all of them, and their saves
+    # are moved to the trash in the background. They can be put back with ctrl+z until UNDO_SECONDS later, when the
+    # saves are deleted.
+    def remove_nodes(self, removal):
+        if not removal.nodes:
+            return
+        start = time.perf_counter()
+        tree, store = main, self.store
+        node_ids = removal.node_ids()
+        self.mark_changed(*removal.linked_ids())
+        for node_id in node_ids:
+            self.mark_removed(node_id)
+        old_regions = self.selection_regions()
+        self.selected_node_ids = []
+        self.path_node_ids = set()
+        self.grabbed_node_id = None
+        self.target_node_id = None
+        self.save_sbr()
+        regions = self.removal_regions(removal)
+        self.redraw_selection(None if regions is None or old_regions is None else old_regions + regions)
+
+        def job():  # Runs after any copy of these saves that's still going.
+            treecore.trash_saves(tree, store, removal)
+
+        def done(result, error):
+            if error is not None:
+                self.show_error("Couldn\'t move saves to the trash:", str(error))
+
+        self.run_file_job(node_ids + [self.trash_key(tree)], job, done)
+        self.removals.append((removal, tree, store))
+        GLib.timeout_add_seconds(UNDO_SECONDS, self.cb_reclaim_timeout, removal)
+        perf.add('remove', start, nodes=len(node_ids))
+        self.statusbar1.push(self.context_id1, "Removed %d node(s). Ctrl+Z to undo." % len(node_ids))
+
+    def cb_reclaim_timeout(self, removal):
+        for entry in self.removals:
+            if entry[0] is removal:  # (Not undone or reclaimed already.)
+                self.reclaim_removal(entry)
+                break
+        return False
+
+    def reclaim_removal(self, entry):  # Delete the saves of a removal for good.
+        removal, tree, store = entry
+        self.removals.remove(entry)
+
+        def job():
+            treecore.reclaim_saves(tree, store, removal)
+
+        def done(result, error):
+            if error is not None:
+                self.show_error("Couldn\'t delete saves:", str(error))
+
+        self.run_file_job(removal.node_ids() + [self.trash_key(tree)], job, done)
+
+    def undo_removal(self):  # Put back the nodes of the last removal, if it hasn't been reclaimed yet.
+        if not self.removals:
+            self.statusbar1.push(self.context_id1, "Nothing to undo.")
+            return
+        removal, tree, store = self.removals.pop()
+        old_regions = self.selection_regions()
+        treecore.restore_nodes(tree, removal)
+        node_ids = removal.node_ids()
+        self.removed_node_ids.difference_update(node_ids)
+        self.mark_changed(*(node_ids + removal.linked_ids()))
+
+        def job():
+            return treecore.untrash_saves(tree, store, removal)
+
+        def done(result, error):
+            if error is not None:
+                self.show_error("Couldn\'t restore saves:", str(error))
+            elif result is False:
+                self.show_error("Couldn\'t restore saves:", "They're no longer in the trash. (Verify lists the nodes missing them.)")
+
+        self.run_file_job(node_ids + [self.trash_key(tree)], job, done)
+        self.selected_node_ids = node_ids
+        self.update_path()
+        self.save_sbr()
+        regions = self.removal_regions(removal)
+        self.redraw_selection(None if regions is None or old_regions is None else old_regions + regions)
+        self.statusbar1.push(self.context_id1, "Restored %d node(s)." % len(node_ids))
+
     def unsaved_changes(self):
         self.set_title("SaveBrancher(*)")
         self.menuitem_save.set_sensitive(True)
@@ -293,13 +874,8 @@ class AppWindow(Gtk.ApplicationWindow):
     def cb_warncreate_response(self, widget, response):
         global main
         if response == Gtk.ResponseType.OK:
-            main = Main()
-            main.source_filepath = self.temp_source_filepath[:]
-            main.source_filename = os.path.split(main.source_filepath)[-1]  # Get filename.
-            main.tree_filename = main.source_filename + '.sbr'
-            treepath = os.path.split(main.source_filepath)[:-1][0]
-            main.tree_dirpath = os.path.join(treepath, main.source_filename) + ' SBR'
-            main.tree_filepath = os.path.join(main.tree_dirpath, main.tree_filename)
+            self.flush_sbr()
+            main = treecore.tree_for_source(self.temp_source_filepath[:])
 
             # Create savebrancher sub-directory for this source file.
             self.directory_exists = False
@@ -325,7 +901,9 @@ class AppWindow(Gtk.ApplicationWindow):
                 pass
 
             # Create savebrancher file. (Main object containing all nodes/positions, window size)
-            savesbr = self.save_sbr()
+            Objects.clear()
+            self.open_store()
+            savesbr = self.save_sbr(wait=True)
 
             if not savesbr:
                 self.clear_paths()
@@ -351,65 +929,10 @@ class AppWindow(Gtk.ApplicationWindow):
         self.file_opentree.show()
 
     def cb_opentree_response(self, widget, response):
-        global main
         if response == Gtk.ResponseType.OK:
             openfn = self.file_opentree.get_filename()
             if openfn.split('.')[-1] == 'sbr':
-                with open(openfn, 'rb') as sbrfile:
-                    try:
-                        oldmain = pickle.load(sbrfile, encoding='latin1')
-                        print('Loading old-style SaveBrancher file.')
-                        newmain = Main()
-                        newmain.node_id_list = []
-                        newmain.next_node_id = oldmain.next_obj_id
-                        newmain.drawarea_size = oldmain.drawarea_size
-                        newmain.drawarea_extra = oldmain.drawarea_extra
-                        newmain.window_size = oldmain.window_size
-                        newmain.source_filepath = oldmain.source_filepath
-                        newmain.source_filename = oldmain.source_filename
-                        newmain.tree_filename = oldmain.tree_filename
-                        newmain.tree_dirpath = oldmain.tree_dirpath
-                        newmain.tree_filepath = oldmain.tree_filepath
-                        main.node_id_list = []
-                        Objects.nodes = {}
-                        main = newmain
-                        for node in oldmain.obj_list:
-                            # Convert old SaveBrancher attributes. (This destroys old edges.)
-                            if hasattr(node, 'sub_edges'):  # super_edges will also exist in this case
-                                del node.sub_edges
-                                del node.super_edges
-                            newnode = Node()
-                            newnode.text = node.text
-                            newnode.x = node.x
-                            newnode.y = node.y
-                            newnode.w = node.w
-                            newnode.h = node.h
-                            newnode.ext_width = node.ext_width
-                            newnode.ext_height = node.ext_height
-                            newnode.text_width = node.text_width
-                            newnode.text_height = node.text_height
-                            newnode.text_x = node.text_x
-                            newnode.text_y = node.text_y
-                            newnode.render_index = node.render_index
-                            newnode.node_id = node.obj_id
-                            main.add_object(newnode)
-                    except (TypeError, pickle.UnpicklingError):
-                        # This will be the default way.
-                        # Having one update with the conversion on the off chance someone used this.
-                        m = json.load(sbrfile)
-                        main.__dict__ = m[:1][0]
-                        nodes = m[1:]
-                        main.node_id_list = []
-                        Objects.nodes = {}
-                        for n in nodes:
-                            node = Node()
-                            node.__dict__ = n
-                            main.add_object(node)
-                self.resize(main.window_size[0], main.window_size[1])
-                self.drawarea.set_size_request(main.drawarea_size[0] + main.drawarea_extra[0],
-                                               main.drawarea_size[1] + main.drawarea_extra[1])
-                self.redraw()
-                self.statusbar1.push(self.context_id4, main.source_filepath)
+                self.open_tree(openfn)
             else:
                 pass
 
@@ -417,6 +940,15 @@ class AppWindow(Gtk.ApplicationWindow):
         elif response == Gtk.ResponseType.CANCEL:
             self.file_opentree.hide()
 
+    def open_tree(self, filepath):
+        self.flush_sbr()
+        self.load_sbr(filepath)
+        self.open_store()
+        self.resize(main.window_size[0], main.window_size[1])
+        self.resize_drawarea()
+        self.redraw()
+        self.statusbar1.push(self.context_id4, main.source_filepath)
+
     # Save node positions. Everything else is saved on action. ?: Seems a bit clunky though.
     def cb_menusave(self, widget):
         self.save_sbr()
@@ -424,8 +956,15 @@ class AppWindow(Gtk.ApplicationWindow):
 
     def cb_quit(self, widget):
         # WIP: Do dialog if positions haven't been saved.
+        self.flush_sbr()
         self.destroy()
 
+    def cb_destroy(self, widget):
+        if self.watcher is not None:
+            self.watcher.stop()
+        self.flush_sbr()
+        self.loader.stop()
+
     def cb_delete_event(self, widget, event):
         # ?: Dialogs have a weird bug of partially destroying themselves when X'd or canceled out
         # This is an override for that behavior that instead hides the widget.
@@ -440,52 +979,173 @@ class AppWindow(Gtk.ApplicationWindow):
         widget.get_child().set_can_focus(False)
 
     def cb_writesave(self, widget, data):
-        fileprefix = main.source_filename + '.' + str(self.selected_node_id)
-        nodefilepath = os.path.join(main.tree_dirpath, fileprefix)
-        shutil.copy2(nodefilepath, main.source_filepath)
-        print(nodefilepath, main.source_filepath)
-        with open("onloadscript.py") as f:
-            code = compile(f.read(), "onloadscript.py", 'exec')
-            exec(code)
+        start = time.perf_counter()
+        node = Objects.nodes[self.selected_node_id]
+        tree, store = main, self.store
+        destpath = main.source_filepath
+        hook_name = getattr(main, 'load_hook', hooks.DEFAULT_HOOK)
+        watcher = self.watcher
+
+        def job():  # Runs after any copy of this node's save that's still going.
+            hook_start = time.perf_counter()
+            hook = self.hooks.get(hook_name)  # Only compiled again if the file changed.
+            hook.run_pre_load(node, destpath, tree.source_filepath, self.loader)
+            copy_start = time.perf_counter()
+            perf.add('hook', hook_start, copy_start)
+            if watcher is not None:  # Not a new save, don't capture it.
+                watcher.expect(getattr(node, 'snapshot', None) or
+                               snapshotstore.hash_file(treecore.save_filepath(tree, store, node)))
+            treecore.write_save(tree, store, node, destpath)
+            post_start = time.perf_counter()
+            perf.add('copy', copy_start, post_start)
+            hook.run_post_load(node, destpath, tree.source_filepath, self.loader)
+            end = time.perf_counter()
+            perf.add('hook', post_start, end)
+            perf.add('load', start, end, node=node.node_id, waiting_ms=round((hook_start - start) * 1000, 1))
+            print('Load %d: %.1fms (waiting %.1fms, copy %.1fms, hooks %.1fms)' %
+                  (node.node_id, (end - start) * 1000, (hook_start - start) * 1000, (post_start - copy_start) * 1000,
+                   (copy_start - hook_start + end - post_start) * 1000))
+
+        def done(result, error):
+            node.pending = None
+            self.redraw_regions([node.region()])
+            if error is not None:
+                self.show_error("Couldn\'t load save:", str(destpath) + "\n" + str(error))
+
+        node.pending = 'loading'
+        main.head_node_id = node.node_id  # Captures from here on branch off this node.
+        self.save_sbr()
+        self.redraw_regions([node.region()])
+        self.run_file_job([node.node_id, destpath], job, done, fileworker.file_size(treecore.save_filepath(tree, store, node)))
 
     def cb_linksave(self, widget, data):
+        old_regions = self.selection_regions()  # (Covers the edges to the old supernodes.)
         for node_id in self.selected_node_ids:
-            if node_id is not self.target_node_id:
-                Objects.nodes[node_id].add_subnode(self.target_node_id)
+            if node_id != self.target_node_id:
+                if not treecore.link(node_id, self.target_node_id):
+                    self.statusbar1.push(self.context_id1, "Can't link a node below its own subtree.")
+        self.mark_changed(self.target_node_id)
+        self.update_path()
+        new_regions = self.selection_regions()  # (Target still set: covers the edges to it.)
         self.target_node_id = None
         self.save_sbr()
-        self.redraw()
+        if old_regions is None or new_regions is None:
+            self.redraw()
+        else:
+            self.redraw_regions(old_regions + new_regions)
 
     # Remove link to parent node.
     def cb_unlink(self, widget, data):
         target_node = Objects.nodes[self.target_node_id]
-        if target_node.super_node_id:
-            findex = Objects.nodes[target_node.super_node_id].sub_node_ids.index(self.target_node_id)
-            Objects.nodes[target_node.super_node_id].sub_node_ids.pop(findex)
-            target_node.super_node_id = None  # .
+        old_regions = self.selection_regions()
+        old_region = target_node.region()  # (Covers the edge that's removed.)
+        if target_node.super_node_id is not None:
+            treecore.unlink(target_node.node_id)
+            self.mark_changed(target_node.node_id)
+            self.update_path()
         self.save_sbr()
+        if old_regions is not None:
+            old_regions.append(old_region)
+        self.redraw_selection(old_regions)
+
+    def cb_selectsubtree(self, widget, data):
+        old_regions = self.selection_regions()
+        self.select_subtree(self.target_node_id)
+        self.redraw_selection(old_regions)
+
+    def select_subtree(self, node_id):
+        self.selected_node_ids = Objects.ancestry.subtree(node_id)
+        self.selected_node_id = node_id
+        self.update_path()
+        self.statusbar4.push(self.context_id4, "%d: %d node(s)" % (node_id, len(self.selected_node_ids)))
+
+    def update_path(self):  # Highlight the path from the selected node to its root.
+        if self.selected_node_id in Objects.nodes and self.selected_node_ids:
+            self.path_node_ids = set(Objects.ancestry.path_to_root(self.selected_node_id))
+        else:
+            self.path_node_ids = set()
+
+    def cb_sqlite_toggled(self, widget):
+        storage = 'sqlite' if widget.get_active() else 'file'
+        if main.storage == storage:
+            return
+        main.storage = storage
+        if main.tree_filepath:
+            if storage == 'sqlite':
+                # Move the whole tree into the database before the tree file stops listing the nodes.
+                self.db_writer.submit(treedb.db_path(main.tree_filepath), self.tree_changes(replace=True))
+                self.db_writer.flush()
+            self.save_sbr(wait=True)
+
+    def cb_autolayout_toggled(self, widget):
+        if getattr(main, 'auto_layout', False) != widget.get_active():
+            main.auto_layout = widget.get_active()
+            if main.tree_filepath:
+                self.save_sbr()
+
+    def cb_autocapture_toggled(self, widget):
+        if getattr(main, 'auto_capture', False) != widget.get_active():
+            main.auto_capture = widget.get_active()
+            if main.tree_filepath:
+                self.save_sbr()
+            self.update_capture()
+
+    def cb_usestore_toggled(self, widget):
+        # Only affects new snapshots; existing node files stay where they are.
+        if getattr(main, 'use_store', False) != widget.get_active():
+            main.use_store = widget.get_active()
+            if main.tree_filepath:
+                self.save_sbr()
+
+    def cb_keyframes_toggled(self, widget, interval):
+        if widget.get_active() and getattr(main, 'keyframe_interval', 0) != interval:
+            main.keyframe_interval = interval
+            if main.tree_filepath:
+                self.save_sbr()
+
+    def cb_hook_toggled(self, widget, name):
+        if widget.get_active() and getattr(main, 'load_hook', hooks.DEFAULT_HOOK) != name:
+            main.load_hook = name
+            if main.tree_filepath:
+                self.save_sbr()
+
+    def set_font(self, font_face, font_size):  # Change the node font and re-measure every node.
+        Objects.layouts.set_font(font_face, font_size)
+        self.layout_pending = True
         self.redraw()
 
+    def cb_compression_toggled(self, widget, codec):
+        # Only affects new snapshots; stored ones keep the codec they were written with.
+        if widget.get_active() and getattr(main, 'compression', None) != codec:
+            main.compression = codec
+            if self.store:
+                self.store.compression = codec
+            if main.tree_filepath:
+                self.save_sbr()
+
     def cb_rename(self, widget, data):
         if self.target_node_id:
             self.dialog_rename.show()
 
-    def cb_onload(self, widget):
-        # load the script.
-        f = open('onloadscript.py', 'r')
-        scriptlines = f.readlines()
-        f.close()
-        scriptlines = "".join(scriptlines)
-        self.onloadbuffer.set_text(scriptlines)
+    def cb_onload(self, widget):  # Edit the load hook of the current tree. (See hooks.py)
+        self.onload_filepath = self.hooks.path(getattr(main, 'load_hook', None))
+        try:
+            with open(self.onload_filepath) as f:
+                self.onloadbuffer.set_text(f.read())
+        except FileNotFoundError:
+            self.onloadbuffer.set_text("")
         self.dialog_onload.show()
 
     def cb_onload_canceled(self, widget):
         self.dialog_onload.hide()
 
     def cb_onload_confirmed(self, widget):
-        f = open('onloadscript.py', 'w')
-        f.writelines(self.onloadbuffer.get_text(self.onloadbuffer.get_start_iter(), self.onloadbuffer.get_end_iter(), True))
-        f.close()
+        text = self.onloadbuffer.get_text(self.onloadbuffer.get_start_iter(), self.onloadbuffer.get_end_iter(), True)
+        try:  # Atomically: a load running on a worker thread may be reading the hook right now.
+            persistence.write_atomic(self.onload_filepath, text.encode('utf-8'))
+        except OSError as e:
+            self.show_error("Couldn\'t save load hook:", self.onload_filepath + "\n" + str(e))
+            return
         self.dialog_onload.hide()
 
     def cb_focus(self, widget, data):
@@ -499,44 +1159,48 @@ class AppWindow(Gtk.ApplicationWindow):
         pass
 
     def cb_click(self, widget, event):
-        # record last mouse positions.
-        self.last_m_x = event.x
-        self.last_m_y = event.y
-
-        # TD: Iterating for all objects. Add bin detection instead.
+        start = time.perf_counter()
+        if event.button == Gdk.BUTTON_PRIMARY and self.minimap_click(event):
+            return
+        old_regions = self.selection_regions()
+        # record last mouse positions. (On the canvas)
+        self.last_m_x = event.x / self.zoom
+        self.last_m_y = event.y / self.zoom
+
+        # Topmost node under the cursor.
         self.target_node_id = None
-        foundnode = [False]
-        for node_id in main.node_id_list:
-            node = Objects.nodes[node_id]
-            if event.x >= node.x and event.x < node.x+node.ext_width:
-                if event.y >= node.y and event.y < node.y+node.ext_height:
-                    foundnode[0] = True
-                    if event.button == Gdk.BUTTON_PRIMARY:
-                        if self.mod_ctrl:
-                            if node.node_id in self.selected_node_ids:
-                                sindex = self.selected_node_ids.index(node.node_id)
-                                self.selected_node_ids.pop(sindex)
-                            self.selected_node_ids.append(node.node_id)
-                            self.selected_node_id = node.node_id
-                        else:
-                            self.selected_node_ids = [node.node_id]
-                            self.selected_node_id = node.node_id
-
-
-                        self.flag_dragging = True
-                        self.grabbed_node_id = node.node_id
-                        self.grabbed_diff = [event.x - node.x, event.y - node.y]
-                    elif event.button == Gdk.BUTTON_SECONDARY:
-                        self.selected_node_id = node.node_id
-                        self.target_node_id = node.node_id
-                        self.nodemenu.popup(None, None, None, None, event.button, event.time)
-                    idstring = ''
-                    for node_id in self.selected_node_ids:
-                        idstring = idstring + str(node_id) + ', '
-                    idstring = idstring[:-2]
-                    self.statusbar4.push(self.context_id4, idstring)
-
-        if foundnode[0] is False:
+        node = treecore.node_at(self.last_m_x, self.last_m_y)
+        if node is not None:
+            if event.button == Gdk.BUTTON_PRIMARY:
+                branch = self.branch_mode or self.mod_shift
+                if self.mod_ctrl:
+                    if node.node_id in self.selected_node_ids:
+                        sindex = self.selected_node_ids.index(node.node_id)
+                        self.selected_node_ids.pop(sindex)
+                    self.selected_node_ids.append(node.node_id)
+                    self.selected_node_id = node.node_id
+                elif branch:
+                    self.select_subtree(node.node_id)
+                else:
+                    self.selected_node_ids = [node.node_id]
+                    self.selected_node_id = node.node_id
+
+                self.flag_dragging = True
+                self.grabbed_node_id = node.node_id
+                self.grabbed_subtree = branch
+                self.grabbed_diff = [self.last_m_x - node.x, self.last_m_y - node.y]
+            elif event.button == Gdk.BUTTON_SECONDARY:
+                self.selected_node_id = node.node_id
+                self.target_node_id = node.node_id
+                self.nodemenu.popup(None, None, None, None, event.button, event.time)
+            if not self.grabbed_subtree:
+                idstring = ''
+                for node_id in self.selected_node_ids:
+                    idstring = idstring + str(node_id) + ', '
+                idstring = idstring[:-2]
+                self.statusbar4.push(self.context_id4, idstring)
+
+        if node is None:
             self.grabbed_node_id = None
             self.target_node_id = None
 
@@ -556,24 +1220,26 @@ class AppWindow(Gtk.ApplicationWindow):
                         self.sm_newsave.show()
                         self.sm_appendsave.hide()
                         self.spacemenu.popup(None, None, None, None, event.button, event.time)
-
-            self.redraw()
         else:
             if len(self.selected_node_ids) > 0:
-                main.bring_top(self.selected_node_ids[-1])
-                self.redraw()
+                main.bring_top(self.selected_node_id)  # (Its region is redrawn with the selection.)
+                self.mark_changed(self.selected_node_id)
+        self.update_path()
+        self.redraw_selection(old_regions)
         self.eventbox.grab_focus()
+        perf.add('click', start)
 
     def cb_release(self, widget, event):
         self.flag_dragging = False
         self.grabbed_node_id = None
+        self.grabbed_subtree = False
         self.grabbed_diff = [0, 0]
 
     def cb_motion(self, widget, event):
         if self.flag_dragging:
 
-            gox = event.x - self.grabbed_diff[0]
-            goy = event.y - self.grabbed_diff[1]
+            gox = event.x / self.zoom - self.grabbed_diff[0]
+            goy = event.y / self.zoom - self.grabbed_diff[1]
             new_posx = gox
             new_posy = goy
             if gox < 0:
@@ -583,48 +1249,58 @@ class AppWindow(Gtk.ApplicationWindow):
 
             # Expand drawarea right/lower dimension if a node nears that side.
             grabbed_object = Objects.nodes[self.grabbed_node_id]
+            old_region = grabbed_object.region()
             if gox + grabbed_object.ext_width >= main.drawarea_size[0] + main.drawarea_extra[0]:
-                main.drawarea_extra[0] += 4
-                self.drawarea.set_size_request(main.drawarea_size[0] + main.drawarea_extra[0],
-                                               main.drawarea_size[1] + main.drawarea_extra[1])
+                main.drawarea_extra[0] += tilecache.TILE_SIZE
+                self.resize_drawarea()
             if goy + grabbed_object.ext_height >= main.drawarea_size[1] + main.drawarea_extra[1]:
-                main.drawarea_extra[1] += 4
-                self.drawarea.set_size_request(main.drawarea_size[0] + main.drawarea_extra[0],
-                                               main.drawarea_size[1] + main.drawarea_extra[1])
+                main.drawarea_extra[1] += tilecache.TILE_SIZE
+                self.resize_drawarea()
+            if self.grabbed_subtree:  # The whole branch goes along.
+                subtree = Objects.ancestry.subtree(grabbed_object.node_id)
+                regions = [Objects.nodes[node_id].region() for node_id in subtree[:SUBTREE_REGIONS]]
+                moved = treecore.move_subtree(grabbed_object.node_id, new_posx - grabbed_object.x,
+                                              new_posy - grabbed_object.y)
+                self.mark_changed(*moved)
+                if main.storage == 'sqlite':
+                    self.save_sbr()
+                if len(subtree) > SUBTREE_REGIONS:
+                    self.redraw()
+                else:
+                    self.redraw_regions(regions + [Objects.nodes[node_id].region() for node_id in subtree])
+                return
             grabbed_object.x = new_posx
             grabbed_object.y = new_posy
+            grabbed_object.update_grid()
 
             self.unsaved_changes()
+            self.mark_changed(grabbed_object.node_id)
+            if main.storage == 'sqlite':
+                self.save_sbr()
 
-            self.redraw()
+            self.redraw_regions([old_region, grabbed_object.region()])
 
     def cb_removenodes(self, widget):
-        # WIP: Should have a warning dialog before deletion.
+        # WIP: Should have a warning dialog before deletion. (Undo covers it for now.)
         if len(self.selected_node_ids) > 0:
-            for node_id in self.selected_node_ids:
-                node = Objects.nodes[node_id]
-                for sub_node_id in node.sub_node_ids:
-                    Objects.nodes[sub_node_id].super_node_id = None
-                if node.super_node_id in Objects.nodes:
-                    super_node = Objects.nodes[node.super_node_id]
-                    super_node.sub_node_ids.pop(super_node.sub_node_ids.index(node_id))
-                node.sub_node_ids = []
-                nodefn = main.tree_filename[:-4] + '.' + str(node_id)
-                nodefp = os.path.join(main.tree_dirpath, nodefn)
-                os.remove(nodefp)
-                main.remove_object(node)
-            self.selected_node_ids = []
-            self.grabbed_node_id = None
-            self.target_node_id = None
-            self.save_sbr()
-            self.redraw()
+            self.remove_nodes(treecore.remove_nodes(main, self.selected_node_ids))
+
+    def cb_deletesubtree(self, widget, data):  # The target's subtree, or the subtrees of the selection it's part of.
+        if self.target_node_id in self.selected_node_ids:
+            self.remove_nodes(treecore.remove_subtrees(main, self.selected_node_ids))
+        elif self.target_node_id in Objects.nodes:
+            self.remove_nodes(treecore.remove_subtrees(main, [self.target_node_id]))
 
     def cb_rename_confirmed(self, widget):
-        Objects.nodes[self.target_node_id].text = self.entry_rename.get_text()
+        node = Objects.nodes[self.target_node_id]
+        old_region = node.region()
+        node.text = self.entry_rename.get_text()
+        node.layout()
+        self.mark_changed(self.target_node_id)
         self.entry_rename.set_text("")
         self.dialog_rename.hide()
         self.save_sbr()
-        self.redraw()
+        self.redraw_regions([old_region, node.region()])
 
     def cb_rename_canceled(self, widget):
         self.dialog_rename.hide()
@@ -647,16 +1323,11 @@ class AppWindow(Gtk.ApplicationWindow):
 
     def cb_appendsave_confirmed(self, widget):
 
-        # Copy source savefile to a node savefile.
-        # WIP: Add error checking.
-        fileprefix = main.source_filename + '.' + str(main.next_node_id + 1)
-        savedest = os.path.join(main.tree_dirpath, fileprefix)
-        shutil.copy2(main.source_filepath, savedest)
-
         newtext = self.entry_appendsave.get_text()
         nx = self.last_m_x
         ny = self.last_m_y
-        node = Node(newtext, (nx, ny))
+        node = Node(newtext, (nx, ny), main.new_node_id())
+        node.layout()
         main.add_object(node)
 
         # Push the node back into the draw area if its new position is outside.
@@ -670,14 +1341,27 @@ class AppWindow(Gtk.ApplicationWindow):
             ny = main.drawarea_size[1] - node.ext_height
         node.x = nx
         node.y = ny
+        node.update_grid()
 
         self.entry_appendsave.set_text("")
         self.dialog_appendsave.hide()
         for sn in self.selected_node_ids:
             Objects.nodes[sn].add_subnode(node.node_id)
+        moved = []
+        if getattr(main, 'auto_layout', False) and node.super_node_id is not None:
+            moved = treecore.layout_subtree(node.super_node_id)
+            self.mark_changed(*moved)
+
+        # Copy source savefile to a node savefile. (After linking, so it can be stored as a delta of its parent.)
+        self.snapshot_source(node)
+        self.mark_changed(node.node_id)
+        main.head_node_id = node.node_id
 
         self.save_sbr()
-        self.redraw()
+        if moved:
+            self.redraw()
+        else:
+            self.redraw_regions([node.region()])
 
     def cb_appendsave_canceled(self, widget):
         self.entry_appendsave.set_text("")
@@ -700,18 +1384,17 @@ class AppWindow(Gtk.ApplicationWindow):
                 self.dialog_newsave.show()
 
     def cb_newsave_confirmed(self, widget):
-
-        # Copy source savefile to a node savefile.
-        # WIP: Add error checking.
-        fileprefix = main.source_filename + '.' + str(main.next_node_id + 1)
-        savedest = os.path.join(main.tree_dirpath, fileprefix)
-        shutil.copy2(main.source_filepath, savedest)
-
+        old_regions = self.selection_regions()
         newtext = self.entry_newsave.get_text()
         nx = self.last_m_x
         ny = self.last_m_y
-        node = Node(newtext, (nx, ny))
+        node = Node(newtext, (nx, ny), main.new_node_id())
+        node.layout()
+
+        # Copy source savefile to a node savefile.
+        self.snapshot_source(node)
         main.add_object(node)
+        self.mark_changed(node.node_id)
 
         # Push the node back into the draw area if its new position is outside.
         if nx < 0:
@@ -724,13 +1407,15 @@ class AppWindow(Gtk.ApplicationWindow):
             ny = main.drawarea_size[1] - node.ext_height
         node.x = nx
         node.y = ny
+        node.update_grid()
 
         self.entry_newsave.set_text("")
         self.dialog_newsave.hide()
         self.selected_node_ids = [node.node_id]
+        main.head_node_id = node.node_id
 
         self.save_sbr()
-        self.redraw()
+        self.redraw_selection(old_regions)
 
     def cb_newsave_canceled(self, widget):
         self.entry_newsave.set_text("")
@@ -748,7 +1433,12 @@ class AppWindow(Gtk.ApplicationWindow):
         #if event.keyval == Gdk.KEY_Escape:
         #    self.destroy()  # WIP: Add quit dialog.
         if event.keyval == Gdk.KEY_Delete:
-            self.cb_removenodes(None)
+            if self.mod_shift:
+                self.remove_nodes(treecore.remove_subtrees(main, self.selected_node_ids))
+            else:
+                self.cb_removenodes(None)
+        if event.keyval == Gdk.KEY_z and self.mod_ctrl:
+            self.undo_removal()
         if event.keyval == Gdk.KEY_Control_L:
             self.mod_ctrl = True
         if event.keyval == Gdk.KEY_Control_R:
@@ -766,27 +1456,66 @@ class AppWindow(Gtk.ApplicationWindow):
                 self.menubar1.hide()
                 self.box1.hide()
                 self.bars_hidden = True
+        if event.keyval == Gdk.KEY_b:
+            self.branch_mode = not self.branch_mode
+            self.statusbar1.push(self.context_id1, "Branch mode: clicks select subtrees, drags move them." if
+                                 self.branch_mode else "Branch mode off.")
+        if event.keyval == Gdk.KEY_m:
+            self.toggle_minimap()
+        if event.keyval == Gdk.KEY_0 and self.mod_ctrl:  # Back to 100%, around the middle of the view.
+            x, y, w, h = self.view_area()
+            self.set_zoom(0, (x + w / 2) * self.zoom, (y + h / 2) * self.zoom)
+        if event.keyval == Gdk.KEY_l:
+            self.layout_nodes(self.selected_node_ids)
+        if event.keyval == Gdk.KEY_p:
+            self.toggle_overlay()
+        if event.keyval == Gdk.KEY_P:
+            self.export_trace()
 
         if event.keyval == Gdk.KEY_Right:
             if self.selected_node_ids:
-                for node_id in self.selected_node_ids:
-                    Objects.nodes[node_id].x += 1
-                self.redraw()
+                self.nudge_selected(1, 0)
         if event.keyval == Gdk.KEY_Down:
             if self.selected_node_ids:
-                for node_id in self.selected_node_ids:
-                    Objects.nodes[node_id].y += 1
-                self.redraw()
+                self.nudge_selected(0, 1)
         if event.keyval == Gdk.KEY_Left:
             if self.selected_node_ids:
-                for node_id in self.selected_node_ids:
-                    Objects.nodes[node_id].x -= 1
-                self.redraw()
+                self.nudge_selected(-1, 0)
         if event.keyval == Gdk.KEY_Up:
             if self.selected_node_ids:
-                for node_id in self.selected_node_ids:
-                    Objects.nodes[node_id].y -= 1
-                self.redraw()
+                self.nudge_selected(0, -1)
+
+    def layout_nodes(self, node_ids=()):  # Lay out the subtrees of the given nodes, or the whole tree.
+        start = time.perf_counter()
+        if self.layout_pending:  # Boxes have to be sized first.
+            treecore.measure_nodes(main)
+            self.layout_pending = False
+        if node_ids:
+            moved = []
+            for node_id in node_ids:
+                moved.extend(treecore.layout_subtree(node_id))
+        else:
+            moved = treecore.layout_tree(main)
+        perf.add('layout', start, nodes=len(moved))
+        if moved:
+            self.mark_changed(*moved)
+            self.save_sbr()
+            self.zoom_drawarea()
+            self.redraw()
+
+    def nudge_selected(self, dx, dy):  # Move the selected nodes by a pixel with the arrow keys.
+        regions = []
+        for node_id in self.selected_node_ids:
+            node = Objects.nodes[node_id]
+            regions.append(node.region())
+            node.x += dx
+            node.y += dy
+            node.update_grid()
+            regions.append(node.region())
+        self.redraw_regions(regions)
+        self.mark_changed(*self.selected_node_ids)
+        if main.storage == 'sqlite':
+            self.save_sbr()
 
     def cb_keyrelease(self, widget, event, data=None):
         if event.keyval == Gdk.KEY_Control_L:
@@ -802,81 +1531,169 @@ class AppWindow(Gtk.ApplicationWindow):
         pass
 
     def cb_draw(self, widget, cr):
+        start = time.perf_counter()
         allocation = self.widget_area.get_allocation()
         w = allocation.width
         h = allocation.height
-        main.drawarea_size = [w, h]
+        if self.zoom == 1.0:  # (Zoomed, the drawarea is sized from the canvas instead.)
+            main.drawarea_size = [w, h]
+
+        # Text size/alignment. Nodes are measured when created or renamed; after opening a tree all at once here.
+        if self.layout_pending:
+            treecore.measure_nodes(main)
+            self.layout_pending = False
+            self.tiles.clear()
+            self.minimap.tiles.clear()
+
+        # Only the invalidated part of the drawarea needs painting, from tiles that are rendered as they come into view.
+        clip_x0, clip_y0, clip_x1, clip_y1 = cr.clip_extents()
+        self.nodes_drawn = 0
+        self.tiles.draw(cr, clip_x0, clip_y0, clip_x1, clip_y1)
+        perf.add('draw', start, nodes=self.nodes_drawn)
+        if self.minimap_shown:
+            self.draw_minimap(cr)
+        if self.overlay_shown:
+            self.draw_overlay(cr)
+
+        if self.first_frame:  # The rest of starting up waits until the window has something on it.
+            self.first_frame = False
+            startup.mark("first frame")
+            GLib.idle_add(self.finish_startup)
+
+    # Timing overlay: percentiles of the recorded timings, in the top left corner of the visible part of the canvas.
+    # Drawn over the tiles, not into them, and redrawn every OVERLAY_INTERVAL while shown.
+    def toggle_overlay(self):
+        self.overlay_shown = not self.overlay_shown
+        if self.overlay_shown:
+            self.overlay_started = not perf.enabled
+            perf.enabled = True
+            self.overlay_timeout = GLib.timeout_add(OVERLAY_INTERVAL, self.cb_overlay_timeout)
+        else:
+            GLib.source_remove(self.overlay_timeout)
+            self.overlay_timeout = None
+            if self.overlay_started:  # Stop recording again, unless it was on before. (--perf)
+                perf.enabled = False
+        self.queue_overlay()
+
+    def cb_overlay_timeout(self):
+        self.queue_overlay()
+        return True
 
+    def queue_overlay(self):
+        if self.overlay_rect is not None:
+            x, y, w, h = self.overlay_rect
+            self.drawarea.queue_draw_area(int(x), int(y), int(w) + 1, int(h) + 1)
+        if not self.overlay_shown:
+            self.overlay_rect = None
+
+    def draw_overlay(self, cr):
+        lines = perf.summary() or ["Recording... (P: export trace)"]
+        x = self.scrolledwindow.get_hadjustment().get_value() + 8
+        y = self.scrolledwindow.get_vadjustment().get_value() + 8
+        cr.save()
+        cr.select_font_face("monospace", cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_NORMAL)
+        cr.set_font_size(12)
+        line_height = 15
+        width = max(cr.text_extents(line)[4] for line in lines) + 16
+        height = line_height * len(lines) + 12
+        if self.overlay_rect is not None and self.overlay_rect[:2] != (x, y):
+            self.queue_overlay()  # Scrolled: clear where it was.
+        self.overlay_rect = (x, y, width, height)
+        cr.set_source_rgba(0, 0, 0, 0.75)
+        cr.rectangle(x, y, width, height)
+        cr.fill()
+        cr.set_source_rgba(1, 1, 1, 1.0)
+        for i, line in enumerate(lines):
+            cr.move_to(x + 8, y + 6 + line_height * (i + 1) - 4)
+            cr.show_text(line)
+        cr.restore()
+
+    def export_trace(self):  # Write the recorded timings as a Chrome trace (chrome://tracing, Perfetto).
+        if not perf.events:
+            self.statusbar1.push(self.context_id1, "No timings recorded. (p shows the overlay and starts recording)")
+            return
+        filepath = os.path.join(main.tree_dirpath or os.getcwd(),
+                                time.strftime('savebrancher-trace-%Y%m%d-%H%M%S.json'))
+        try:
+            perf.export(filepath)
+        except OSError as e:
+            self.show_error("Couldn\'t write trace:", filepath + "\n" + str(e))
+            return
+        print('Trace: ' + filepath)
+        self.statusbar1.push(self.context_id1, "Trace written to " + filepath)
+
+    # Paint the nodes and edges in an area of the canvas. (Called by the tile cache for each tile it renders.)
+    # Detail depends on the scale it's painted at (zoom, or the minimap's scale): see TEXT_ZOOM etc.
+    def paint_area(self, cr, clip_x0, clip_y0, clip_x1, clip_y1):
+        zoom = cr.user_to_device_distance(1, 0)[0]
         cr.set_source_rgba(0, 0, 0, 1.0)
-        cr.rectangle(0, 0, main.drawarea_size[0] + main.drawarea_extra[0], main.drawarea_size[1] + main.drawarea_extra[1])
+        cr.rectangle(clip_x0, clip_y0, clip_x1 - clip_x0, clip_y1 - clip_y0)
         cr.fill()
-
-        # Text size/alignment.
-        #print (main.node_id_list)
-        for node_id in main.node_id_list:
-            node = Objects.nodes[node_id]
-            cr.set_font_size(32)
-            cr.select_font_face("m5x7")
-            node.text_x, node.text_y, node.text_width, node.text_height, dx, dy = cr.text_extents(node.text)
-            node.ext_width = node.text_width
-            node.ext_height = node.text_height
-            pad_width = 6 #node.w - padding
-            pad_height = 4 #node.h - padding
-            if node.text_width > pad_width:
-                node.ext_width = node.w + (node.text_width - pad_width)
-            else:
-                node.ext_width = node.w
-            if node.text_height > pad_height:
-                node.ext_height = node.h + (node.text_height - pad_height)
-            else:
-                node.ext_height = node.h
-
-        # Draw lines.
-        for node_id in main.node_id_list:
-            node = Objects.nodes[node_id]
-            for sub_node_id in node.sub_node_ids:
-                sub_node = Objects.nodes[sub_node_id]
-                arrow_length = 14
-                arrow_degrees = 10
-                # Arrow/Line Positions.
-                startx = node.x + (node.ext_width / 2)
-                starty = node.y + (node.ext_height / 2)
-                endx = sub_node.x + (sub_node.ext_width / 2)
-                endy = sub_node.y + (sub_node.ext_height / 2)
-                difx = (endx - startx) / 3
-                dify = (endy - starty) / 3
-                arrow_endx = endx - difx
-                arrow_endy = endy - dify
-
-                # Draw lines between nodes.
-                cr.set_line_cap(0)
-                cr.set_source_rgba(0.098039215, 0.4, 1, 1.0)
-                cr.move_to(startx, starty)
-                cr.set_line_width(4)
-                cr.set_dash([])
-                cr.line_to(endx, endy)
-                cr.stroke()
+        if zoom < BLOCK_ZOOM:
+            # Shade each cell of the node index by how many nodes are in it. (Cells are the same size at any zoom,
+            # so this costs about as much as the area painted.)
+            cs = Objects.grid.cell_size
+            for cx, cy, count in Objects.grid.counts(clip_x0, clip_y0, clip_x1 - clip_x0, clip_y1 - clip_y0):
+                cr.set_source_rgba(0.098039215, 0.4, 1, min(1.0, 0.3 + 0.1 * count))
+                cr.rectangle(cx * cs, cy * cs, cs, cs)
                 cr.fill()
+            return
+        detail = zoom >= TEXT_ZOOM
+        if detail:
+            Objects.layouts.apply_font(cr)
 
-                # Draw arrows between nodes.
-                line_angle = math.atan2(arrow_endy - endy, arrow_endx - endx) + math.pi
-                p1_x = arrow_endx + arrow_length * math.cos(line_angle - arrow_degrees)
-                p1_y = arrow_endy + arrow_length * math.sin(line_angle - arrow_degrees)
-                p2_x = arrow_endx + arrow_length * math.cos(line_angle + arrow_degrees)
-                p2_y = arrow_endy + arrow_length * math.sin(line_angle + arrow_degrees)
-                cr.set_line_cap(cairo.LINE_CAP_SQUARE)
-                cr.set_dash([])
-                cr.set_line_width(3)
+        # Draw lines.
+        for sub_node_id in Objects.edge_grid.within(clip_x0, clip_y0, clip_x1 - clip_x0, clip_y1 - clip_y0):
+            sub_node = Objects.nodes[sub_node_id]
+            node = Objects.nodes[sub_node.super_node_id]
+            arrow_length = 14
+            arrow_degrees = 10
+            # Arrow/Line Positions.
+            startx = node.x + (node.ext_width / 2)
+            starty = node.y + (node.ext_height / 2)
+            endx = sub_node.x + (sub_node.ext_width / 2)
+            endy = sub_node.y + (sub_node.ext_height / 2)
+            difx = (endx - startx) / 3
+            dify = (endy - starty) / 3
+            arrow_endx = endx - difx
+            arrow_endy = endy - dify
+
+            # Draw lines between nodes.
+            cr.set_line_cap(0)
+            if sub_node_id in self.path_node_ids:  # On the way from the selected node to its root.
+                cr.set_source_rgba(1, 1, 1, 1.0)
+            else:
                 cr.set_source_rgba(0.098039215, 0.4, 1, 1.0)
-                cr.move_to(p1_x, p1_y)
-                cr.line_to(arrow_endx, arrow_endy)
-                cr.line_to(p2_x, p2_y)
-                cr.line_to(p1_x, p1_y)
-                cr.close_path()
-                cr.stroke_preserve()
-                cr.fill()
+            cr.move_to(startx, starty)
+            cr.set_line_width(4 if detail else 1 / zoom)
+            cr.set_dash([])
+            cr.line_to(endx, endy)
+            cr.stroke()
+            cr.fill()
+            if not detail:
+                continue
+
+            # Draw arrows between nodes.
+            line_angle = math.atan2(arrow_endy - endy, arrow_endx - endx) + math.pi
+            p1_x = arrow_endx + arrow_length * math.cos(line_angle - arrow_degrees)
+            p1_y = arrow_endy + arrow_length * math.sin(line_angle - arrow_degrees)
+            p2_x = arrow_endx + arrow_length * math.cos(line_angle + arrow_degrees)
+            p2_y = arrow_endy + arrow_length * math.sin(line_angle + arrow_degrees)
+            cr.set_line_cap(cairo.LINE_CAP_SQUARE)
+            cr.set_dash([])
+            cr.set_line_width(3)
+            cr.move_to(p1_x, p1_y)
+            cr.line_to(arrow_endx, arrow_endy)
+            cr.line_to(p2_x, p2_y)
+            cr.line_to(p1_x, p1_y)
+            cr.close_path()
+            cr.stroke_preserve()
+            cr.fill()
 
-        for node_id in main.node_id_list:
+        visible_node_ids = Objects.grid.within(clip_x0 - 2, clip_y0 - 2, clip_x1 - clip_x0 + 4, clip_y1 - clip_y0 + 4)
+        if perf.enabled:
+            self.nodes_drawn += len(visible_node_ids)
+        for node_id in sorted(visible_node_ids, key=lambda node_id: Objects.nodes[node_id].render_index):
             node = Objects.nodes[node_id]
             # Draw boxes
             cr.set_line_width(4)
@@ -885,24 +1702,29 @@ class AppWindow(Gtk.ApplicationWindow):
             # !: Using dashed lines fudges the rectangle outward. Maybe just slightly adjusting them works. (+1.., -2..)
             if self.target_node_id == node_id:
                 cr.set_source_rgba(1, 1, 0, 1.0)
-                cr.rectangle(node.x+1, node.y+1, node.ext_width-2, node.ext_height-2)
-                cr.stroke()
-                cr.fill()
             elif node_id in self.selected_node_ids:
                 cr.set_source_rgba(1, 1, 1, 1.0)
-                cr.rectangle(node.x+1, node.y+1, node.ext_width-2, node.ext_height-2)
-                cr.stroke()
-                cr.fill()
+            elif node.pending:  # Save still being copied.
+                cr.set_source_rgba(0.4, 0.4, 0.4, 1.0)
             else:
                 cr.set_source_rgba(0.098039215, 0.4, 1, 1.0)
-                cr.rectangle(node.x+1, node.y+1, node.ext_width-2, node.ext_height-2)
-                cr.stroke()
+            if zoom < POINT_ZOOM:  # A few pixels in the middle.
+                cx, cy = node.center()
+                cr.rectangle(cx - 1.5 / zoom, cy - 1.5 / zoom, 3 / zoom, 3 / zoom)
                 cr.fill()
+                continue
+            if not detail:  # Filled box, no label.
+                cr.rectangle(node.x, node.y, node.ext_width, node.ext_height)
+                cr.fill()
+                continue
+            cr.rectangle(node.x+1, node.y+1, node.ext_width-2, node.ext_height-2)
+            cr.stroke()
+            cr.fill()
             cr.set_source_rgba(0, 0, 0, 1.0)
             cr.rectangle(node.x + 2, node.y + 2, node.ext_width - 4, node.ext_height - 4)
             cr.fill()
 
-            # Draw text.
+            # Draw text. (Boxes are sized before any tile is painted, see cb_draw.)
             cr.set_source_rgba(1, 1, 1, 1.0)
             cr.move_to((node.x + node.ext_width / 2) - node.text_width / 2 - node.text_x,
                        (node.y + node.ext_height / 2) - node.text_height / 2 - node.text_y)
@@ -918,7 +1740,11 @@ def on_activate(app):
     win.connect('key-press-event', win.cb_keypress)
     win.connect('key-release-event', win.cb_keyrelease)
     win.connect('focus-in-event', win.cb_focus_in)
+    win.connect('destroy', win.cb_destroy)
     win.show()
+    startup.mark("show")
+    # Tree file given on the command line.
+    win.startup_filepath = next((arg for arg in sys.argv[1:] if not arg.startswith('--')), None)
 
 
 def finish(self, widget, data=None):
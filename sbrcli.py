@@ -0,0 +1,197 @@
+#!/bin/env python3
+
+# SaveBrancher without the GUI, for scripts, batch jobs and emulator hotkeys:
+#   sbrcli.py new SOURCE                       Start a tree for a save file.
+#   sbrcli.py snapshot [--parent ID] LABEL     Add a node with the current source save. (Prints its id)
+#   sbrcli.py load ID                          Write a node's save to the source file and run the load hook.
+#   sbrcli.py ls [--tree]                      List nodes. (--tree: indented under their supernodes)
+#   sbrcli.py layout [--node ID]               Lay out the whole tree, or only the nodes below a node.
+#   sbrcli.py rm [--subtree] ID...             Remove nodes and delete their saves. (--subtree: with everything below)
+#   sbrcli.py export [--format json|csv]       Write the tree's nodes to stdout.
+#   sbrcli.py verify [--full] [--repair [--prune]]
+#                                              Check the saves against the tree and their checksums. (See integrity.py)
+# The tree file is given with -f or $SBR_TREE. Don't change a tree here while it's open in the GUI;
+# the GUI's next save would overwrite it.
+import argparse, csv, json, os, sys, time
+import hooks, integrity, loader, treecore
+from treecore import Objects
+
+
+def open_tree(args):
+    if not args.file:
+        sys.exit("No tree file given. (-f or $SBR_TREE)")
+    main, converted = treecore.load_tree(args.file)
+    return main
+
+
+def cmd_new(args):
+    main = treecore.tree_for_source(os.path.abspath(args.source))
+    os.makedirs(main.tree_dirpath, exist_ok=True)
+    if os.path.exists(main.tree_filepath):
+        sys.exit("Tree already exists: " + main.tree_filepath)
+    treecore.save_tree(main)
+    print(main.tree_filepath)
+
+
+def cmd_snapshot(args):
+    main = open_tree(args)
+    srcpath = args.source or main.source_filepath
+    if args.parent is not None and args.parent not in Objects.nodes:
+        sys.exit("No node %d." % args.parent)
+    node = treecore.add_node(main, args.label, treecore.new_node_position(args.parent), args.parent)
+    node.text_width = None  # Sized to its label when the GUI first draws it.
+    changed = [node.node_id]
+    if main.auto_layout and args.parent is not None:
+        changed.extend(treecore.layout_subtree(args.parent))
+    store = treecore.open_store(main)
+    treecore.snapshot_source(main, store, node, srcpath)
+    main.head_node_id = node.node_id
+    treecore.save_tree(main, changed)
+    print(node.node_id)
+
+
+def cmd_load(args):
+    start = time.perf_counter()
+    main = open_tree(args)
+    if args.node_id not in Objects.nodes:
+        sys.exit("No node %d." % args.node_id)
+    node = Objects.nodes[args.node_id]
+    store = treecore.open_store(main)
+    destpath = args.dest or main.source_filepath
+    hook = hooks.HookCache(os.path.dirname(os.path.abspath(__file__))).get(getattr(main, 'load_hook', None))
+    injector = loader.Loader()
+    hook.run_pre_load(node, destpath, main.source_filepath, injector)
+    treecore.write_save(main, store, node, destpath)
+    hook.run_post_load(node, destpath, main.source_filepath, injector)
+    injector.stop()
+    if destpath == main.source_filepath:
+        main.head_node_id = node.node_id
+        treecore.save_tree(main)
+    print('Load %d: %.1fms' % (node.node_id, (time.perf_counter() - start) * 1000))
+
+
+def cmd_ls(args):
+    main = open_tree(args)
+    if not args.tree:
+        for node_id in sorted(main.node_id_list):
+            node = Objects.nodes[node_id]
+            print('%6d %6s  %s' % (node_id, '' if node.super_node_id is None else node.super_node_id, node.text))
+        return
+    pending = [(0, node_id) for node_id in sorted(main.node_id_list, reverse=True)
+               if Objects.nodes[node_id].super_node_id is None]
+    while pending:
+        depth, node_id = pending.pop()
+        node = Objects.nodes[node_id]
+        print('%s%d %s' % ('  ' * depth, node_id, node.text))
+        pending.extend((depth + 1, sub_node_id) for sub_node_id in sorted(node.sub_node_ids, reverse=True))
+
+
+def cmd_layout(args):
+    start = time.perf_counter()
+    main = open_tree(args)
+    if args.node is None:
+        moved = treecore.layout_tree(main)
+    elif args.node in Objects.nodes:
+        moved = treecore.layout_subtree(args.node)
+    else:
+        sys.exit("No node %d." % args.node)
+    treecore.save_tree(main, moved)
+    print('Moved %d nodes in %.1fms' % (len(moved), (time.perf_counter() - start) * 1000))
+
+
+def cmd_rm(args):
+    start = time.perf_counter()
+    main = open_tree(args)
+    for node_id in args.node_ids:
+        if node_id not in Objects.nodes:
+            sys.exit("No node %d." % node_id)
+    if args.subtree:
+        removal = treecore.remove_subtrees(main, args.node_ids)
+    else:
+        removal = treecore.remove_nodes(main, args.node_ids)
+    store = treecore.open_store(main)
+    treecore.trash_saves(main, store, removal)  # Out of the tree's directory before the tree stops listing them.
+    treecore.save_tree(main, removal.linked_ids(), removal.node_ids())
+    treecore.reclaim_saves(main, store, removal)
+    print('Removed %d nodes in %.1fms' % (len(removal.nodes), (time.perf_counter() - start) * 1000))
+
+
+def cmd_verify(args):
+    main = open_tree(args)
+    store = treecore.open_store(main)
+    report, files = integrity.verify(main, store, args.full)
+    for line in report.lines():
+        print(line)
+    integrity.write_manifest(main, files)
+    if report.ok():
+        return
+    if not args.repair:
+        sys.exit(1)
+    changed, removal = integrity.repair(main, store, report, args.prune)
+    treecore.trash_saves(main, store, removal)
+    treecore.save_tree(main, changed, removal.node_ids())
+    treecore.reclaim_saves(main, store, removal)
+    print('Recovered %d nodes, moved %d files to the trash, removed %d nodes' %
+          (len([node_id for node_id, path in report.orphaned if node_id is not None]),
+           len([node_id for node_id, path in report.orphaned if node_id is None]), len(removal.nodes)))
+
+
+def cmd_export(args):
+    main = open_tree(args)
+    rows = []
+    for node_id in main.node_id_list:
+        node = Objects.nodes[node_id]
+        rows.append({'node_id': node_id, 'super_node_id': node.super_node_id, 'text': node.text,
+                     'x': node.x, 'y': node.y, 'snapshot': node.snapshot})
+    if args.format == 'csv':
+        writer = csv.DictWriter(sys.stdout, ['node_id', 'super_node_id', 'text', 'x', 'y', 'snapshot'])
+        writer.writeheader()
+        writer.writerows(rows)
+    else:
+        json.dump({'source_filepath': main.source_filepath, 'nodes': rows}, sys.stdout, indent=1)
+        print()
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(prog='sbrcli.py', description="SaveBrancher trees from the command line.")
+    parser.add_argument('-f', '--file', default=os.environ.get('SBR_TREE'), help="tree file (.sbr)")
+    commands = parser.add_subparsers(dest='command')
+    command = commands.add_parser('new', help="start a tree for a save file")
+    command.add_argument('source')
+    command.set_defaults(run=cmd_new)
+    command = commands.add_parser('snapshot', help="add a node with the current source save")
+    command.add_argument('label')
+    command.add_argument('--parent', type=int, help="id of the supernode")
+    command.add_argument('--source', help="save file to copy instead of the tree's source")
+    command.set_defaults(run=cmd_snapshot)
+    command = commands.add_parser('load', help="write a node's save to the source and run the load hook")
+    command.add_argument('node_id', type=int)
+    command.add_argument('--dest', help="write the save here instead of the tree's source")
+    command.set_defaults(run=cmd_load)
+    command = commands.add_parser('ls', help="list nodes")
+    command.add_argument('--tree', action='store_true', help="indent subnodes under their supernodes")
+    command.set_defaults(run=cmd_ls)
+    command = commands.add_parser('layout', help="lay out the tree's nodes")
+    command.add_argument('--node', type=int, help="only lay out the nodes below this one")
+    command.set_defaults(run=cmd_layout)
+    command = commands.add_parser('rm', help="remove nodes and delete their saves")
+    command.add_argument('node_ids', type=int, nargs='+')
+    command.add_argument('--subtree', action='store_true', help="also remove everything below the nodes")
+    command.set_defaults(run=cmd_rm)
+    command = commands.add_parser('export', help="write the tree's nodes to stdout")
+    command.add_argument('--format', choices=('json', 'csv'), default='json')
+    command.set_defaults(run=cmd_export)
+    command = commands.add_parser('verify', help="check the tree's saves, optionally repairing the tree")
+    command.add_argument('--full', action='store_true', help="hash every save, even unchanged ones")
+    command.add_argument('--repair', action='store_true', help="take orphaned node saves in again, trash other orphans")
+    command.add_argument('--prune', action='store_true', help="with --repair: remove nodes whose saves are missing or corrupt")
+    command.set_defaults(run=cmd_verify)
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return
+    args.run(args)
+
+
+if __name__ == '__main__':
+    cli()
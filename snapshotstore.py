@@ -0,0 +1,320 @@
+import bz2, gzip, hashlib, lzma, os, shutil, struct, threading, time
+import filecopy
+
+
+CHUNK_SIZE = 1024 * 1024  # Bytes read at a time while hashing/copying.
+
+# Delta objects: a header followed by copy/literal records against the base snapshot, block by block.
+# Copy records reuse a run of blocks from the base at the same offset, literal records carry one block of new data.
+BLOCK_SIZE = 4096
+DELTA_MAGIC = b'SBRD'
+DELTA_HEADER = struct.Struct('<4s64sIIQ')  # Magic, base hash, chain depth, block size, file size.
+DELTA_RECORD = struct.Struct('<cI')        # b'C' + number of blocks, or b'L' + length of the data that follows.
+DELTA_MAX_LITERAL = 0.5  # Store a full keyframe instead if more than this fraction of blocks changed.
+
+# Compression codecs for stored objects: name -> (file suffix, open function taking (path, mode)).
+# Objects are only ever read front to back, so any streaming file-like codec works. Others can be added with register_codec.
+CODECS = {}
+
+
+def register_codec(name, suffix, opener):
+    CODECS[name] = (suffix, opener)
+
+
+register_codec('zlib', '.gz', lambda path, mode: gzip.open(path, mode, compresslevel=6))
+register_codec('lzma', '.xz', lambda path, mode: lzma.open(path, mode))
+register_codec('bz2', '.bz2', lambda path, mode: bz2.open(path, mode))
+
+
+def hash_file(filepath):  # Content hash of a file, read in chunks so large states don't have to fit in memory.
+    h = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        chunk = f.read(CHUNK_SIZE)
+        while chunk:
+            h.update(chunk)
+            chunk = f.read(CHUNK_SIZE)
+    return h.hexdigest()
+
+
+def open_object(filepath, codec, mode='rb'):  # Open a stored object, (de)compressing with codec if it has one.
+    if codec is None:
+        return open(filepath, mode)
+    return CODECS[codec][1](filepath, mode)
+
+
+# Parsed delta object: which blocks it carries itself (block index -> (offset, length) in the uncompressed object).
+class DeltaMap(object):
+    def __init__(self, filepath, codec=None):
+        self.literals = {}
+        with open_object(filepath, codec) as f:
+            magic, base, self.depth, self.block_size, self.size = DELTA_HEADER.unpack(f.read(DELTA_HEADER.size))
+            if magic != DELTA_MAGIC:
+                raise ValueError("Not a delta object: " + filepath)
+            self.base = base.decode('ascii')
+            block = 0
+            record = f.read(DELTA_RECORD.size)
+            while record:
+                op, count = DELTA_RECORD.unpack(record)
+                if op == b'C':
+                    block += count
+                else:
+                    self.literals[block] = (f.tell(), count)
+                    f.seek(count, os.SEEK_CUR)
+                    block += 1
+                record = f.read(DELTA_RECORD.size)
+
+
+# Content-addressed object store for node save files. (hash -> blob)
+# Nodes keep the hash of their snapshot, identical snapshots are stored once and a blob is only
+# removed once no node references it anymore. Reference counts are rebuilt from the tree when it's opened.
+# A snapshot can also be stored as a delta against its parent's snapshot, with a full keyframe every
+# keyframe_interval steps along a chain so rebuilding a save never walks more than that many objects.
+# Objects can be compressed with any codec in CODECS; the suffix of the object file records which one,
+# so changing the compression setting never affects objects that are already stored.
+class SnapshotStore(object):
+    def __init__(self, tree_dirpath, compression=None):
+        self.dirpath = os.path.join(tree_dirpath, 'objects')
+        self.compression = compression  # Codec name for new objects. (None: stored raw)
+        self.refs = {}  # Snapshot hash -> number of nodes (and deltas based on it) referencing it.
+        self.delta_maps = {}  # Snapshot hash -> DeltaMap. Objects never change once written so these are kept.
+        self.locations = {}   # Snapshot hash -> (path, is delta, codec).
+        self.lock = threading.RLock()  # Snapshots are put/got/released from several worker threads at once.
+        self.stats = threading.local()  # last_put/last_get of the calling thread.
+
+    @property
+    def last_put(self):  # (size, stored size, seconds) of the last object stored by this thread.
+        return getattr(self.stats, 'last_put', None)
+
+    @property
+    def last_get(self):  # (size, seconds) of the last snapshot written out by this thread.
+        return getattr(self.stats, 'last_get', None)
+
+    def object_path(self, snapshot, delta=False, codec=None):  # Path of a snapshot stored as a full copy or a delta.
+        objpath = os.path.join(self.dirpath, snapshot[:2], snapshot)
+        if delta:
+            objpath += '.delta'
+        if codec is not None:
+            objpath += CODECS[codec][0]
+        return objpath
+
+    def locate(self, snapshot):  # (path, is delta, codec) of a stored snapshot, or None if it isn't stored.
+        if snapshot in self.locations:
+            return self.locations[snapshot]
+        for delta in (False, True):
+            for codec in [None] + list(CODECS):
+                objpath = self.object_path(snapshot, delta, codec)
+                if os.path.isfile(objpath):
+                    self.locations[snapshot] = (objpath, delta, codec)
+                    return self.locations[snapshot]
+        return None
+
+    def stored_path(self, snapshot):
+        location = self.locate(snapshot)
+        if location is None:
+            return self.object_path(snapshot)
+        return location[0]
+
+    def exists(self, snapshot):
+        return self.locate(snapshot) is not None
+
+    def open_snapshot(self, snapshot):
+        objpath, delta, codec = self.locate(snapshot)
+        return open_object(objpath, codec)
+
+    def delta_map(self, snapshot):  # DeltaMap of a snapshot, or None if it's stored in full (a keyframe).
+        if snapshot in self.delta_maps:
+            return self.delta_maps[snapshot]
+        objpath, delta, codec = self.locate(snapshot)
+        if not delta:
+            return None
+        dmap = DeltaMap(objpath, codec)
+        self.delta_maps[snapshot] = dmap
+        return dmap
+
+    def depth(self, snapshot):  # Number of deltas between a snapshot and its keyframe.
+        dmap = self.delta_map(snapshot)
+        if dmap is None:
+            return 0
+        return dmap.depth
+
+    def recount(self, snapshots):  # Rebuild reference counts from the snapshot hashes held by the tree's nodes.
+        self.refs = {}
+        pending = [snapshot for snapshot in snapshots if snapshot]
+        counted = set()
+        while pending:
+            snapshot = pending.pop()
+            self.refs[snapshot] = self.refs.get(snapshot, 0) + 1
+            if snapshot not in counted:
+                counted.add(snapshot)
+                if self.exists(snapshot):
+                    dmap = self.delta_map(snapshot)
+                    if dmap is not None:
+                        pending.append(dmap.base)  # Deltas hold a reference to their base.
+
+    def put(self, filepath, base=None, keyframe_interval=0):  # Store a file, returns its snapshot hash.
+        snapshot = hash_file(filepath)
+        # Referenced before anything is written: a release of the same snapshot by another thread (a node with the
+        # same save being reclaimed) can't delete it in between then.
+        with self.lock:
+            stored = self.exists(snapshot)
+            self.refs[snapshot] = self.refs.get(snapshot, 0) + 1
+        if stored:
+            self.stats.last_put = (os.path.getsize(filepath), 0, 0.0)  # Already stored: costs nothing.
+            return snapshot
+        try:
+            start = time.perf_counter()
+            os.makedirs(os.path.dirname(self.object_path(snapshot)), exist_ok=True)
+            stored_delta = False
+            if base and keyframe_interval > 1:
+                with self.lock:  # Hold on to the base while the delta is written, in case its node gets removed.
+                    if self.exists(base):
+                        self.refs[base] = self.refs.get(base, 0) + 1
+                    else:
+                        base = None
+                if base:
+                    try:
+                        depth = self.depth(base) + 1
+                        if depth < keyframe_interval:
+                            stored_delta = self.put_delta(filepath, snapshot, base, depth)
+                    finally:
+                        if not stored_delta:
+                            self.release(base)
+            if not stored_delta:
+                objpath = self.object_path(snapshot, False, self.compression)
+                temppath = '%s.%d.tmp' % (objpath, threading.get_ident())
+                if self.compression is None:
+                    filecopy.copy_file(filepath, temppath)
+                else:
+                    with open(filepath, 'rb') as src, open_object(temppath, self.compression, 'wb') as out:
+                        shutil.copyfileobj(src, out, CHUNK_SIZE)
+                    shutil.copystat(filepath, temppath)
+                os.replace(temppath, objpath)  # Only complete blobs ever appear under their hash.
+            self.stats.last_put = (os.path.getsize(filepath), os.path.getsize(self.stored_path(snapshot)),
+                                   time.perf_counter() - start)
+        except BaseException:
+            self.release(snapshot)
+            raise
+        return snapshot
+
+    def put_delta(self, filepath, snapshot, base, depth):  # Returns False if a delta isn't worth it.
+        chain = self.open_chain(base)
+        deltapath = self.object_path(snapshot, True, self.compression)
+        temppath = '%s.%d.tmp' % (deltapath, threading.get_ident())
+        try:
+            size = os.path.getsize(filepath)
+            nblocks = (size + BLOCK_SIZE - 1) // BLOCK_SIZE
+            literal_blocks = 0
+            with open(filepath, 'rb') as src, open_object(temppath, self.compression, 'wb') as out:
+                out.write(DELTA_HEADER.pack(DELTA_MAGIC, base.encode('ascii'), depth, BLOCK_SIZE, size))
+                copy_run = 0
+                for block in range(nblocks):
+                    data = src.read(BLOCK_SIZE)
+                    if data == self.chain_block(chain, block):
+                        copy_run += 1
+                        continue
+                    if copy_run:
+                        out.write(DELTA_RECORD.pack(b'C', copy_run))
+                        copy_run = 0
+                    out.write(DELTA_RECORD.pack(b'L', len(data)))
+                    out.write(data)
+                    literal_blocks += 1
+                if copy_run:
+                    out.write(DELTA_RECORD.pack(b'C', copy_run))
+            if literal_blocks > nblocks * DELTA_MAX_LITERAL:
+                os.remove(temppath)
+                return False
+            shutil.copystat(filepath, temppath)
+            os.replace(temppath, deltapath)
+        finally:
+            self.close_chain(chain)
+        return True  # Keeps the reference to the base taken in put.
+
+    # Open every object from a snapshot down to its keyframe. [(file, DeltaMap or None)]
+    # Blocks are read in order, so every object in the chain is only read forward and can be decompressed as a stream.
+    def open_chain(self, snapshot):
+        chain = []
+        while True:
+            dmap = self.delta_map(snapshot)
+            chain.append((self.open_snapshot(snapshot), dmap))
+            if dmap is None:
+                return chain
+            snapshot = dmap.base
+
+    def close_chain(self, chain):
+        for f, dmap in chain:
+            f.close()
+
+    def chain_block(self, chain, block):  # Contents of one block of the newest snapshot in a chain.
+        for f, dmap in chain:
+            if dmap is None:
+                f.seek(block * BLOCK_SIZE)
+                return f.read(BLOCK_SIZE)
+            if block in dmap.literals:
+                offset, length = dmap.literals[block]
+                f.seek(offset)
+                return f.read(length)
+            if block * BLOCK_SIZE >= dmap.size:
+                return b''
+        return b''
+
+    def get(self, snapshot, destpath):  # Write a stored snapshot out to destpath.
+        start = time.perf_counter()
+        objpath, delta, codec = self.locate(snapshot)
+        if not delta:
+            if codec is None:
+                filecopy.copy_file(objpath, destpath)
+            else:
+                with open_object(objpath, codec) as src, open(destpath, 'wb') as out:
+                    shutil.copyfileobj(src, out, CHUNK_SIZE)
+        else:
+            dmap = self.delta_map(snapshot)
+            chain = self.open_chain(snapshot)
+            try:
+                nblocks = (dmap.size + BLOCK_SIZE - 1) // BLOCK_SIZE
+                with open(destpath, 'wb') as out:
+                    for block in range(nblocks):
+                        out.write(self.chain_block(chain, block))
+                    out.truncate(dmap.size)
+            finally:
+                self.close_chain(chain)
+        self.stats.last_get = (os.path.getsize(destpath), time.perf_counter() - start)
+
+    def content_hash(self, snapshot):  # Hash of a stored snapshot's contents, rebuilt from its objects. (To verify them)
+        h = hashlib.sha256()
+        objpath, delta, codec = self.locate(snapshot)
+        if not delta:
+            with open_object(objpath, codec) as f:
+                chunk = f.read(CHUNK_SIZE)
+                while chunk:
+                    h.update(chunk)
+                    chunk = f.read(CHUNK_SIZE)
+        else:
+            dmap = self.delta_map(snapshot)
+            chain = self.open_chain(snapshot)
+            try:
+                for block in range((dmap.size + BLOCK_SIZE - 1) // BLOCK_SIZE):
+                    h.update(self.chain_block(chain, block)[:dmap.size - block * BLOCK_SIZE])
+            finally:
+                self.close_chain(chain)
+        return h.hexdigest()
+
+    def release(self, snapshot):  # Drop a reference; the blob is deleted when nothing references it anymore.
+        with self.lock:
+            count = self.refs.get(snapshot, 0) - 1
+            if count > 0:
+                self.refs[snapshot] = count
+                return False
+            self.refs.pop(snapshot, None)
+            dmap = None
+            if self.exists(snapshot):
+                try:
+                    dmap = self.delta_map(snapshot)
+                except Exception:  # Unreadable delta: deleted all the same, its base is left to verify --repair.
+                    pass
+            self.delta_maps.pop(snapshot, None)
+            location = self.locations.pop(snapshot, None)
+            if location is not None:
+                os.remove(location[0])
+            if dmap is not None:
+                self.release(dmap.base)
+            return True
@@ -0,0 +1,247 @@
+import contextlib, gc
+
+
+# Building an index (or anything else with a container per node) for a big tree creates so many objects at once that
+# Python's cyclic garbage collector keeps running in between, which can take longer than the building itself. None of
+# it is garbage yet, so collecting is paused until it's done.
+@contextlib.contextmanager
+def paused_gc():
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+# Uniform grid over the canvas for finding nodes under a point (or inside a rectangle) without scanning every node.
+# With spanning=True a box is listed in every cell it overlaps, which suits boxes of any size (edges).
+# Otherwise a box is only listed in the cell of its top-left corner and lookups also search the cells up to the
+# largest box size back, which makes indexing and moving a box a single cell operation (nodes).
+# Indexing everything can be put off until the grid is next searched (defer), so that opening a tree or laying all of
+# it out indexes each box once, after the last change, instead of on every change.
+class NodeGrid(object):
+    def __init__(self, cell_size=128, spanning=True):
+        self.cell_size = cell_size
+        self.spanning = spanning
+        self.cells = {}   # (cell x, cell y) -> set of node ids.
+        self.bounds = {}  # Node id -> (x, y, w, h) it was last indexed with.
+        self.max_w = 0    # Largest box indexed so far. (Only used without spanning.)
+        self.max_h = 0
+        self.deferred = None  # Function returning the boxes to index on the next search.
+
+    def defer(self, boxes):  # Drop the index and build it from boxes() on the next search. Until then changes are ignored.
+        self.cells = {}
+        self.bounds = {}
+        self.max_w = self.max_h = 0
+        self.deferred = boxes
+
+    def index_deferred(self):
+        if self.deferred is not None:
+            boxes, self.deferred = self.deferred, None
+            with paused_gc():
+                self.add_many(boxes())
+
+    def cell_range(self, x, y, w, h):  # Cells overlapped by a box. (x0, y0, x1, y1)
+        cs = self.cell_size
+        return (int(x // cs), int(y // cs), int((x + max(w, 1) - 1) // cs), int((y + max(h, 1) - 1) // cs))
+
+    def cells_of(self, x, y, w, h):  # Cells a box is listed in.
+        if self.spanning:
+            return self.cell_range(x, y, w, h)
+        cs = self.cell_size
+        cx, cy = int(x // cs), int(y // cs)
+        return cx, cy, cx, cy
+
+    def search_range(self, x, y, w, h):  # Cells that can list a box overlapping the area.
+        if self.spanning:
+            return self.cell_range(x, y, w, h)
+        return self.cell_range(x - self.max_w, y - self.max_h, w + self.max_w, h + self.max_h)
+
+    def update(self, node_id, x, y, w, h):  # Add a node or move it to its current box.
+        if self.deferred is not None:
+            return
+        old = self.bounds.get(node_id)
+        if old == (x, y, w, h):
+            return
+        if old is not None:
+            if self.cells_of(*old) == self.cells_of(x, y, w, h):
+                self.bounds[node_id] = (x, y, w, h)  # Still in the same cells.
+                self.max_w, self.max_h = max(self.max_w, w), max(self.max_h, h)
+                return
+            self.remove(node_id)
+        self.add_many([(node_id, x, y, w, h)])
+
+    def add_many(self, boxes):  # Index new nodes. (node id, x, y, w, h) each; ids must not be indexed yet.
+        cells = self.cells
+        bounds = self.bounds
+        max_w, max_h = self.max_w, self.max_h
+        cs = self.cell_size
+        for node_id, x, y, w, h in boxes:
+            bounds[node_id] = (x, y, w, h)
+            if w > max_w:
+                max_w = w
+            if h > max_h:
+                max_h = h
+            if not self.spanning:  # (cells_of, inlined: most of opening a big tree is spent here.)
+                key = (int(x // cs), int(y // cs))
+                cell = cells.get(key)
+                if cell is None:
+                    cells[key] = {node_id}
+                else:
+                    cell.add(node_id)
+                continue
+            x0, y0, x1, y1 = self.cells_of(x, y, w, h)
+            if x0 == x1 and y0 == y1:
+                cell = cells.get((x0, y0))
+                if cell is None:
+                    cells[(x0, y0)] = {node_id}
+                else:
+                    cell.add(node_id)
+                continue
+            for cx in range(x0, x1 + 1):
+                for cy in range(y0, y1 + 1):
+                    cells.setdefault((cx, cy), set()).add(node_id)
+        self.max_w, self.max_h = max_w, max_h
+
+    def remove(self, node_id):
+        if self.deferred is not None:
+            return
+        old = self.bounds.pop(node_id, None)
+        if old is None:
+            return
+        x0, y0, x1, y1 = self.cells_of(*old)
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                cell = self.cells.get((cx, cy))
+                if cell is not None:
+                    cell.discard(node_id)
+                    if not cell:
+                        del self.cells[(cx, cy)]
+
+    def at(self, x, y):  # Ids of all nodes whose box contains the point.
+        found = []
+        for node_id in self.within(x, y, 1, 1):
+            nx, ny, nw, nh = self.bounds[node_id]
+            if nx <= x < nx + nw and ny <= y < ny + nh:
+                found.append(node_id)
+        return found
+
+    def counts(self, x, y, w, h):  # (cell x, cell y, node count) of the cells in use in an area.
+        self.index_deferred()
+        x0, y0, x1, y1 = self.cell_range(x, y, w, h)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self.cells):
+            return [(cx, cy, len(cell)) for (cx, cy), cell in self.cells.items()
+                    if x0 <= cx <= x1 and y0 <= cy <= y1]
+        found = []
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                cell = self.cells.get((cx, cy))
+                if cell:
+                    found.append((cx, cy, len(cell)))
+        return found
+
+    def within(self, x, y, w, h):  # Ids of all nodes whose box overlaps the rectangle.
+        self.index_deferred()
+        x0, y0, x1, y1 = self.search_range(x, y, w, h)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self.cells):
+            # Rectangle covers more cells than are in use: only look at those.
+            keys = [key for key in self.cells if x0 <= key[0] <= x1 and y0 <= key[1] <= y1]
+        else:
+            keys = [(cx, cy) for cx in range(x0, x1 + 1) for cy in range(y0, y1 + 1)]
+        found = set()
+        for key in keys:
+            for node_id in self.cells.get(key, ()):
+                if node_id in found:
+                    continue
+                nx, ny, nw, nh = self.bounds[node_id]
+                if nx < x + w and x < nx + nw and ny < y + h and y < ny + nh:
+                    found.add(node_id)
+        return found
+
+
+# Grid for boxes of any size (edges: one between nodes far apart can be as wide as the tree). Boxes are sorted into
+# levels by size, each a NodeGrid without spanning whose cells are growth times bigger than the level below; a box goes
+# into the first level with cells at least as big as it. So indexing a box is a single cell operation whatever its
+# size, and a lookup only searches the cells around the area on each level in use.
+# Like NodeGrid's, indexing everything can be put off until the grid is next searched (defer), so opening a tree
+# doesn't index edges before anything is drawn.
+class EdgeGrid(object):
+    def __init__(self, cell_size=128, growth=4):
+        self.cell_size = cell_size
+        self.growth = growth
+        self.levels = {}    # Level -> NodeGrid with cells of cell_size * growth ** level.
+        self.level_of = {}  # Node id -> level it's indexed in.
+        self.deferred = None  # Function returning the boxes to index on the first search.
+
+    def level(self, w, h):  # Level for a box of this size.
+        size = max(w, h)
+        level = 0
+        cell_size = self.cell_size
+        while cell_size < size:
+            cell_size *= self.growth
+            level += 1
+        return level
+
+    def grid(self, level):
+        grid = self.levels.get(level)
+        if grid is None:
+            grid = NodeGrid(self.cell_size * self.growth ** level, spanning=False)
+            self.levels[level] = grid
+        return grid
+
+    def defer(self, boxes):  # Drop the index and build it from boxes() on the next search. Until then changes are ignored.
+        self.levels = {}
+        self.level_of = {}
+        self.deferred = boxes
+
+    def index_deferred(self):
+        if self.deferred is not None:
+            boxes, self.deferred = self.deferred, None
+            with paused_gc():
+                self.add_many(boxes())
+
+    def update(self, node_id, x, y, w, h):  # Add a box or move it to its current position and size.
+        if self.deferred is not None:
+            return
+        level = self.level(w, h)
+        old_level = self.level_of.get(node_id)
+        if old_level is not None and old_level != level:
+            self.levels[old_level].remove(node_id)
+        self.level_of[node_id] = level
+        self.grid(level).update(node_id, x, y, w, h)
+
+    def add_many(self, boxes):  # Index new boxes. (node id, x, y, w, h) each; ids must not be indexed yet.
+        by_level = {}
+        level_of = self.level_of
+        cell_size, growth = self.cell_size, self.growth
+        for box in boxes:
+            size = box[3] if box[3] > box[4] else box[4]
+            level = 0
+            level_size = cell_size
+            while level_size < size:  # (self.level, inlined.)
+                level_size *= growth
+                level += 1
+            level_of[box[0]] = level
+            level_boxes = by_level.get(level)
+            if level_boxes is None:
+                by_level[level] = [box]
+            else:
+                level_boxes.append(box)
+        for level, level_boxes in by_level.items():
+            self.grid(level).add_many(level_boxes)
+
+    def remove(self, node_id):
+        if self.deferred is not None:
+            return
+        level = self.level_of.pop(node_id, None)
+        if level is not None:
+            self.levels[level].remove(node_id)
+
+    def within(self, x, y, w, h):  # Ids of all boxes overlapping the rectangle.
+        self.index_deferred()
+        found = set()
+        for grid in self.levels.values():
+            found.update(grid.within(x, y, w, h))
+        return found
@@ -0,0 +1,81 @@
+import time
+import pytest
+import capture, snapshotstore
+
+SETTLE = 0.1
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture(params=['inotify', 'polling'])
+def watch(request, save, monkeypatch):  # watch(): SourceWatcher on a save; watch.captured lists what it reported.
+    if request.param == 'polling':
+        monkeypatch.setattr(capture, 'inotify_watch', lambda dirpath: None)
+    path = save('game.sav', b'first')
+    captured = []
+    watchers = []
+
+    def watch():
+        watcher = capture.SourceWatcher(path, captured.append, settle=SETTLE, poll_interval=0.02)
+        watchers.append(watcher)
+        assert wait_until(lambda: watcher.known_hash is not None)  # Started: the current contents aren't new.
+        return watcher
+    watch.path = path
+    watch.captured = captured
+    yield watch
+    for watcher in watchers:
+        watcher.stop()
+
+
+def write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def test_captures_once_settled(watch):
+    watch()
+    with open(watch.path, 'wb') as f:  # Written in several goes, like games do.
+        for chunk in (b'sec', b'ond ', b'save'):
+            f.write(chunk)
+            f.flush()
+            time.sleep(SETTLE / 4)
+    assert wait_until(lambda: watch.captured)
+    time.sleep(SETTLE * 2)
+    assert watch.captured == [snapshotstore.hash_file(watch.path)]
+
+
+def test_same_contents_skipped(watch):
+    watch()
+    write(watch.path, b'first')  # Written again, but nothing new.
+    time.sleep(SETTLE * 3)
+    write(watch.path, b'second')
+    assert wait_until(lambda: watch.captured)
+    write(watch.path, b'second')
+    time.sleep(SETTLE * 3)
+    assert len(watch.captured) == 1
+
+
+def test_expected_contents_skipped(watch, save):
+    watcher = watch()
+    watcher.expect(snapshotstore.hash_file(save('node.sav', b'loaded')))  # A node's save being loaded.
+    write(watch.path, b'loaded')
+    time.sleep(SETTLE * 3)
+    assert watch.captured == []
+    write(watch.path, b'played on')
+    assert wait_until(lambda: watch.captured)
+
+
+def test_stopped(watch):
+    watcher = watch()
+    watcher.stop()
+    watcher.thread.join(5)
+    write(watch.path, b'after')
+    time.sleep(SETTLE * 2)
+    assert watch.captured == [] and not watcher.thread.is_alive()
@@ -0,0 +1,53 @@
+import errno, os
+import pytest
+import filecopy
+
+
+@pytest.fixture(autouse=True)
+def no_cached_strategies(monkeypatch):
+    monkeypatch.setattr(filecopy, 'strategy_cache', {})
+
+
+def test_copy(tmp_path, save):
+    data = os.urandom(300000)
+    src = save('a.sav', data)
+    os.utime(src, (1000000000, 1000000000))
+    strategy = filecopy.copy_file(src, str(tmp_path / 'b.sav'))
+    assert strategy in filecopy.STRATEGIES
+    assert (tmp_path / 'b.sav').read_bytes() == data
+    assert os.stat(str(tmp_path / 'b.sav')).st_mtime == 1000000000  # Metadata too, like shutil.copy2.
+    assert filecopy.strategy_cache[filecopy.device_pair(src, str(tmp_path / 'b.sav'))] == strategy
+
+
+def test_unsupported_falls_back(tmp_path, save, monkeypatch):
+    def half_reflink(src, dest, size):  # Fails after writing some of it, which mustn't end up in the copy.
+        dest.write(b'x' * 100)
+        raise OSError(errno.EOPNOTSUPP, "Not here")
+
+    monkeypatch.setitem(filecopy.COPY_FUNCTIONS, 'reflink', half_reflink)
+    data = os.urandom(5000)
+    src = save('a.sav', data)
+    assert filecopy.copy_file(src, str(tmp_path / 'b.sav')) != 'reflink'
+    assert (tmp_path / 'b.sav').read_bytes() == data
+    # Remembered: the next copy between the same devices starts with what worked.
+    calls = []
+    monkeypatch.setitem(filecopy.COPY_FUNCTIONS, 'reflink', lambda src, dest, size: calls.append(size))
+    filecopy.copy_file(src, str(tmp_path / 'c.sav'))
+    assert calls == []
+
+
+def test_other_errors_are_raised(tmp_path, save, monkeypatch):
+    def broken(src, dest, size):
+        raise OSError(errno.EIO, "Disk on fire")
+
+    monkeypatch.setitem(filecopy.COPY_FUNCTIONS, 'reflink', broken)
+    with pytest.raises(OSError):
+        filecopy.copy_file(save('a.sav', b'save'), str(tmp_path / 'b.sav'))
+
+
+def test_log_goes_to_stderr(tmp_path, save, capsys):
+    filecopy.copy_file(save('a.sav', b'save'), str(tmp_path / 'b.sav'))
+    out, err = capsys.readouterr()
+    assert out == '' and 'Copied 4 bytes' in err
+    filecopy.copy_file(save('a.sav', b'save'), str(tmp_path / 'b.sav'), log=False)
+    assert capsys.readouterr() == ('', '')
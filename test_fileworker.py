@@ -0,0 +1,44 @@
+import threading, time
+import fileworker
+
+
+def test_same_key_runs_in_order():
+    worker = fileworker.FileWorker()
+    release = threading.Event()
+    order = []
+
+    def slow_copy():
+        release.wait()
+        order.append('copy')
+    worker.submit([1, 'game.sav'], slow_copy)
+    worker.submit([1], lambda: order.append('load'))  # Waits for the copy of the same node.
+    worker.submit([2], lambda: order.append('other'))  # Doesn't.
+    worker.submit([3, 'game.sav'], lambda: order.append('write'))  # Waits for the copy of the same file.
+    for i in range(100):
+        if order:
+            break
+        time.sleep(0.01)
+    time.sleep(0.05)  # Time for the waiting jobs to run too, if they wrongly didn't wait.
+    assert order == ['other']
+    release.set()
+    worker.flush()
+    assert order[0] == 'other' and order[1] == 'copy' and sorted(order[2:]) == ['load', 'write']
+    assert worker.last == {}
+
+
+def test_results_errors_and_progress():
+    changes, done = [], []
+    worker = fileworker.FileWorker(on_change=lambda jobs, size: changes.append((jobs, size)))
+    release = threading.Event()
+    worker.submit([1], lambda: release.wait() and 'copied', lambda result, error: done.append((result, error)), 100)
+    worker.submit([1], lambda: 1 / 0, lambda result, error: done.append((result, type(error))), 50)
+    assert changes == [(1, 100), (2, 150)]
+    release.set()
+    worker.flush()  # Returns once every on_done has been called.
+    assert done == [('copied', None), (None, ZeroDivisionError)]
+    assert changes[2:] == [(1, 50), (0, 0)]
+
+
+def test_file_size(save, tmp_path):
+    assert fileworker.file_size(save('a.sav', b'12345')) == 5
+    assert fileworker.file_size(str(tmp_path / 'missing.sav')) == 0
@@ -0,0 +1,77 @@
+import os
+import pytest
+import hooks, sbrcli, treecore
+
+
+@pytest.fixture
+def cache(tmp_path):  # HookCache on tmp_path. write(name, source) writes a hook file with a new mtime.
+    cache = hooks.HookCache(str(tmp_path))
+
+    def write(name, source):
+        path = tmp_path / name
+        mtime = path.stat().st_mtime_ns + 10 ** 9 if path.exists() else None
+        path.write_text(source)
+        if mtime is not None:  # (Same-second rewrites would otherwise keep the old mtime on some filesystems.)
+            os.utime(str(path), ns=(mtime, mtime))
+    cache.write = write
+    return cache
+
+
+CALLS = """
+calls = []
+def pre_load(node, save_path, source_path, loader):
+    calls.append(('pre', node, save_path, source_path, loader))
+def post_load(node, save_path, source_path, loader):
+    calls.append(('post', node, save_path, source_path, loader))
+"""
+
+
+def test_pre_and_post_load(cache):
+    cache.write(hooks.DEFAULT_HOOK, CALLS)
+    hook = cache.get()
+    hook.run_pre_load('node', 'game.sav', 'game.sav', 'loader')
+    hook.run_post_load('node', 'game.sav', 'game.sav', 'loader')
+    assert [call[0] for call in hook.namespace['calls']] == ['pre', 'post']
+    assert not hook.script
+
+
+def test_compiled_again_only_when_changed(cache):
+    cache.write('onloadscript-a.py', CALLS)
+    hook = cache.get('onloadscript-a.py')
+    assert cache.get('onloadscript-a.py') is hook
+    cache.write('onloadscript-a.py', "def post_load(node, save_path, source_path, loader):\n    pass\n")
+    assert cache.get('onloadscript-a.py') is not hook
+    assert cache.get('onloadscript-a.py').pre_load is None
+
+
+def test_older_script(cache, tmp_path):
+    cache.write(hooks.DEFAULT_HOOK, "open(filepath + '.loaded', 'w').write(str(node_id))\n")
+    hook = cache.get()  # Only run on loads, not when compiled.
+    assert hook.script and not list(tmp_path.glob('*.loaded'))
+    node = treecore.Node('Save', (0, 0), 7)
+    hook.run_pre_load(node, str(tmp_path / 'game.sav'), None, None)
+    assert not (tmp_path / 'game.sav.loaded').exists()
+    hook.run_post_load(node, str(tmp_path / 'game.sav'), None, None)
+    assert (tmp_path / 'game.sav.loaded').read_text() == '7'
+
+
+def test_available(cache):
+    for name in ('onloadscript-b.py', hooks.DEFAULT_HOOK, 'onloadscript-a.py', 'other.py'):
+        cache.write(name, '')
+    assert cache.available() == [hooks.DEFAULT_HOOK, 'onloadscript-a.py', 'onloadscript-b.py']
+    assert hooks.profile_name('onloadscript-a.py') == 'a' and hooks.profile_name(hooks.DEFAULT_HOOK) == "Default"
+
+
+def test_load_passes_the_written_save(main, save, tmp_path, monkeypatch):
+    # With the snapshot store, the node's save is an object file in the store; the hooks get the save written out.
+    cache = hooks.HookCache(str(tmp_path))
+    (tmp_path / hooks.DEFAULT_HOOK).write_text(CALLS)
+    monkeypatch.setattr(hooks, 'HookCache', lambda dirpath: cache)
+    main.use_store = True
+    treecore.save_tree(main)
+    sbrcli.cli(['-f', main.tree_filepath, 'snapshot', 'root'])
+    dest = str(tmp_path / 'copy.sav')
+    sbrcli.cli(['-f', main.tree_filepath, 'load', '0', '--dest', dest])
+    calls = cache.get().namespace['calls']
+    assert [(call[0], call[1].node_id, call[2], call[3]) for call in calls] == \
+        [('pre', 0, dest, main.source_filepath), ('post', 0, dest, main.source_filepath)]
@@ -0,0 +1,121 @@
+import os
+import pytest
+import integrity, treecore
+from snapshotstore import BLOCK_SIZE
+from treecore import Objects
+
+
+# Tree of nodes 0 <- 1 <- 2 <- 3 <- 4, each save a block different from its supernode's, stored as a delta chain.
+# Node 5 is a root kept as its own file.
+@pytest.fixture
+def chain(main, store, save):
+    src = main.source_filepath
+    main.use_store = True
+    main.keyframe_interval = 10
+    data = bytearray(os.urandom(8 * BLOCK_SIZE))
+    super_node_id = None
+    for i in range(5):
+        data[i * BLOCK_SIZE] ^= 1
+        save('game.sav', data)
+        node = treecore.add_node(main, 'Save %d' % i, (0, 60 * i), super_node_id)
+        treecore.snapshot_source(main, store, node, src)
+        super_node_id = node.node_id
+    main.use_store = False
+    treecore.snapshot_source(main, store, treecore.add_node(main, 'File', (100, 0)), src)
+    treecore.save_tree(main)
+    return main
+
+
+def corrupt_literal(store, snapshot):  # Flip a byte of a delta's own data, keeping it parseable.
+    path = store.stored_path(snapshot)
+    offset, length = next(iter(store.delta_map(snapshot).literals.values()))
+    with open(path, 'r+b') as f:
+        f.seek(offset + 10)
+        byte = f.read(1)
+        f.seek(offset + 10)
+        f.write(bytes([byte[0] ^ 0xff]))
+
+
+def test_clean_tree(chain, store):
+    main = chain
+    report, files = integrity.verify(main, store)
+    assert report.ok(), report.lines()
+    assert report.hashed == 6
+    integrity.write_manifest(main, files)
+    report, files = integrity.verify(main, store)
+    assert report.ok() and report.hashed == 0  # Nothing changed since the manifest.
+
+
+def test_corrupt_base_is_found_incrementally(chain, store):
+    main = chain
+    report, files = integrity.verify(main, store)
+    integrity.write_manifest(main, files)
+    corrupt_literal(store, Objects.nodes[1].snapshot)
+    report, files = integrity.verify(main, store)
+    full, full_files = integrity.verify(main, store, full=True)
+    # Nodes 2-4 are built on node 1's delta: they're checked again although their own files didn't change.
+    expected = sorted(os.path.relpath(store.stored_path(Objects.nodes[node_id].snapshot), main.tree_dirpath)
+                      for node_id in (1, 2, 3, 4))
+    assert sorted(path for path, reason in report.corrupt) == expected
+    assert sorted(path for path, reason in full.corrupt) == expected
+
+
+def test_prune_removes_whole_chain(chain, store):
+    main = chain
+    report, files = integrity.verify(main, store)
+    integrity.write_manifest(main, files)
+    corrupt_literal(store, Objects.nodes[1].snapshot)
+    report, files = integrity.verify(main, store)
+    changed, removal = integrity.repair(main, store, report, prune=True)
+    assert sorted(removal.node_ids()) == [1, 2, 3, 4]
+    treecore.trash_saves(main, store, removal)
+    treecore.save_tree(main, changed, removal.node_ids())
+    treecore.reclaim_saves(main, store, removal)
+    store = treecore.open_store(main)
+    report, files = integrity.verify(main, store, full=True)
+    assert report.ok(), report.lines()  # The broken objects went with the last nodes referencing them.
+    assert sorted(main.node_id_list) == [0, 5]
+
+
+def test_missing_base(chain, store):
+    main = chain
+    os.remove(store.stored_path(Objects.nodes[2].snapshot))
+    store = treecore.open_store(main)
+    report, files = integrity.verify(main, store)
+    assert [node_id for node_id, path in report.missing] == [2]
+    changed, removal = integrity.repair(main, store, report, prune=True)
+    assert sorted(removal.node_ids()) == [2, 3, 4]
+
+
+def test_orphans(chain, store):
+    main = chain
+    stray = os.path.join(main.tree_dirpath, 'notes.txt.tmp')
+    with open(stray, 'w') as f:
+        f.write('half written')
+    os.utime(stray, (0, 0))  # Long ago.
+    node_file = treecore.node_filepath(main, 9)
+    with open(node_file, 'w') as f:
+        f.write('a save nobody has')
+    report, files = integrity.verify(main, store)
+    assert sorted(report.orphaned, key=str) == sorted([(None, 'notes.txt.tmp'), (9, os.path.basename(node_file))], key=str)
+    changed, removal = integrity.repair(main, store, report)
+    assert 9 in changed and Objects.nodes[9].text == 'Recovered 9'
+    assert not os.path.exists(stray)
+    trash = os.path.join(main.tree_dirpath, treecore.TRASH_DIRNAME)
+    treecore.empty_trash(main)  # Repair orphans are kept.
+    assert any(name.startswith('orphans.') for name in os.listdir(trash))
+    report, files = integrity.verify(main, store)
+    assert report.ok(), report.lines()
+
+
+def test_temp_file_being_written(chain, store):
+    main = chain
+    writing = [os.path.join(main.tree_dirpath, main.tree_filename + '.12345.tmp'),
+               store.object_path(Objects.nodes[1].snapshot) + '.12345.tmp']
+    for path in writing:
+        with open(path, 'w') as f:
+            f.write('still being written')
+    report, files = integrity.verify(main, store)
+    assert report.ok(), report.lines()
+    integrity.repair(main, store, report)
+    assert all(os.path.exists(path) for path in writing)
@@ -0,0 +1,67 @@
+import os, shlex, sys
+import pytest
+import loader
+
+FAKE = shlex.quote(sys.executable) + ' ' + shlex.quote(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                    'fakeinjector.py'))
+PRESS = ['keydown --window 12345 F7', 'keyup --window 12345 F7', 'getwindowname 12345']
+
+
+@pytest.fixture(params=['script', 'buffered'])
+def injector(request, tmp_path, monkeypatch):  # Loader on fakeinjector.py; commands() lists what the fake got.
+    logpath = tmp_path / 'injector.log'
+    monkeypatch.setenv('FAKEINJECTOR_LOG', str(logpath))
+    monkeypatch.delenv('FAKEINJECTOR_BADWINDOWS', raising=False)
+    if request.param == 'buffered':
+        monkeypatch.setenv('FAKEINJECTOR_BUFFERED', '1')
+    else:
+        monkeypatch.delenv('FAKEINJECTOR_BUFFERED', raising=False)
+    injector = loader.Loader(FAKE)
+
+    def commands():
+        if not logpath.exists():
+            return []
+        return [line.split(' ', 1)[1] for line in logpath.read_text().splitlines()]
+    injector.commands = commands
+    injector.mode = request.param
+    yield injector
+    injector.stop()
+
+
+def test_press(injector):
+    injector.press('mednafen', 'F7')
+    injector.press('mednafen', 'F7')
+    commands = injector.commands()
+    if injector.mode == 'script':
+        # One process, started with a probe; every batch ends with a token.
+        assert injector.script_mode
+        assert commands == ['search --classname mednafen', 'exec --sync echo sbr-done-1'] + \
+            PRESS + ['exec --sync echo sbr-done-2'] + PRESS + ['exec --sync echo sbr-done-3']
+    else:
+        # The probe never comes back: each press starts the injector with the commands chained on its command line.
+        assert injector.script_mode is False
+        assert [command for command in commands if not command.startswith('exec')] == \
+            ['search --classname mednafen'] + PRESS + PRESS
+
+
+def test_stale_window_is_searched_again(injector, monkeypatch):
+    monkeypatch.setenv('FAKEINJECTOR_BADWINDOWS', '999')
+    injector.windows['mednafen'] = '999'  # Looked up before the emulator was restarted.
+    injector.press('mednafen', 'F7')
+    assert injector.windows['mednafen'] == '12345'
+    commands = [command for command in injector.commands() if not command.startswith('exec')]
+    assert commands[0] == 'keydown --window 999 F7'  # (The rest of that batch may have run too.)
+    assert [command for command in commands if '999' not in command] == ['search --classname mednafen'] + PRESS
+
+
+def test_window_keeps_failing(injector, monkeypatch):
+    monkeypatch.setenv('FAKEINJECTOR_BADWINDOWS', '12345')
+    with pytest.raises(loader.InjectorError):
+        injector.press('mednafen', 'F7')
+    assert 'mednafen' not in injector.windows
+
+
+def test_no_window(injector, monkeypatch):
+    monkeypatch.setenv('FAKEINJECTOR_WINDOW', '')
+    with pytest.raises(loader.InjectorError):
+        injector.press('mednafen', 'F7')
@@ -0,0 +1,70 @@
+import os, threading
+import pytest
+import persistence, treedb
+
+
+def test_write_atomic_replaces(tmp_path, save):
+    path = save('tree.sbr', b'old')
+    persistence.write_atomic(path, b'new')
+    assert (tmp_path / 'tree.sbr').read_bytes() == b'new'
+    assert os.listdir(str(tmp_path)) == ['tree.sbr']  # No temp file left behind.
+
+
+def test_write_atomic_failure_keeps_old(tmp_path, save, monkeypatch):
+    path = save('tree.sbr', b'old')
+
+    def no_rename(src, dst):
+        raise OSError("Disk full")
+    monkeypatch.setattr(os, 'replace', no_rename)
+    with pytest.raises(OSError):
+        persistence.write_atomic(path, b'new')
+    assert (tmp_path / 'tree.sbr').read_bytes() == b'old'
+
+
+def test_burst_is_written_once(tmp_path):
+    written = []
+    started, release = threading.Event(), threading.Event()
+
+    def apply(filepath, state):
+        written.append(state)
+        started.set()
+        release.wait()
+    writer = persistence.TreeWriter(apply=apply)
+    writer.submit('a.sbr', 1)
+    started.wait()
+    for state in range(2, 10):  # While the first write is still going.
+        writer.submit('a.sbr', state)
+    release.set()
+    writer.flush()
+    assert written == [1, 9]  # Only the newest state of the burst.
+
+
+def test_merge(tmp_path):
+    written = []
+    started, release = threading.Event(), threading.Event()
+
+    def apply(filepath, changes):
+        written.append(changes)
+        started.set()
+        release.wait()
+    writer = persistence.TreeWriter(apply=apply, merge=lambda older, newer: older.merge(newer))
+    writer.submit('a.sqlite', treedb.TreeChanges({}, {0: 'root'}))
+    started.wait()
+    writer.submit('a.sqlite', treedb.TreeChanges({}, {1: 'a'}))
+    writer.submit('a.sqlite', treedb.TreeChanges({}, {2: 'b', 1: None}))
+    release.set()
+    writer.flush()
+    assert [changes.nodes for changes in written] == [{0: 'root'}, {1: None, 2: 'b'}]  # Nothing dropped.
+
+
+def test_encode_and_errors(tmp_path):
+    errors, saved = [], []
+    writer = persistence.TreeWriter(encode=lambda state: state, on_error=lambda path, e: errors.append(path),
+                                    on_saved=saved.append)
+    path = str(tmp_path / 'tree.sbr')
+    writer.submit(path, b'tree')
+    writer.submit(str(tmp_path / 'missing' / 'tree.sbr'), b'tree')
+    writer.flush()
+    assert (tmp_path / 'tree.sbr').read_bytes() == b'tree'
+    assert saved == [path] and errors == [str(tmp_path / 'missing' / 'tree.sbr')]
+    assert isinstance(writer.write(str(tmp_path / 'missing' / 'tree.sbr'), b'tree'), OSError)  # Returned, not raised.
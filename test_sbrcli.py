@@ -0,0 +1,12 @@
+import sbrcli
+
+
+def test_snapshot_prints_only_the_id(main, capsys):
+    sbrcli.cli(['new', main.source_filepath])
+    capsys.readouterr()
+    sbrcli.cli(['-f', main.tree_filepath, 'snapshot', 'root'])
+    sbrcli.cli(['-f', main.tree_filepath, 'snapshot', '--parent', '0', 'next'])
+    out, err = capsys.readouterr()
+    assert out == '0\n1\n'  # Copy statistics go to stderr.
+    sbrcli.cli(['-f', main.tree_filepath, 'ls'])
+    assert capsys.readouterr()[0].split() == ['0', 'root', '1', '0', 'next']
@@ -0,0 +1,96 @@
+import hashlib, os, threading
+import pytest
+import snapshotstore
+from snapshotstore import BLOCK_SIZE, SnapshotStore
+
+
+def stored_files(store):
+    return sorted(filename for dirpath, dirnames, filenames in os.walk(store.dirpath) for filename in filenames)
+
+
+@pytest.mark.parametrize('codec', [None] + sorted(snapshotstore.CODECS))
+def test_put_get_release(tmp_path, save, codec):
+    store = SnapshotStore(str(tmp_path), codec)
+    data = os.urandom(3 * BLOCK_SIZE + 17)
+    src = save('a.sav', data)
+    snapshot = store.put(src)
+    assert snapshot == snapshotstore.hash_file(src)
+    assert store.put(src) == snapshot  # Stored once, referenced twice.
+    assert len(stored_files(store)) == 1
+    assert store.locate(snapshot)[2] == codec
+    store.get(snapshot, str(tmp_path / 'out.sav'))
+    assert (tmp_path / 'out.sav').read_bytes() == data
+    assert store.content_hash(snapshot) == snapshot
+    assert not store.release(snapshot)
+    assert store.exists(snapshot)
+    assert store.release(snapshot)
+    assert stored_files(store) == []
+
+
+@pytest.mark.parametrize('codec', [None, 'zlib'])
+def test_delta_chain(tmp_path, save, codec):
+    store = SnapshotStore(str(tmp_path), codec)
+    data = bytearray(os.urandom(8 * BLOCK_SIZE + 100))
+    versions = []
+    base = None
+    for i in range(4):
+        data[i * BLOCK_SIZE] ^= 0xff
+        versions.append(bytes(data))
+        base = store.put(save('src.sav', data), base, keyframe_interval=3)
+        assert store.content_hash(base) == snapshotstore.hash_file(str(tmp_path / 'src.sav'))
+    snapshots = [hashlib.sha256(version).hexdigest() for version in versions]
+    # Keyframe, two deltas, then a keyframe again: chains are never longer than the interval.
+    assert [store.depth(snapshot) for snapshot in snapshots] == [0, 1, 2, 0]
+    assert [store.locate(snapshot)[1] for snapshot in snapshots] == [False, True, True, False]
+    for snapshot, version in zip(snapshots, versions):
+        store.get(snapshot, str(tmp_path / 'out.sav'))
+        assert (tmp_path / 'out.sav').read_bytes() == version
+    # A delta keeps its base, even once nothing else references it.
+    assert not store.release(snapshots[1])
+    store.get(snapshots[2], str(tmp_path / 'out.sav'))
+    assert (tmp_path / 'out.sav').read_bytes() == versions[2]
+    for snapshot in (snapshots[0], snapshots[2], snapshots[3]):
+        store.release(snapshot)
+    assert stored_files(store) == []
+
+
+def test_delta_not_worth_it(tmp_path, save):
+    store = SnapshotStore(str(tmp_path))
+    base = store.put(save('a.sav', os.urandom(4 * BLOCK_SIZE)))
+    snapshot = store.put(save('b.sav', os.urandom(4 * BLOCK_SIZE)), base, keyframe_interval=10)
+    assert store.delta_map(snapshot) is None
+    assert store.refs[base] == 1  # The reference taken for the delta is given back.
+
+
+def test_recount(tmp_path, save):
+    store = SnapshotStore(str(tmp_path))
+    data = bytearray(os.urandom(4 * BLOCK_SIZE))
+    base = store.put(save('a.sav', data))
+    data[0] ^= 1
+    snapshot = store.put(save('a.sav', data), base, keyframe_interval=4)
+    refs = dict(store.refs)
+    store = SnapshotStore(str(tmp_path))
+    store.recount([base, snapshot, None])
+    assert store.refs == refs == {base: 2, snapshot: 1}
+
+
+def test_put_while_same_snapshot_is_released(tmp_path, save):
+    store = SnapshotStore(str(tmp_path))
+    src = save('a.sav', os.urandom(BLOCK_SIZE))
+    snapshot = store.put(src)  # Referenced by a node that's being reclaimed on another thread...
+    exists = store.exists
+    releasing = []
+
+    def exists_then_release(checked):  # ...right after a new node with the same save found it stored.
+        found = exists(checked)
+        if checked == snapshot and not releasing:
+            releasing.append(threading.Thread(target=store.release, args=(snapshot,)))
+            releasing[0].start()
+            releasing[0].join(0.2)  # (Waits for the store's lock, if put holds it.)
+        return found
+
+    store.exists = exists_then_release
+    assert store.put(src) == snapshot
+    releasing[0].join()
+    assert store.refs[snapshot] == 1
+    assert exists(snapshot)
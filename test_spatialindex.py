@@ -0,0 +1,72 @@
+import random
+import pytest
+import spatialindex, treecore
+from treecore import Objects
+
+
+def overlapping(boxes, x, y, w, h):  # What within should find, by looking at every box.
+    return {node_id for node_id, (nx, ny, nw, nh) in boxes.items()
+            if nx < x + w and x < nx + nw and ny < y + h and y < ny + nh}
+
+
+def random_boxes(rng, count, largest):
+    return {node_id: (rng.uniform(-500, 3000), rng.uniform(-500, 3000), rng.uniform(1, largest), rng.uniform(1, largest))
+            for node_id in range(count)}
+
+
+@pytest.mark.parametrize('make_grid', [lambda: spatialindex.NodeGrid(), lambda: spatialindex.NodeGrid(spanning=False),
+                                       lambda: spatialindex.EdgeGrid()], ids=['spanning', 'corner', 'edges'])
+def test_within_matches_a_scan(make_grid):
+    rng = random.Random(1)
+    boxes = random_boxes(rng, 500, 400)
+    grid = make_grid()
+    grid.add_many((node_id,) + box for node_id, box in boxes.items())
+    for node_id in range(0, 500, 3):  # Moved and resized, some across cells and levels.
+        boxes[node_id] = (boxes[node_id][0] + rng.uniform(-300, 300), boxes[node_id][1], rng.uniform(1, 2000), 30)
+        grid.update(node_id, *boxes[node_id])
+    for node_id in range(0, 500, 7):
+        del boxes[node_id]
+        grid.remove(node_id)
+    for i in range(200):
+        area = (rng.uniform(-600, 3000), rng.uniform(-600, 3000), rng.uniform(1, 700), rng.uniform(1, 700))
+        assert grid.within(*area) == overlapping(boxes, *area)
+
+
+def test_at():
+    grid = spatialindex.NodeGrid(spanning=False)
+    grid.add_many([(1, 0, 0, 100, 20), (2, 90, 10, 300, 20), (3, 500, 500, 10, 10)])
+    assert sorted(grid.at(95, 15)) == [1, 2]
+    assert grid.at(100, 5) == []  # Right edge is outside the box.
+    assert grid.at(380, 25) == [2]  # Far from the cell of its corner.
+    grid.update(3, 95, 15, 10, 10)
+    assert sorted(grid.at(96, 16)) == [1, 2, 3]
+    assert grid.at(505, 505) == []
+
+
+def test_defer():
+    grid = spatialindex.NodeGrid()
+    grid.add_many([(1, 0, 0, 10, 10)])
+    boxes = [(1, 50, 50, 10, 10), (2, 200, 0, 10, 10)]
+    calls = []
+    grid.defer(lambda: calls.append(1) or boxes)
+    grid.update(1, 999, 999, 10, 10)  # Ignored: the whole index is built again anyway.
+    grid.remove(2)
+    assert calls == []
+    assert grid.at(5, 5) == [] and grid.at(55, 55) == [1] and grid.at(205, 5) == [2]
+    grid.within(0, 0, 1000, 1000)
+    assert calls == [1]  # Only built once.
+    grid.update(1, 0, 0, 10, 10)
+    assert grid.at(5, 5) == [1]
+
+
+def test_node_at_is_topmost():
+    main = treecore.Main()
+    Objects.clear()
+    bottom = treecore.add_node(main, 'Save', (0, 0))
+    top = treecore.add_node(main, 'Save', (50, 50))
+    assert treecore.node_at(60, 60) is top
+    main.bring_top(bottom.node_id)
+    assert treecore.node_at(60, 60) is bottom
+    assert treecore.node_at(10, 10) is bottom
+    assert treecore.node_at(140, 140) is top
+    assert treecore.node_at(200, 10) is None
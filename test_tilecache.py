@@ -0,0 +1,57 @@
+import pytest
+cairo = pytest.importorskip('cairo')
+import tilecache
+
+
+@pytest.fixture
+def tiles():  # TileCache of 100px tiles; tiles.painted lists the canvas areas it rendered.
+    painted = []
+
+    def paint(cr, x0, y0, x1, y1):
+        painted.append((x0, y0, x1, y1))
+        cr.set_source_rgb(1, 1, 1)
+        cr.rectangle(x0, y0, x1 - x0, y1 - y0)
+        cr.fill()
+    tiles = tilecache.TileCache(paint, tile_size=100, memory_budget=4 * 100 * 100 * 4)
+    tiles.painted = painted
+    return tiles
+
+
+def draw(tiles, x0, y0, x1, y1):
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, 400, 400)
+    tiles.draw(cairo.Context(surface), x0, y0, x1, y1)
+
+
+def test_rendered_once(tiles):
+    draw(tiles, 50, 0, 150, 100)
+    assert sorted(tiles.painted) == [(0, 0, 100, 100), (100, 0, 200, 100)]
+    draw(tiles, 0, 0, 200, 100)
+    assert len(tiles.painted) == 2  # Drawn from the cache.
+
+
+def test_invalidate(tiles):
+    draw(tiles, 0, 0, 200, 200)
+    tiles.invalidate(90, 10, 20, 20)  # Across two tiles.
+    assert sorted(tiles.tiles) == [(0, 1), (1, 1)]
+    del tiles.painted[:]
+    draw(tiles, 0, 0, 200, 200)
+    assert sorted(tiles.painted) == [(0, 0, 100, 100), (100, 0, 200, 100)]
+    tiles.invalidate(-1000, -1000, 5000, 5000)  # Bigger than the cache: only the tiles in use are looked at.
+    assert not tiles.tiles
+
+
+def test_least_recently_used_evicted(tiles):
+    draw(tiles, 0, 0, 200, 200)
+    draw(tiles, 0, 0, 100, 100)  # (0, 0) used last.
+    draw(tiles, 200, 0, 300, 100)  # Over the budget of 4 tiles.
+    assert list(tiles.tiles) == [(1, 0), (1, 1), (0, 0), (2, 0)]
+    draw(tiles, 0, 0, 300, 300)  # A frame keeps all of its own tiles, then evicts.
+    assert len(tiles.tiles) == 4
+
+
+def test_scale(tiles):
+    tiles.set_scale(2.0)
+    draw(tiles, 100, 0, 200, 100)  # Scaled coordinates; painted in canvas coordinates.
+    assert tiles.painted == [(50, 0, 100, 50)]
+    tiles.invalidate(60, 10, 1, 1)
+    assert not tiles.tiles
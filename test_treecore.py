@@ -0,0 +1,105 @@
+import os, subprocess
+import pytest
+import treecore
+from treecore import Objects
+
+
+# Tree of node saves kept as files:  0 -> 1 -> 3, 0 -> 2 -> 4, 2 -> 5
+@pytest.fixture
+def tree(main, store):
+    for super_node_id in (None, 0, 0, 1, 2, 2):
+        node = treecore.add_node(main, 'Save', (0, 0), super_node_id)
+        treecore.snapshot_source(main, store, node, main.source_filepath)
+    return main
+
+
+def links():
+    return {node_id: node.super_node_id for node_id, node in Objects.nodes.items()}
+
+
+def test_link_refuses_cycles(tree, store):
+    main = tree
+    assert not treecore.link(4, 0)
+    assert not treecore.link(2, 2)
+    assert treecore.link(4, 1)
+    assert Objects.nodes[1].super_node_id == 4
+    assert Objects.ancestry.subtree(2) == [2, 4, 1, 3, 5]
+
+
+def test_remove_and_undo(tree, store):
+    main = tree
+    before = links()
+    removal = treecore.remove_nodes(main, [2, 3])
+    assert sorted(main.node_id_list) == [0, 1, 4, 5]
+    assert Objects.nodes[4].super_node_id is None and Objects.nodes[5].super_node_id is None
+    treecore.trash_saves(main, store, removal)
+    assert not os.path.exists(treecore.node_filepath(main, 2))
+    treecore.restore_nodes(main, removal)
+    assert treecore.untrash_saves(main, store, removal)
+    assert links() == before
+    assert os.path.exists(treecore.node_filepath(main, 2))
+    assert Objects.ancestry.subtree(0) == [0, 1, 3, 2, 4, 5]
+
+
+def test_undo_skips_links_that_would_make_a_cycle(tree, store):
+    main = tree
+    removal = treecore.remove_nodes(main, [2])
+    assert treecore.link(4, 0)  # 0 is below 4 now, so 2 can't go below 0 and above 4 again.
+    treecore.restore_nodes(main, removal)
+    assert Objects.nodes[2].super_node_id == 0
+    assert Objects.nodes[4].super_node_id is None
+    assert Objects.nodes[5].super_node_id == 2
+    for node_id in Objects.nodes:
+        assert Objects.ancestry.path_to_root(node_id)[-1] == 4
+
+
+def test_reclaim(tree, store):
+    main = tree
+    removal = treecore.remove_subtrees(main, [2])
+    assert sorted(removal.node_ids()) == [2, 4, 5]
+    treecore.trash_saves(main, store, removal)
+    trash_dirpath = removal.trash_dirpath
+    assert len(os.listdir(trash_dirpath)) == 3
+    treecore.reclaim_saves(main, store, removal)
+    assert not os.path.exists(trash_dirpath)
+    assert not any(os.path.exists(treecore.node_filepath(main, node_id)) for node_id in (2, 4, 5))
+
+
+def test_empty_trash_keeps_live_batches(tree, store):
+    main = tree
+    trash = os.path.join(main.tree_dirpath, treecore.TRASH_DIRNAME)
+    finished = subprocess.Popen(['true'])
+    finished.wait()
+    names = ['%d.1' % os.getpid(), '%d.2' % finished.pid, 'orphans.1700000000']
+    for name in names:
+        os.makedirs(os.path.join(trash, name))
+    treecore.empty_trash(main)
+    assert sorted(os.listdir(trash)) == sorted([names[0], names[2]])
+
+
+def test_untrash_after_trash_was_emptied(tree, store):
+    main = tree
+    removal = treecore.remove_nodes(main, [3])
+    treecore.trash_saves(main, store, removal)
+    os.rename(removal.trash_dirpath, removal.trash_dirpath + '.gone')
+    treecore.restore_nodes(main, removal)
+    assert not treecore.untrash_saves(main, store, removal)
+    assert removal.trash_dirpath is None
+
+
+class FakeLayouts(object):  # Labels 10 wide per character, 8 high.
+    def text_extents(self, text):
+        return 0, -8, 10 * len(text), 8
+
+
+def test_measure_nodes(tree, monkeypatch):
+    main = tree
+    monkeypatch.setattr(Objects, 'layouts', FakeLayouts())
+    Objects.nodes[3].text = 'A much longer label'
+    Objects.grid.within(0, 0, 1, 1)  # Indexed with the unmeasured 100x100 boxes.
+    treecore.measure_nodes(main)
+    assert (Objects.nodes[3].ext_width, Objects.nodes[3].ext_height) == (20 + 190 - 6, 20 + 8 - 4)
+    assert (Objects.nodes[0].ext_width, Objects.nodes[0].ext_height) == (20 + 40 - 6, 20 + 8 - 4)
+    assert treecore.node_at(150, 10) is Objects.nodes[3]  # Re-indexed with the measured boxes.
+    assert treecore.node_at(30, 10) is Objects.nodes[5]  # Topmost of the short ones.
+    assert treecore.node_at(30, 30) is None
@@ -0,0 +1,43 @@
+import treecore, treedb
+from treecore import Objects
+
+
+def row(node_id, super_node_id=None, text='Save'):
+    return (node_id, super_node_id, 10.0 * node_id, 0.0, node_id, 100.0, 20.0, text, None)
+
+
+def test_apply(tmp_path):
+    database = treedb.TreeDB(str(tmp_path / 'tree.sqlite'))
+    database.apply(treedb.TreeChanges({'window_size': [800, 600]}, {0: row(0), 1: row(1, 0), 2: row(2, 0)}))
+    database.apply(treedb.TreeChanges({'storage': 'sqlite'}, {1: row(1, 0, 'Renamed'), 2: None}))
+    assert database.settings() == {'window_size': [800, 600], 'storage': 'sqlite'}
+    assert list(database.nodes()) == [row(0), row(1, 0, 'Renamed')]
+    database.apply(treedb.TreeChanges({'storage': 'sqlite'}, {5: row(5)}, replace=True))
+    assert database.settings() == {'storage': 'sqlite'} and list(database.nodes()) == [row(5)]
+    database.close()
+
+
+def test_merge():
+    older = treedb.TreeChanges({'a': 1}, {0: row(0), 1: row(1)})
+    merged = older.merge(treedb.TreeChanges({'b': 2}, {1: None, 2: row(2)}))
+    assert merged.settings == {'a': 1, 'b': 2} and merged.nodes == {0: row(0), 1: None, 2: row(2)}
+    replacing = treedb.TreeChanges({}, {3: row(3)}, replace=True)
+    assert older.merge(replacing) is replacing  # Everything before it is overwritten anyway.
+
+
+def test_tree_round_trip(main):
+    main.storage = 'sqlite'
+    root = treecore.add_node(main, 'Root', (0, 0))
+    sub = treecore.add_node(main, 'Sub', (0, 100), root.node_id)
+    treecore.add_node(main, 'Gone', (0, 200), root.node_id)
+    treedb.connect(treedb.db_path(main.tree_filepath)).apply(treecore.tree_changes(main, replace=True))
+    treecore.save_tree(main)
+    main.bring_top(root.node_id)
+    sub.text = 'Renamed'
+    treecore.remove_nodes(main, [2])
+    treecore.save_tree(main, [root.node_id, sub.node_id], [2])  # Only the rows that changed.
+    loaded, converted = treecore.load_tree(main.tree_filepath)
+    assert not converted and list(loaded.node_id_list) == [1, 0]
+    assert Objects.nodes[1].text == 'Renamed' and Objects.nodes[1].super_node_id == 0
+    assert Objects.nodes[0].sub_node_ids == [1] and 2 not in Objects.nodes
+    assert loaded.next_render_index > Objects.nodes[0].render_index  # New nodes still go on top.
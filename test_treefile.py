@@ -0,0 +1,92 @@
+import json, os, pickle, struct
+import pytest
+import treecore, treefile
+from treecore import Objects
+
+
+SETTINGS = {'source_filename': 'game.sav', 'next_node_id': 2, 'storage': 'file'}
+NODES = [(0, None, 10.0, 20.0, 0, 40.0, 24.0, 'Start', None),
+         (1, 0, 10.5, 80.0, 1, 60.0, 24.0, 'Boss ✓', 'ab' * 32),
+         (2, 0, 90.0, 80.0, 2, 20.0, 20.0, '', None)]
+
+
+def test_encode_decode(save):
+    path = save('tree.sbr', treefile.encode_tree(SETTINGS, NODES))
+    assert treefile.is_tree_file(path)
+    tree = treefile.TreeFile(path)
+    assert tree.settings == SETTINGS
+    assert tree.node_count == len(NODES)
+    decoded = []
+    for (node_id, super_node_id, x, y, render_index, ext_width, ext_height,
+         label_offset, label_length, snapshot_offset, snapshot_length) in tree.records():
+        decoded.append((node_id, None if super_node_id < 0 else super_node_id, x, y, render_index, ext_width,
+                        ext_height, tree.string(label_offset, label_length),
+                        tree.string(snapshot_offset, snapshot_length) if snapshot_length else None))
+    assert decoded == NODES
+
+
+def test_newer_version(save):
+    data = bytearray(treefile.encode_tree(SETTINGS, NODES))
+    struct.pack_into('<H', data, len(treefile.MAGIC), treefile.VERSION + 1)
+    path = save('tree.sbr', data)
+    with pytest.raises(ValueError):
+        treefile.TreeFile(path)
+
+
+def test_load_tree(save):
+    path = save('tree.sbr', treefile.encode_tree(SETTINGS, NODES))
+    main, converted = treecore.load_tree(path)
+    assert not converted
+    assert list(main.node_id_list) == [0, 1, 2]
+    assert Objects.nodes[0].sub_node_ids == [1, 2]
+    assert Objects.nodes[1].text == 'Boss ✓'
+    assert Objects.nodes[1].snapshot == 'ab' * 32
+    assert Objects.edge_grid.within(0, 0, 200, 200) == {1, 2}  # Edges indexed on the first search.
+
+
+def test_legacy_json(tmp_path):
+    path = str(tmp_path / 'tree.sbr')
+    old = [{'next_node_id': 1, 'source_filename': 'game.sav', 'node_id_list': [0, 1]},
+           {'node_id': 0, 'text': 'Start', 'x': 5, 'y': 5},
+           {'node_id': 1, 'text': 'Next', 'x': 5, 'y': 60, 'super_node_id': 0, 'snapshot': 'cd' * 32}]
+    with open(path, 'w') as f:
+        json.dump(old, f)
+    main, converted = treecore.load_tree(path)
+    assert converted
+    assert os.path.exists(path + '.bak')
+    assert main.source_filename == 'game.sav'
+    assert Objects.nodes[1].super_node_id == 0
+    assert Objects.nodes[1].snapshot == 'cd' * 32
+    # Written in the current format from then on.
+    main.tree_filepath = path
+    treecore.save_tree(main)
+    assert treefile.is_tree_file(path)
+    main, converted = treecore.load_tree(path)
+    assert not converted and Objects.nodes[1].text == 'Next'
+
+
+class OldNode(object):  # Pickled with this module's name; loaded without it through treefile.LegacyObject.
+    pass
+
+
+class OldMain(object):
+    pass
+
+
+def test_legacy_pickle(tmp_path):
+    oldmain = OldMain()
+    oldmain.source_filename = 'game.sav'
+    oldmain.next_obj_id = 5
+    oldmain.obj_list = []
+    for obj_id, text in ((3, 'Start'), (5, 'End')):
+        node = OldNode()
+        node.obj_id, node.text, node.x, node.y, node.ext_width, node.ext_height = obj_id, text, 1, 2, 30, 20
+        oldmain.obj_list.append(node)
+    path = str(tmp_path / 'tree.sbr')
+    with open(path, 'wb') as f:
+        pickle.dump(oldmain, f)
+    settings, nodes = treefile.load_legacy(path)
+    assert settings == {'source_filename': 'game.sav', 'next_node_id': 5}
+    assert [(node['node_id'], node['text']) for node in nodes] == [(3, 'Start'), (5, 'End')]
+    main, converted = treecore.load_tree(path)
+    assert converted and main.next_node_id == 5
@@ -0,0 +1,76 @@
+import pytest
+import treecore, treelayout
+from treecore import Objects
+from treelayout import LEVEL_GAP, SIBLING_GAP
+
+
+@pytest.fixture
+def nodes():  # add(super_node_id, width): a node with a box of that width, 20 high. Returns its id.
+    main = treecore.Main()
+    Objects.clear()
+
+    def add(super_node_id=None, width=100):
+        node = treecore.add_node(main, 'Save', (0, 0), super_node_id)
+        node.ext_width, node.ext_height = width, 20
+        return node.node_id
+    add.main = main
+    return add
+
+
+def test_tidy_tree(nodes):
+    root = nodes()
+    a, b = nodes(root), nodes(root, 40)
+    a1, a2, b1 = nodes(a), nodes(a), nodes(b)
+    positions = treelayout.tidy_layout(Objects.nodes, [root], 10, 10)
+    assert sorted(positions) == sorted(Objects.nodes)
+    center = {node_id: x + Objects.nodes[node_id].ext_width / 2 for node_id, (x, y) in positions.items()}
+    assert [positions[node_id][1] for node_id in (root, a, a1)] == [10, 10 + 20 + LEVEL_GAP, 10 + 2 * (20 + LEVEL_GAP)]
+    assert center[a] == (center[a1] + center[a2]) / 2  # Centered over its subnodes.
+    assert center[root] == (center[a] + center[b]) / 2
+    assert center[b1] == center[b]
+    assert positions[a2][0] - (positions[a1][0] + 100) == SIBLING_GAP  # Packed as close as allowed.
+    assert positions[b1][0] >= positions[a2][0] + 100 + SIBLING_GAP  # Subtrees don't overlap.
+    assert min(x for x, y in positions.values()) == 10
+
+
+def test_forest_side_by_side(nodes):
+    first, second = nodes(), nodes()
+    nodes(first), nodes(first), nodes(second)
+    positions = treelayout.tidy_layout(Objects.nodes, [second, first])
+    first_tree = [positions[node_id][0] for node_id in Objects.ancestry.subtree(first)]
+    second_tree = [positions[node_id][0] for node_id in Objects.ancestry.subtree(second)]
+    assert max(second_tree) + 100 + SIBLING_GAP <= min(first_tree)
+
+
+def test_long_chain(nodes):  # Deeper than Python's recursion limit.
+    node_id = nodes()
+    for i in range(5000):
+        node_id = nodes(node_id)
+    positions = treelayout.tidy_layout(Objects.nodes, [0])
+    assert len(set(x for x, y in positions.values())) == 1
+    assert positions[node_id][1] == 5000 * (20 + LEVEL_GAP)
+
+
+def test_layout_tree_reindexes(nodes):
+    root = nodes()
+    node_ids = [nodes(root) for i in range(20)]
+    moved = treecore.layout_tree(nodes.main)
+    assert sorted(moved) == sorted(Objects.nodes)
+    for node_id in [root] + node_ids:  # Found where they are now, on a grid built again for them.
+        node = Objects.nodes[node_id]
+        assert treecore.node_at(node.x + 1, node.y + 1) is node
+        assert node_id == root or node_id in Objects.edge_grid.within(*node.center() + (1, 1))
+    assert treecore.node_at(0, 0) is None
+
+
+def test_layout_subtree(nodes):
+    root = nodes()
+    sub = nodes(root)
+    Objects.nodes[sub].x, Objects.nodes[sub].y = 500, 500
+    leaves = [nodes(sub), nodes(sub)]
+    treecore.layout_subtree(sub)
+    assert (Objects.nodes[sub].x, Objects.nodes[sub].y) == (500, 500)  # Stays where it is.
+    assert [Objects.nodes[node_id].y for node_id in leaves] == [500 + 20 + LEVEL_GAP] * 2
+    assert (Objects.nodes[root].x, Objects.nodes[root].y) == (0, 0)
+    leaf = Objects.nodes[leaves[1]]
+    assert treecore.node_at(leaf.x + 1, leaf.y + 1) is leaf
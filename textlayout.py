@@ -0,0 +1,31 @@
+import cairo
+
+
+FONT_FACE = "m5x7"
+FONT_SIZE = 32
+
+
+# Text extents of node labels, measured once per font and text on a scratch surface instead of on every draw.
+class LayoutCache(object):
+    def __init__(self, font_face=FONT_FACE, font_size=FONT_SIZE):
+        self.surface = cairo.ImageSurface(cairo.FORMAT_A8, 1, 1)
+        self.cr = cairo.Context(self.surface)
+        self.extents = {}  # (font face, font size, text) -> (x bearing, y bearing, width, height)
+        self.set_font(font_face, font_size)
+
+    def set_font(self, font_face, font_size):  # Changing the font invalidates every measured text.
+        self.font_face = font_face
+        self.font_size = font_size
+        self.cr.select_font_face(font_face)
+        self.cr.set_font_size(font_size)
+        self.extents = {}
+
+    def apply_font(self, cr):  # Set the font the cached extents were measured with on a drawing context.
+        cr.select_font_face(self.font_face)
+        cr.set_font_size(self.font_size)
+
+    def text_extents(self, text):
+        key = (self.font_face, self.font_size, text)
+        if key not in self.extents:
+            self.extents[key] = self.cr.text_extents(text)[:4]
+        return self.extents[key]
@@ -0,0 +1,74 @@
+import cairo, math
+from collections import OrderedDict
+
+
+TILE_SIZE = 256
+MEMORY_BUDGET = 64 * 1024 * 1024  # Bytes of tile surfaces kept around.
+
+
+# Offscreen cache of the canvas in fixed-size tiles. Tiles are rendered when they're first drawn,
+# kept until something inside them changes and evicted least recently used first once over the memory budget.
+# paint(cr, x0, y0, x1, y1) must paint that part of the canvas in canvas coordinates.
+# Tiles are rendered at scale (canvas zoom): draw() takes scaled coordinates, invalidate() canvas coordinates.
+class TileCache(object):
+    def __init__(self, paint, tile_size=TILE_SIZE, memory_budget=MEMORY_BUDGET):
+        self.paint = paint
+        self.scale = 1.0
+        self.tile_size = tile_size
+        self.tile_bytes = tile_size * tile_size * 4  # ARGB32
+        self.max_tiles = max(1, memory_budget // self.tile_bytes)
+        self.tiles = OrderedDict()  # (tile x, tile y) -> ImageSurface, least recently used first.
+
+    def tile_range(self, x0, y0, x1, y1):  # Tiles covering the area x0..x1, y0..y1.
+        ts = self.tile_size
+        return (int(math.floor(x0 / ts)), int(math.floor(y0 / ts)),
+                int(math.ceil(x1 / ts)) - 1, int(math.ceil(y1 / ts)) - 1)
+
+    def render(self, key):
+        ts = self.tile_size
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, ts, ts)
+        cr = cairo.Context(surface)
+        cr.translate(-key[0] * ts, -key[1] * ts)
+        s = self.scale
+        cr.scale(s, s)
+        self.paint(cr, key[0] * ts / s, key[1] * ts / s, (key[0] + 1) * ts / s, (key[1] + 1) * ts / s)
+        surface.flush()
+        return surface
+
+    def draw(self, cr, x0, y0, x1, y1):  # Paint the area x0..x1, y0..y1 onto cr from the cache.
+        ts = self.tile_size
+        tx0, ty0, tx1, ty1 = self.tile_range(x0, y0, x1, y1)
+        for tx in range(tx0, tx1 + 1):
+            for ty in range(ty0, ty1 + 1):
+                key = (tx, ty)
+                surface = self.tiles.get(key)
+                if surface is None:
+                    surface = self.render(key)
+                    self.tiles[key] = surface
+                else:
+                    self.tiles.move_to_end(key)
+                cr.set_source_surface(surface, tx * ts, ty * ts)
+                cr.rectangle(tx * ts, ty * ts, ts, ts)
+                cr.fill()
+        # Evict after drawing so a frame never throws away its own tiles.
+        while len(self.tiles) > self.max_tiles:
+            self.tiles.popitem(last=False)
+
+    def invalidate(self, x, y, w, h):  # Drop the tiles overlapping a changed area. (In canvas coordinates)
+        s = self.scale
+        tx0, ty0, tx1, ty1 = self.tile_range(x * s, y * s, (x + w) * s, (y + h) * s)
+        if (tx1 - tx0 + 1) * (ty1 - ty0 + 1) > len(self.tiles):
+            for key in [key for key in self.tiles if tx0 <= key[0] <= tx1 and ty0 <= key[1] <= ty1]:
+                del self.tiles[key]
+            return
+        for tx in range(tx0, tx1 + 1):
+            for ty in range(ty0, ty1 + 1):
+                self.tiles.pop((tx, ty), None)
+
+    def clear(self):
+        self.tiles = OrderedDict()
+
+    def set_scale(self, scale):  # Render at another zoom. (Drops every tile)
+        if scale != self.scale:
+            self.scale = scale
+            self.clear()
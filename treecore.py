@@ -0,0 +1,696 @@
+import itertools, os, re, shutil, sys
+from collections import OrderedDict
+import filecopy, hooks, persistence, snapshotstore, spatialindex, treedb, treefile, treelayout
+
+
+# The tree itself, without any GUI: nodes, the tree file and the node saves. Used by savebrancher.py and sbrcli.py.
+# Only one tree is open at a time: its nodes are in Objects, its settings in a Main.
+
+
+# Where every node is in the tree: the nodes in depth-first order, so each node is followed by its whole subtree.
+# "Is a above b" is then two comparisons and a subtree is a slice. Built from the links the first time it's
+# needed after they changed (changed() is called by everything that links or unlinks nodes).
+# Nodes that aren't below a root (only possible through a cycle in a broken tree file) are answered by
+# following their supernodes instead.
+class Ancestry(object):
+    def __init__(self):
+        self.valid = False
+        self.order = []  # Node ids, depth first.
+        self.enter = {}  # Node id -> index in order.
+        self.size = {}   # Node id -> number of nodes in its subtree, itself included.
+        self.depth = {}  # Node id -> number of supernodes above it.
+
+    def changed(self):
+        self.valid = False
+
+    def build(self):
+        nodes = Objects.nodes
+        order = []
+        enter = {}
+        size = {}
+        depth = {}
+        pending = [(node_id, 0) for node_id, node in nodes.items() if node.super_node_id not in nodes]
+        pending.reverse()
+        while pending:
+            node_id, d = pending.pop()
+            if d < 0:  # Past the end of its subtree.
+                size[node_id] = len(order) - enter[node_id]
+                continue
+            if node_id in enter:
+                continue
+            enter[node_id] = len(order)
+            order.append(node_id)
+            depth[node_id] = d
+            pending.append((node_id, -1))
+            for sub_node_id in reversed(nodes[node_id].sub_node_ids):
+                if sub_node_id in nodes:
+                    pending.append((sub_node_id, d + 1))
+        self.order, self.enter, self.size, self.depth = order, enter, size, depth
+        self.valid = True
+
+    def is_ancestor(self, node_id, of_node_id):  # Whether node_id is of_node_id or one of its supernodes.
+        if not self.valid:
+            self.build()
+        enter = self.enter
+        if node_id in enter and of_node_id in enter:
+            return enter[node_id] <= enter[of_node_id] < enter[node_id] + self.size[node_id]
+        return node_id in self.path_to_root(of_node_id)
+
+    def subtree(self, node_id):  # The node and every node below it, depth first.
+        if not self.valid:
+            self.build()
+        if node_id not in self.enter:
+            return [node_id]
+        start = self.enter[node_id]
+        return self.order[start:start + self.size[node_id]]
+
+    def roots(self):  # Node id -> id of the root it's below. (Nodes that aren't below a root are left out.)
+        if not self.valid:
+            self.build()
+        roots = {}
+        root_id = None
+        for node_id in self.order:
+            if self.depth[node_id] == 0:
+                root_id = node_id
+            roots[node_id] = root_id
+        return roots
+
+    def path_to_root(self, node_id):  # The node and its supernodes, up to the root.
+        path = []
+        seen = set()
+        while node_id in Objects.nodes and node_id not in seen:
+            seen.add(node_id)
+            path.append(node_id)
+            node_id = Objects.nodes[node_id].super_node_id
+        return path
+
+
+# Everything refers to objects by id so they can be saved as json. Here we keep the references to the actual objects.
+class Objects(object):
+    nodes = {}
+    grid = spatialindex.NodeGrid(spanning=False)  # Node boxes by position, for hit-testing.
+    edge_grid = spatialindex.EdgeGrid()  # Edge bounding boxes by the id of the edge's subnode, for drawing only what's visible.
+    ancestry = Ancestry()  # Subtrees and supernodes. (See Ancestry)
+    layouts = None  # textlayout.LayoutCache measuring node texts; set by the GUI. (Kept between trees.)
+
+    @classmethod
+    def clear(cls):
+        cls.nodes = {}
+        cls.grid = spatialindex.NodeGrid(spanning=False)
+        cls.edge_grid = spatialindex.EdgeGrid()
+        cls.ancestry = Ancestry()
+
+
+EDGE_PAD = 16  # Space around a node box/edge that lines, arrows and outlines can paint into.
+LAYOUT_MARGIN = 20  # Space left above and left of an automatically laid out tree.
+TRASH_DIRNAME = 'trash'  # Saves of removed nodes wait in here (in the tree's directory) until they're reclaimed.
+
+
+class Main(object):
+    def __init__(self):
+        self.node_id_list = OrderedDict()  # Node ids in rendering order, bottom to top. (Keys only, referencable in Objects.nodes)
+        self.next_node_id = -1
+        self.next_render_index = 0  # Render indices only ever increase, so raising a node doesn't renumber the others.
+        self.drawarea_size = []
+        self.drawarea_extra = [0, 0]  # Extra amount of drawarea that is scrollable.
+        self.window_size = [1280, 960]
+        self.source_filepath = None  # This will be None while an sbr file is not accessed and source is not known.
+        self.source_filename = None
+        self.tree_filename = None
+        self.tree_dirpath = None
+        self.tree_filepath = None
+        self.use_store = False  # Keep node saves in the deduplicating snapshot store instead of one copy per node.
+        self.keyframe_interval = 0  # Store appended saves as deltas against their parent, with a full copy every n. (0: off)
+        self.compression = None  # Codec from snapshotstore.CODECS that new snapshots are compressed with. (None: off)
+        self.storage = 'file'  # 'file': nodes are saved in the tree file. 'sqlite': in a database, a row per changed node.
+        self.load_hook = hooks.DEFAULT_HOOK  # File name of the hook run when loading a save. (See hooks.py)
+        self.auto_layout = False  # Lay out a node's subtree again when a node is appended to it. (See treelayout.py)
+        self.auto_capture = False  # Append a node whenever the game writes a new save to the source. (See capture.py)
+        self.head_node_id = None  # Node the source save was last loaded from or saved as; captures go below it.
+
+    def new_node_id(self):  # New object IDs.
+        self.next_node_id += 1
+        return self.next_node_id
+
+    def new_render_index(self):
+        self.next_render_index += 1
+        return self.next_render_index - 1
+
+    def clear_nodes(self):  # Empty the rendering list. (Before adding the nodes of a loaded tree.)
+        self.node_id_list = OrderedDict()
+        self.next_render_index = 0
+
+    def bring_top(self, node_id):  # Bring an object to the front of the rendering order.
+        self.node_id_list.move_to_end(node_id)
+        Objects.nodes[node_id].render_index = self.new_render_index()
+
+    def remove_object(self, node):  # Remove an object from the rendering list.
+        del self.node_id_list[node.node_id]
+        del Objects.nodes[node.node_id]
+        Objects.grid.remove(node.node_id)
+        Objects.edge_grid.remove(node.node_id)
+        Objects.ancestry.changed()
+
+    def add_object(self, node):  # Add an object to the rendering list.
+        node.render_index = self.new_render_index()
+        self.node_id_list[node.node_id] = None
+        Objects.nodes[node.node_id] = node
+        node.update_grid()
+
+
+
+# Prototype node object.
+class Node(object):
+    def __init__(self, text, pos, node_id):
+        self.super_node_id = None
+        self.sub_node_ids = []
+        self._text = text
+        self.label = None       # (TreeFile, offset, length) of a label that hasn't been read from the tree file yet.
+        self.x = pos[0]
+        self.y = pos[1]
+        self.w = 20
+        self.h = 20
+        self.ext_width = 100    # Dimensions of box after padding with text.
+        self.ext_height = 100
+        self.text_width = 0     # Text string dimensions.
+        self.text_height = 0
+        self.text_x = 0
+        self.text_y = 0
+        self.render_index = None             # Rendering order; higher is drawn on top. (Matches the order of main.node_id_list)
+        self.snapshot = None                 # Hash of this node's save in the snapshot store. (None: stored as its own file)
+        self.pending = None                  # What's being done with the node's save in the background. (Drawn greyed out)
+        self.node_id = node_id
+
+    @property
+    def text(self):  # Labels of opened trees are decoded from the tree file the first time they're needed.
+        if self.label is not None:
+            tree, offset, length = self.label
+            self._text = tree.string(offset, length)
+            self.label = None
+        return self._text
+
+    @text.setter
+    def text(self, text):
+        self._text = text
+        self.label = None
+
+    @classmethod
+    def from_record(cls, record):  # Node from a database row. (See record)
+        node_id, super_node_id, x, y, render_index, ext_width, ext_height, text, snapshot = record
+        node = cls(text, (x, y), node_id)
+        node.super_node_id = super_node_id
+        node.render_index = render_index
+        node.ext_width = ext_width
+        node.ext_height = ext_height
+        node.text_width = None  # Not measured yet. (See measure_nodes)
+        node.snapshot = snapshot
+        return node
+
+    def record(self):  # What's saved of a node. (Everything else is worked out again when it's loaded.)
+        return (self.node_id, self.super_node_id, self.x, self.y, self.render_index,
+                self.ext_width, self.ext_height, self.text, self.snapshot)
+
+    def layout(self):  # Size the box around the text. Only needed when the text or the font changes.
+        self.measure()
+        self.update_grid()
+
+    def measure(self):  # (layout without re-indexing the box, see measure_nodes)
+        self.text_x, self.text_y, self.text_width, self.text_height = Objects.layouts.text_extents(self.text)
+        pad_width = 6 #self.w - padding
+        pad_height = 4 #self.h - padding
+        if self.text_width > pad_width:
+            self.ext_width = self.w + (self.text_width - pad_width)
+        else:
+            self.ext_width = self.w
+        if self.text_height > pad_height:
+            self.ext_height = self.h + (self.text_height - pad_height)
+        else:
+            self.ext_height = self.h
+
+    def update_grid(self):  # Re-index this node's box and its edges after it moved or was resized.
+        Objects.grid.update(self.node_id, self.x, self.y, self.ext_width, self.ext_height)
+        self.update_edge()
+        for sub_node_id in self.sub_node_ids:
+            if sub_node_id in Objects.nodes:
+                Objects.nodes[sub_node_id].update_edge()
+
+    def update_edge(self):  # Re-index the edge from this node's supernode to it.
+        if self.super_node_id is None or self.super_node_id not in Objects.nodes:
+            Objects.edge_grid.remove(self.node_id)
+            return
+        Objects.edge_grid.update(*self.edge_box())
+
+    def edge_box(self):  # (node id, x, y, w, h) of the edge from this node's supernode to it.
+        x0, y0 = Objects.nodes[self.super_node_id].center()
+        x1, y1 = self.center()
+        return (self.node_id, min(x0, x1) - EDGE_PAD, min(y0, y1) - EDGE_PAD,
+                abs(x1 - x0) + 2 * EDGE_PAD, abs(y1 - y0) + 2 * EDGE_PAD)
+
+    def center(self):
+        return self.x + self.ext_width / 2, self.y + self.ext_height / 2
+
+    def region(self):  # Area painted by this node and the edges to its supernode and subnodes. (x, y, w, h)
+        x0, y0 = self.x, self.y
+        x1, y1 = self.x + self.ext_width, self.y + self.ext_height
+        linked_ids = list(self.sub_node_ids)
+        if self.super_node_id is not None:
+            linked_ids.append(self.super_node_id)
+        for node_id in linked_ids:
+            if node_id in Objects.nodes:
+                cx, cy = Objects.nodes[node_id].center()
+                x0, y0, x1, y1 = min(x0, cx), min(y0, cy), max(x1, cx), max(y1, cy)
+        return x0 - EDGE_PAD, y0 - EDGE_PAD, x1 - x0 + 2 * EDGE_PAD, y1 - y0 + 2 * EDGE_PAD
+
+    # Creates an edge from this node to a subnode; connecting the two. (The subnode is unlinked from any
+    # supernode it had. Doesn't check for cycles, see link.)
+    def add_subnode(self, node_id):
+        sub_node = Objects.nodes[node_id]
+        if node_id not in self.sub_node_ids:
+            unlink(node_id)
+            self.sub_node_ids.append(sub_node.node_id)
+            sub_node.super_node_id = self.node_id
+            sub_node.update_edge()
+            Objects.ancestry.changed()
+
+
+
+
+def tree_bounds():  # Width and height of the area from the canvas origin to the bottom right of every node.
+    w = h = 0
+    for node in Objects.nodes.values():
+        w = max(w, node.x + node.ext_width)
+        h = max(h, node.y + node.ext_height)
+    return w, h
+
+
+def node_boxes():  # Boxes of every node, for indexing them all at once.
+    return [(node.node_id, node.x, node.y, node.ext_width, node.ext_height) for node in Objects.nodes.values()]
+
+
+def edge_boxes():  # Boxes of every edge, for indexing them all at once. (Node.edge_box, inlined for big trees.)
+    nodes = Objects.nodes
+    boxes = []
+    for node in nodes.values():
+        super_node = nodes.get(node.super_node_id)
+        if super_node is not None:
+            x0, y0 = super_node.x + super_node.ext_width / 2, super_node.y + super_node.ext_height / 2
+            x1, y1 = node.x + node.ext_width / 2, node.y + node.ext_height / 2
+            boxes.append((node.node_id, min(x0, x1) - EDGE_PAD, min(y0, y1) - EDGE_PAD,
+                          abs(x1 - x0) + 2 * EDGE_PAD, abs(y1 - y0) + 2 * EDGE_PAD))
+    return boxes
+
+
+# Make a node a subnode of another. False if that would make a cycle. (Checked by following the supernodes up from
+# the new supernode, so linking costs the depth of the tree rather than rebuilding the ancestry after every change.)
+def measure_nodes(main):  # Size every box to its label (after opening a tree or changing the font), then re-index them.
+    with spatialindex.paused_gc():
+        for node_id in main.node_id_list:
+            Objects.nodes[node_id].measure()
+    Objects.grid.defer(node_boxes)
+    Objects.edge_grid.defer(edge_boxes)
+
+
+def link(super_node_id, node_id):
+    if node_id in Objects.ancestry.path_to_root(super_node_id):
+        return False
+    Objects.nodes[super_node_id].add_subnode(node_id)
+    return True
+
+
+def unlink(node_id):  # Remove the link from a node's supernode to it.
+    node = Objects.nodes[node_id]
+    if node.super_node_id is None:
+        return
+    super_node = Objects.nodes.get(node.super_node_id)
+    if super_node is not None and node_id in super_node.sub_node_ids:
+        super_node.sub_node_ids.remove(node_id)
+    node.super_node_id = None
+    node.update_edge()
+    Objects.ancestry.changed()
+
+
+def move_subtree(node_id, dx, dy):  # Move a node and everything below it. Returns the moved ids.
+    return move_nodes({sub_node_id: (Objects.nodes[sub_node_id].x + dx, Objects.nodes[sub_node_id].y + dy)
+                       for sub_node_id in Objects.ancestry.subtree(node_id)})
+
+
+def node_at(x, y):  # Topmost node whose box contains the point, or None.
+    hit_node_ids = Objects.grid.at(x, y)
+    if not hit_node_ids:
+        return None
+    return Objects.nodes[max(hit_node_ids, key=lambda node_id: Objects.nodes[node_id].render_index)]
+
+
+# Move nodes to {node id: (x, y)}. Returns the ids of the nodes that moved.
+# When most of the tree moved (a layout), the grids are built again from scratch the next time they're searched.
+# That's a lot cheaper than moving each node and edge in them.
+def move_nodes(positions):
+    nodes = Objects.nodes
+    moved = []
+    for node_id, (x, y) in positions.items():
+        node = nodes[node_id]
+        if node.x != x or node.y != y:
+            node.x, node.y = x, y
+            moved.append(node_id)
+    if len(moved) * 2 > len(nodes):
+        Objects.grid.defer(node_boxes)
+        Objects.edge_grid.defer(edge_boxes)
+        return moved
+    # Re-index the boxes, then each edge touching a moved node once. (update_grid would redo an edge for both ends)
+    edge_ids = set(moved)
+    for node_id in moved:
+        node = Objects.nodes[node_id]
+        Objects.grid.update(node_id, node.x, node.y, node.ext_width, node.ext_height)
+        edge_ids.update(node.sub_node_ids)
+    for node_id in edge_ids:
+        if node_id in Objects.nodes:
+            Objects.nodes[node_id].update_edge()
+    return moved
+
+
+def layout_tree(main):  # Lay out every node, trees side by side in the order they're in now. Returns the moved ids.
+    root_ids = [node_id for node_id in main.node_id_list if Objects.nodes[node_id].super_node_id is None]
+    root_ids.sort(key=lambda node_id: (Objects.nodes[node_id].x, Objects.nodes[node_id].y))
+    with spatialindex.paused_gc():
+        return move_nodes(treelayout.tidy_layout(Objects.nodes, root_ids, LAYOUT_MARGIN, LAYOUT_MARGIN))
+
+
+# Lay out the nodes below a node, which stays where it is. (Unless the subtree wouldn't fit left of it.)
+# Only the subtree is looked at, so it can end up overlapping the nodes around it. Returns the moved ids.
+def layout_subtree(node_id):
+    node = Objects.nodes[node_id]
+    positions = treelayout.tidy_layout(Objects.nodes, [node_id])
+    x, y = positions[node_id]
+    dx = max(node.x - x, LAYOUT_MARGIN - min(px for px, py in positions.values()))
+    dy = node.y - y
+    return move_nodes({sub_node_id: (px + dx, py + dy) for sub_node_id, (px, py) in positions.items()})
+
+
+def tree_for_source(source_filepath):  # New tree for a save file: <dir>/<name> SBR/<name>.sbr (Nothing is created yet.)
+    main = Main()
+    main.source_filepath = source_filepath
+    main.source_filename = os.path.split(source_filepath)[-1]
+    main.tree_filename = main.source_filename + '.sbr'
+    main.tree_dirpath = os.path.join(os.path.dirname(source_filepath), main.source_filename) + ' SBR'
+    main.tree_filepath = os.path.join(main.tree_dirpath, main.tree_filename)
+    return main
+
+
+def tree_settings(main):
+    settings = dict(main.__dict__)
+    del settings['node_id_list']
+    return settings
+
+
+def tree_state(main):  # Copy of the tree for writing: (Main's settings, node records in rendering order)
+    if main.storage == 'sqlite':
+        return tree_settings(main), []  # The tree file only says where the nodes are.
+    return tree_settings(main), [Objects.nodes[node_id].record() for node_id in main.node_id_list]
+
+
+# Rows to write to the tree's database: the changed and removed nodes, or all of them with replace=True.
+def tree_changes(main, changed_node_ids=(), removed_node_ids=(), replace=False):
+    if replace:
+        node_ids = main.node_id_list
+    else:
+        node_ids = [node_id for node_id in changed_node_ids if node_id in Objects.nodes]
+    nodes = {node_id: Objects.nodes[node_id].record() for node_id in node_ids}
+    if not replace:
+        for node_id in removed_node_ids:
+            nodes[node_id] = None
+    return treedb.TreeChanges(tree_settings(main), nodes, replace)
+
+
+def save_tree(main, changed_node_ids=(), removed_node_ids=()):  # Write the tree right away.
+    if main.storage == 'sqlite':
+        treedb.connect(treedb.db_path(main.tree_filepath)).apply(tree_changes(main, changed_node_ids, removed_node_ids))
+        if os.path.exists(main.tree_filepath):
+            return  # Only has the settings, which are in the database too.
+    persistence.write_atomic(main.tree_filepath, treefile.encode_tree(*tree_state(main)))
+
+
+# Open a tree file and make it the current tree. Returns (Main, converted).
+# Trees in the older pickle/JSON formats are converted (converted is True, their nodes still need laying out);
+# the original is kept as .bak and the tree is written in the current format on the next save.
+@spatialindex.paused_gc()  # (A node object per record, see paused_gc)
+def load_tree(filepath):
+    main = Main()
+    nodes = []
+    converted = False
+    keep_render_indices = False
+    if treefile.is_tree_file(filepath) and treefile.TreeFile(filepath).settings.get('storage') == 'sqlite':
+        settings = treefile.TreeFile(filepath).settings
+        database = treedb.connect(treedb.db_path(filepath))
+        settings.update(database.settings())
+        for record in database.nodes():
+            nodes.append(Node.from_record(record))
+        # Rows only get rewritten when their node changes, so the stored indices have to stay valid.
+        keep_render_indices = True
+    elif treefile.is_tree_file(filepath):
+        tree = treefile.TreeFile(filepath)
+        settings = tree.settings
+        for (node_id, super_node_id, x, y, render_index, ext_width, ext_height,
+             label_offset, label_length, snapshot_offset, snapshot_length) in tree.records():
+            node = Node(None, (x, y), node_id)
+            node.label = (tree, label_offset, label_length)
+            if super_node_id >= 0:
+                node.super_node_id = super_node_id
+            node.ext_width = ext_width
+            node.ext_height = ext_height
+            node.text_width = None  # Not measured yet. (See measure_nodes)
+            if snapshot_length:
+                node.snapshot = tree.string(snapshot_offset, snapshot_length)
+            nodes.append(node)
+    else:
+        settings, legacy_nodes = treefile.load_legacy(filepath)
+        for n in legacy_nodes:
+            node = Node(n.get('text', 'default'), (n.get('x', 0), n.get('y', 0)), n['node_id'])
+            node.super_node_id = n.get('super_node_id')
+            node.ext_width = n.get('ext_width', node.ext_width)
+            node.ext_height = n.get('ext_height', node.ext_height)
+            node.snapshot = n.get('snapshot')
+            nodes.append(node)
+        converted = True
+        if not os.path.exists(filepath + '.bak'):
+            shutil.copy2(filepath, filepath + '.bak')
+        print('Converted older tree file, original kept as ' + filepath + '.bak', file=sys.stderr)
+    for key, value in settings.items():
+        if key != 'node_id_list':
+            setattr(main, key, value)
+    main.clear_nodes()
+    Objects.clear()
+    for node in nodes:
+        Objects.nodes[node.node_id] = node
+    for node in nodes:  # Subnode lists from the supernode ids.
+        if node.super_node_id is not None:
+            if node.super_node_id in Objects.nodes:
+                Objects.nodes[node.super_node_id].sub_node_ids.append(node.node_id)
+            else:
+                node.super_node_id = None
+    # Add to the rendering list and index everything in one go.
+    if not keep_render_indices:
+        for render_index, node in enumerate(nodes):
+            node.render_index = render_index
+    main.node_id_list = OrderedDict.fromkeys(node.node_id for node in nodes)
+    if nodes:
+        main.next_render_index = max(node.render_index for node in nodes) + 1
+        main.next_node_id = max(main.node_id_list)
+    # Indexed when they're first searched, after measure_nodes has sized the boxes.
+    Objects.grid.defer(node_boxes)
+    Objects.edge_grid.defer(edge_boxes)
+    return main, converted
+
+
+def open_store(main):  # Snapshot store of a tree, with the nodes referencing each snapshot counted.
+    store = snapshotstore.SnapshotStore(main.tree_dirpath, getattr(main, 'compression', None))
+    store.recount(getattr(Objects.nodes[node_id], 'snapshot', None) for node_id in main.node_id_list)
+    return store
+
+
+def node_filepath(main, node_id):  # Save file of a node that isn't kept in the snapshot store.
+    return os.path.join(main.tree_dirpath, main.source_filename + '.' + str(node_id))
+
+
+def save_filepath(main, store, node):  # Where a node's save is kept.
+    if getattr(node, 'snapshot', None):
+        return store.stored_path(node.snapshot)
+    return node_filepath(main, node.node_id)
+
+
+# Copy a save file into the tree as a node's save. With the snapshot store on, it's stored as a delta of the
+# supernode's snapshot where that's worth it.
+def snapshot_source(main, store, node, srcpath):
+    if getattr(main, 'use_store', False):
+        super_node = Objects.nodes.get(node.super_node_id)
+        base = getattr(super_node, 'snapshot', None)
+        node.snapshot = store.put(srcpath, base, getattr(main, 'keyframe_interval', 0))
+        size, stored_size, seconds = store.last_put
+        print('Snapshot %d: %d -> %d bytes (%.1f%% saved) in %.3fs' %
+              (node.node_id, size, stored_size, 100.0 - 100.0 * stored_size / max(size, 1), seconds), file=sys.stderr)
+    else:
+        filecopy.copy_file(srcpath, node_filepath(main, node.node_id))
+
+
+def write_save(main, store, node, destpath):  # Write a node's save out. (Usually to the source file, to load it.)
+    if getattr(node, 'snapshot', None):
+        store.get(node.snapshot, destpath)
+        print('Snapshot %d: wrote %d bytes in %.3fs' % ((node.node_id,) + store.last_get), file=sys.stderr)
+    else:
+        filecopy.copy_file(node_filepath(main, node.node_id), destpath)
+
+
+def delete_save(main, store, node):  # Delete the save of a removed node.
+    if getattr(node, 'snapshot', None):
+        store.release(node.snapshot)  # Only deletes the blob if no other node shares it.
+    else:
+        os.remove(node_filepath(main, node.node_id))  # (Named after the source file, not the tree file.)
+
+
+# Nodes taken out of the tree together, with what's needed to put them back: the nodes themselves (still linked
+# to each other) and their links to the nodes that stayed. Their saves are moved to the trash (trash_saves) and only
+# deleted when the removal is reclaimed, so it can be undone until then.
+class Removal(object):
+    def __init__(self, nodes, super_links, sub_links):
+        self.nodes = nodes              # In rendering order.
+        self.super_links = super_links  # (supernode id, node id) of removed nodes that were below nodes that stayed.
+        self.sub_links = sub_links      # (removed node id, node id) of nodes that stayed, unlinked from removed ones.
+        self.trash_dirpath = None       # Set once the saves are in the trash.
+
+    def node_ids(self):
+        return [node.node_id for node in self.nodes]
+
+    def linked_ids(self):  # Nodes that stayed but had their links changed.
+        return [super_node_id for super_node_id, node_id in self.super_links] + \
+               [node_id for super_node_id, node_id in self.sub_links]
+
+
+trash_ids = itertools.count(1)
+
+
+# Remove nodes in one go: links to the rest of the tree are cut, the rest of the tree is left as it is. (Subnodes of
+# removed nodes become roots. Pass a whole subtree to remove it.) Returns a Removal, nothing is deleted yet.
+def remove_nodes(main, node_ids):
+    removed = set(node_id for node_id in node_ids if node_id in Objects.nodes)
+    nodes = sorted((Objects.nodes[node_id] for node_id in removed), key=lambda node: node.render_index)
+    super_links = []
+    sub_links = []
+    for node in nodes:
+        if node.super_node_id is not None and node.super_node_id not in removed:
+            super_links.append((node.super_node_id, node.node_id))
+            unlink(node.node_id)
+        for sub_node_id in list(node.sub_node_ids):
+            if sub_node_id not in removed:
+                sub_links.append((node.node_id, sub_node_id))
+                unlink(sub_node_id)
+    for node in nodes:
+        main.remove_object(node)
+    return Removal(nodes, super_links, sub_links)
+
+
+def remove_subtrees(main, node_ids):  # Remove nodes and everything below them.
+    removed = {}
+    for node_id in node_ids:
+        if node_id in Objects.nodes:
+            removed.update(dict.fromkeys(Objects.ancestry.subtree(node_id)))
+    return remove_nodes(main, removed)
+
+
+# Undo remove_nodes. Links to nodes that are gone by now (or would make a cycle) aren't.
+# Each link puts a root below a node, which only makes a cycle if that node is in the root's own tree by then. So the
+# trees are looked up once and joined as links are made, instead of checking every link against the whole tree.
+def restore_nodes(main, removal):
+    for node in removal.nodes:
+        main.add_object(node)
+    Objects.ancestry.changed()
+    roots = Objects.ancestry.roots()
+    joined = {}  # Root id -> root of the tree it was linked into.
+
+    def tree_of(node_id):
+        root_id = roots.get(node_id, node_id)  # (Nodes below a cycle can't be in a root's tree.)
+        while root_id in joined:
+            root_id = joined[root_id]
+        return root_id
+
+    for super_node_id, node_id in removal.super_links + removal.sub_links:
+        if super_node_id in Objects.nodes and node_id in Objects.nodes and Objects.nodes[node_id].super_node_id is None:
+            root_id = tree_of(super_node_id)
+            if root_id == tree_of(node_id):
+                continue
+            Objects.nodes[super_node_id].add_subnode(node_id)
+            joined[node_id] = root_id
+    Objects.ancestry.changed()
+
+
+# Move the saves of removed nodes into a directory of their own in the trash. (Snapshots in the store stay where
+# they are; they're still referenced until the removal is reclaimed.)
+def trash_saves(main, store, removal):
+    trash_dirpath = os.path.join(main.tree_dirpath, TRASH_DIRNAME, '%d.%d' % (os.getpid(), next(trash_ids)))
+    os.makedirs(trash_dirpath)
+    for node in removal.nodes:
+        if not getattr(node, 'snapshot', None):
+            nodefilepath = node_filepath(main, node.node_id)
+            if os.path.exists(nodefilepath):
+                os.replace(nodefilepath, os.path.join(trash_dirpath, os.path.basename(nodefilepath)))
+    removal.trash_dirpath = trash_dirpath
+
+
+def untrash_saves(main, store, removal):  # Put the saves back for restore_nodes. False if they're gone from the trash.
+    if removal.trash_dirpath is None:
+        return True
+    if not os.path.isdir(removal.trash_dirpath):  # Emptied by something else in the meantime.
+        removal.trash_dirpath = None
+        return False
+    for filename in os.listdir(removal.trash_dirpath):
+        os.replace(os.path.join(removal.trash_dirpath, filename), os.path.join(main.tree_dirpath, filename))
+    os.rmdir(removal.trash_dirpath)
+    removal.trash_dirpath = None
+    return True
+
+
+def reclaim_saves(main, store, removal):  # Delete the saves of a removal for good.
+    for node in removal.nodes:
+        if getattr(node, 'snapshot', None):
+            store.release(node.snapshot)  # Only deletes the blob if no other node shares it.
+    if removal.trash_dirpath is not None:
+        shutil.rmtree(removal.trash_dirpath, ignore_errors=True)
+        removal.trash_dirpath = None
+
+
+# Delete the removals left in the trash by processes that have quit without reclaiming them. Removals of processes
+# that are still running are theirs to undo or reclaim, and files moved there by verify --repair are kept.
+def empty_trash(main):
+    trash_dirpath = os.path.join(main.tree_dirpath, TRASH_DIRNAME)
+    if not os.path.isdir(trash_dirpath):
+        return
+    for entry in os.scandir(trash_dirpath):
+        match = re.match(r'(\d+)\.\d+$', entry.name)  # <pid>.<number>, see trash_saves.
+        if match and entry.is_dir() and not process_running(int(match.group(1))):
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def process_running(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # Someone else's.
+        return True
+    return True
+
+
+def new_node_position(super_node_id=None):  # Below a supernode, next to its other subnodes, or below the whole tree.
+    if super_node_id is not None:
+        super_node = Objects.nodes[super_node_id]
+        return super_node.x + 40 * len(super_node.sub_node_ids), super_node.y + super_node.ext_height + 40
+    bottom = max([node.y + node.ext_height for node in Objects.nodes.values()] or [0])
+    return 20, bottom + 40
+
+
+def add_node(main, text, pos, super_node_id=None):  # New node, linked to a supernode if given.
+    node = Node(text, pos, main.new_node_id())
+    main.add_object(node)
+    if super_node_id is not None:
+        Objects.nodes[super_node_id].add_subnode(node.node_id)  # (A new node can't make a cycle.)
+    return node
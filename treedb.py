@@ -0,0 +1,84 @@
+import json, os, sqlite3, threading
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS nodes (
+    node_id INTEGER PRIMARY KEY,
+    super_node_id INTEGER,
+    x REAL NOT NULL,
+    y REAL NOT NULL,
+    render_index INTEGER NOT NULL,
+    ext_width REAL NOT NULL,
+    ext_height REAL NOT NULL,
+    text TEXT NOT NULL,
+    snapshot TEXT
+);
+CREATE INDEX IF NOT EXISTS nodes_super_node_id ON nodes (super_node_id);
+CREATE INDEX IF NOT EXISTS nodes_position ON nodes (x, y);
+"""
+
+
+def db_path(tree_filepath):  # The database sits next to the tree file in the SBR directory.
+    return os.path.splitext(tree_filepath)[0] + '.sqlite'
+
+
+# Changes to write to a tree database in one transaction.
+# nodes: node id -> (node id, supernode id, x, y, render index, box width, box height, label, snapshot), or None if removed.
+# With replace=True the database is emptied first. (Moving a whole tree into it.)
+class TreeChanges(object):
+    def __init__(self, settings=None, nodes=None, replace=False):
+        self.settings = settings or {}
+        self.nodes = nodes or {}
+        self.replace = replace
+
+    def merge(self, newer):  # Changes made after these, combined into one batch.
+        if newer.replace:
+            return newer
+        self.settings.update(newer.settings)
+        self.nodes.update(newer.nodes)
+        return self
+
+
+# Tree stored in SQLite: tree settings as JSON values by name, one row per node with the edge to its supernode.
+# Connections are shared by path (see connect) and only used by one thread at a time.
+class TreeDB(object):
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.connection = sqlite3.connect(filepath, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')  # Durable at checkpoints, commits don't wait on fsync.
+        self.connection.executescript(SCHEMA)
+
+    def settings(self):
+        return {key: json.loads(value) for key, value in self.connection.execute('SELECT key, value FROM settings')}
+
+    def nodes(self):  # Node rows in rendering order.
+        return self.connection.execute('SELECT node_id, super_node_id, x, y, render_index, ext_width, ext_height, '
+                                       'text, snapshot FROM nodes ORDER BY render_index')
+
+    def apply(self, changes):
+        with self.connection:  # One transaction.
+            if changes.replace:
+                self.connection.execute('DELETE FROM settings')
+                self.connection.execute('DELETE FROM nodes')
+            self.connection.executemany('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)',
+                                        [(key, json.dumps(value)) for key, value in changes.settings.items()])
+            self.connection.executemany('INSERT OR REPLACE INTO nodes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                        [row for row in changes.nodes.values() if row is not None])
+            self.connection.executemany('DELETE FROM nodes WHERE node_id = ?',
+                                        [(node_id,) for node_id, row in changes.nodes.items() if row is None])
+
+    def close(self):
+        self.connection.close()
+
+
+databases = {}
+databases_lock = threading.Lock()
+
+
+def connect(filepath):  # Shared TreeDB for a database file.
+    with databases_lock:
+        if filepath not in databases:
+            databases[filepath] = TreeDB(filepath)
+        return databases[filepath]
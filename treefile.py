@@ -0,0 +1,107 @@
+import json, mmap, pickle, struct, sys
+
+
+# .sbr tree file layout (little-endian):
+#   header | tree settings (JSON) | node table (fixed-width records) | string table (UTF-8 labels, snapshot hashes)
+# Nodes are stored in rendering order. Records point into the string table, so opening a tree only unpacks the
+# node table; labels are decoded the first time they're needed.
+MAGIC = b'SBRT'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIIQ')  # Magic, version, reserved, node count, settings length, string table length.
+# Node id, supernode id (-1: none), x, y, render index, box width, box height,
+# label offset/length, snapshot offset/length (length 0: no snapshot).
+NODE = struct.Struct('<qqddqffIIII')
+
+
+def is_tree_file(filepath):  # False for the older pickle/JSON .sbr files.
+    with open(filepath, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+# nodes: (node id, supernode id or None, x, y, render index, box width, box height, label, snapshot or None)
+def encode_tree(settings, nodes):
+    settings_data = json.dumps(settings).encode('utf-8')
+    strings = bytearray()
+    table = bytearray()
+    for node_id, super_node_id, x, y, render_index, ext_width, ext_height, text, snapshot in nodes:
+        label = text.encode('utf-8')
+        label_offset = len(strings)
+        strings += label
+        snapshot_data = snapshot.encode('ascii') if snapshot else b''
+        snapshot_offset = len(strings)
+        strings += snapshot_data
+        table += NODE.pack(node_id, -1 if super_node_id is None else super_node_id, x, y, render_index,
+                           ext_width, ext_height, label_offset, len(label), snapshot_offset, len(snapshot_data))
+    header = HEADER.pack(MAGIC, VERSION, 0, len(nodes), len(settings_data), len(strings))
+    return b''.join((header, settings_data, bytes(table), bytes(strings)))
+
+
+# A tree file opened for reading. The file stays memory-mapped so labels can be read from it later.
+class TreeFile(object):
+    def __init__(self, filepath):
+        with open(filepath, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, reserved, self.node_count, settings_length, strings_length = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a SaveBrancher tree file: " + filepath)
+        if version > VERSION:
+            raise ValueError("Tree file is from a newer SaveBrancher (format version %d): %s" % (version, filepath))
+        offset = HEADER.size
+        self.settings = json.loads(self.map[offset:offset + settings_length].decode('utf-8'))
+        self.table_offset = offset + settings_length
+        self.strings_offset = self.table_offset + self.node_count * NODE.size
+
+    def records(self):  # Raw node records in rendering order. (See NODE.)
+        return NODE.iter_unpack(memoryview(self.map)[self.table_offset:self.strings_offset])
+
+    def string(self, offset, length):
+        start = self.strings_offset + offset
+        return self.map[start:start + length].decode('utf-8')
+
+
+# Stand-in for the classes found in pickled tree files, so they load without the code that wrote them.
+class LegacyObject(object):
+    def __setstate__(self, state):
+        if isinstance(state, tuple):  # (dict, slots)
+            state = state[0] or {}
+        self.__dict__.update(state)
+
+
+class LegacyUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if module in ('builtins', '__builtin__', 'collections', 'copyreg', 'copy_reg'):
+            return pickle.Unpickler.find_class(self, module, name)
+        return LegacyObject
+
+
+# Read a tree written before the tree file format: a pickled Main (either the first SaveBrancher's, or one
+# without its nodes) or the JSON list of Main's attributes followed by each node's.
+# Returns (settings, nodes) with nodes as attribute dicts in rendering order.
+def load_legacy(filepath):
+    with open(filepath, 'rb') as sbrfile:
+        try:
+            oldmain = LegacyUnpickler(sbrfile, encoding='latin1').load()
+        except (pickle.UnpicklingError, EOFError, ValueError):
+            sbrfile.seek(0)
+            m = json.loads(sbrfile.read().decode('utf-8'))
+            return dict(m[0]), [dict(n) for n in m[1:]]
+    settings = {}
+    for key in ('drawarea_size', 'drawarea_extra', 'window_size', 'source_filepath', 'source_filename',
+                'tree_filename', 'tree_dirpath', 'tree_filepath', 'use_store', 'keyframe_interval', 'compression'):
+        if hasattr(oldmain, key):
+            settings[key] = getattr(oldmain, key)
+    nodes = []
+    if hasattr(oldmain, 'obj_list'):
+        print('Loading old-style SaveBrancher file.', file=sys.stderr)
+        settings['next_node_id'] = oldmain.next_obj_id
+        for node in oldmain.obj_list:
+            # Old edges aren't converted.
+            nodes.append({'node_id': node.obj_id, 'text': node.text, 'x': node.x, 'y': node.y,
+                          'ext_width': node.ext_width, 'ext_height': node.ext_height})
+    else:
+        # Saved without its nodes: their save files are still there, so bring them back as a grid of placeholders.
+        settings['next_node_id'] = oldmain.next_node_id
+        for i, node_id in enumerate(oldmain.node_id_list):
+            nodes.append({'node_id': node_id, 'text': 'Save %d' % node_id,
+                          'x': 20 + (i % 10) * 120, 'y': 20 + (i // 10) * 60})
+    return settings, nodes
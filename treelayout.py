@@ -0,0 +1,143 @@
+# Automatic tree layout: subnodes in a row below their supernode, each supernode centered over its subnodes,
+# subtrees packed as close as SIBLING_GAP allows without overlapping. (Walker's tidy tree algorithm, in the
+# linear time version by Buchheim, Jünger and Leipert.) Nodes keep their box sizes (ext_width/ext_height);
+# each level is as high as its highest node. Everything is done with loops instead of recursion, so long chains
+# of saves don't hit Python's recursion limit.
+
+SIBLING_GAP = 20  # Space between neighbouring nodes in a level.
+LEVEL_GAP = 40    # Space between levels.
+
+
+# Positions for the trees under root_ids, side by side in that order, with the layout's top left corner at (x, y).
+# nodes maps node ids to nodes. Returns {node id: (x, y)} for every node in the trees.
+def tidy_layout(nodes, root_ids, x=0, y=0, sibling_gap=SIBLING_GAP, level_gap=LEVEL_GAP):
+    # Nodes by index in breadth-first order, so subnodes always come after their supernode.
+    # Index 0 is an extra root above the given ones, which makes a forest a single tree.
+    order = [None]
+    parent = [-1]
+    children = []
+    seen = set()  # (Guards against a node being listed twice.)
+    pending = root_ids
+    v = 0
+    while True:
+        subs = []
+        for node_id in pending:
+            if node_id not in seen and node_id in nodes:
+                seen.add(node_id)
+                subs.append(len(order))
+                order.append(node_id)
+        parent.extend([v] * len(subs))
+        children.append(subs)
+        v += 1
+        if v == len(order):
+            break
+        pending = nodes[order[v]].sub_node_ids
+    n = len(order)
+    boxes = [None] + [nodes[node_id] for node_id in order[1:]]
+    width = [0] + [node.ext_width for node in boxes[1:]]
+    number = [0] * n  # Position among its siblings.
+    for subs in children:
+        for k, w in enumerate(subs):
+            number[w] = k
+    depth = [-1] * n
+    for v in range(1, n):
+        depth[v] = depth[parent[v]] + 1
+
+    prelim = [0.0] * n    # x of each node's center relative to its supernode's subtree.
+    mod = [0.0] * n       # Added to the whole subtree below a node.
+    shift = [0.0] * n     # Moves of subtrees, spread over their siblings by execute_shifts.
+    change = [0.0] * n
+    thread = [-1] * n     # Next node on the outline of a subtree, for leaves.
+    ancestor = list(range(n))
+    midpoint = [0.0] * n  # Center between a node's first and last subnode.
+
+    def move_subtree(wl, wr, distance):
+        subtrees = number[wr] - number[wl]
+        change[wr] -= distance / subtrees
+        shift[wr] += distance
+        change[wl] += distance / subtrees
+        prelim[wr] += distance
+        mod[wr] += distance
+
+    # Push the subtree of v right until it clears the subtrees of its left siblings, level by level along their
+    # facing outlines. Returns the default ancestor for the next sibling.
+    def apportion(v, default_ancestor):
+        siblings = children[parent[v]]
+        vir = vor = v
+        vil = siblings[number[v] - 1]
+        vol = siblings[0]
+        sir, sor, sil, sol = mod[vir], mod[vor], mod[vil], mod[vol]
+        while True:
+            next_vil = children[vil][-1] if children[vil] else thread[vil]
+            next_vir = children[vir][0] if children[vir] else thread[vir]
+            if next_vil < 0 or next_vir < 0:
+                break
+            vil, vir = next_vil, next_vir
+            vol = children[vol][0] if children[vol] else thread[vol]
+            vor = children[vor][-1] if children[vor] else thread[vor]
+            ancestor[vor] = v
+            distance = (prelim[vil] + sil) - (prelim[vir] + sir) + (width[vil] + width[vir]) / 2 + sibling_gap
+            if distance > 0:
+                a = ancestor[vil]
+                move_subtree(a if parent[a] == parent[v] else default_ancestor, v, distance)
+                sir += distance
+                sor += distance
+            sil += mod[vil]
+            sir += mod[vir]
+            sol += mod[vol]
+            sor += mod[vor]
+        next_vil = children[vil][-1] if children[vil] else thread[vil]
+        next_vir = children[vir][0] if children[vir] else thread[vir]
+        if next_vil >= 0 and not children[vor] and thread[vor] < 0:
+            thread[vor] = next_vil
+            mod[vor] += sil - sor
+        if next_vir >= 0 and not children[vol] and thread[vol] < 0:
+            thread[vol] = next_vir
+            mod[vol] += sir - sol
+            default_ancestor = v
+        return default_ancestor
+
+    # Bottom up: place each node's subnodes next to each other, then center it over them.
+    for v in range(n - 1, -1, -1):
+        subs = children[v]
+        if not subs:
+            continue
+        default_ancestor = subs[0]
+        for k, w in enumerate(subs):
+            if k:
+                left = subs[k - 1]
+                prelim[w] = prelim[left] + (width[left] + width[w]) / 2 + sibling_gap
+                if children[w]:
+                    mod[w] = prelim[w] - midpoint[w]
+                default_ancestor = apportion(w, default_ancestor)
+            else:
+                prelim[w] = midpoint[w]
+        moved = moved_change = 0.0
+        for w in reversed(subs):
+            prelim[w] += moved
+            mod[w] += moved
+            moved_change += change[w]
+            moved += shift[w] + moved_change
+        midpoint[v] = (prelim[subs[0]] + prelim[subs[-1]]) / 2
+
+    # Top down: add up the modifiers of the supernodes, and stack the levels.
+    level_heights = []
+    for v in range(1, n):
+        height = boxes[v].ext_height
+        if depth[v] == len(level_heights):
+            level_heights.append(height)
+        elif height > level_heights[depth[v]]:
+            level_heights[depth[v]] = height
+    level_y = []
+    top = y
+    for height in level_heights:
+        level_y.append(top)
+        top += height + level_gap
+    offset = [0.0] * n  # Sum of the modifiers above each node.
+    left = []
+    for v in range(1, n):
+        p = parent[v]
+        offset[v] = offset[p] + mod[p]
+        left.append(prelim[v] + offset[v] - width[v] / 2)
+    dx = x - min(left) if left else 0
+    return dict(zip(order[1:], zip([lx + dx for lx in left], [level_y[d] for d in depth[1:]])))